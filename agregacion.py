@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+from operator import itemgetter
+
+def indices_columnas(headers, nombres):
+    """
+    Devuelve {nombre: índice} buscando cada nombre en los encabezados sin
+    distinguir mayúsculas/minúsculas. Los nombres que no aparecen no se incluyen.
+    """
+    headers_lower = [h.strip().lower() if isinstance(h, str) else "" for h in headers]
+    indices = {}
+    for nombre in nombres:
+        if nombre.lower() in headers_lower:
+            indices[nombre] = headers_lower.index(nombre.lower())
+    return indices
+
+def agregar_filas(filas, agrupaciones, valores_vacios=None):
+    """
+    Calcula varios conteos group-by recorriendo las filas una sola vez.
+
+    - agrupaciones: {nombre: (índice_columna, ...)} con las columnas de cada agrupación.
+    - valores_vacios: {índice_columna: texto} que reemplaza las celdas vacías (ej: "Sin Familia").
+
+    Una fila cuenta para una agrupación solo si tiene todas sus columnas.
+    Devuelve {nombre: Counter} donde cada clave del Counter es la tupla de valores.
+
+    En la pasada se cuenta cada combinación de las columnas usadas (son muchas menos
+    que las filas, y el conteo lo hace Counter en C); después cada agrupación se
+    arma a partir de esas combinaciones. 'filas' puede ser cualquier iterable.
+    """
+    valores_vacios = valores_vacios or {}
+    columnas_usadas = sorted({c for columnas in agrupaciones.values() for c in columnas})
+    if not columnas_usadas:
+        return {nombre: Counter() for nombre in agrupaciones}
+    maxima = columnas_usadas[-1]
+    extraer = itemgetter(*columnas_usadas, maxima)  # siempre devuelve una tupla
+    # A las filas cortas se les agregan None al final: marcan las columnas que no tienen
+    relleno = [None] * (maxima + 1)
+
+    def combinacion(fila):
+        return extraer(fila) if len(fila) > maxima else extraer(fila + relleno)
+
+    combinaciones = Counter(map(combinacion, filas))
+
+    posicion = {c: i for i, c in enumerate(columnas_usadas)}
+    resultado = {}
+    for nombre, columnas in agrupaciones.items():
+        contador = Counter()
+        posiciones = [(posicion[c], valores_vacios.get(c, "")) for c in columnas]
+        for clave, cantidad in combinaciones.items():
+            valores = [clave[p] for p, _ in posiciones]
+            if None in valores:
+                continue
+            contador[tuple(v or vacio for v, (_, vacio) in zip(valores, posiciones))] += cantidad
+        resultado[nombre] = contador
+    return resultado
+
+def top_n(contador, n=5):
+    """Top N de un conteo de una sola columna como lista de (valor, cantidad)."""
+    return [(clave[0] if isinstance(clave, tuple) and len(clave) == 1 else clave, cantidad)
+            for clave, cantidad in contador.most_common(n)]
+
+def top_n_por_grupo(contador_pares, grupos, n=5):
+    """
+    A partir de un conteo de pares (grupo, valor) devuelve {grupo: [(valor, cantidad), ...]}
+    con los N valores más frecuentes de cada uno de los 'grupos' pedidos, en ese orden.
+    """
+    por_grupo = {grupo: Counter() for grupo in grupos}
+    for (grupo, valor), cantidad in contador_pares.items():
+        if grupo in por_grupo:
+            por_grupo[grupo][valor] = cantidad
+    return {grupo: contador.most_common(n) for grupo, contador in por_grupo.items()}
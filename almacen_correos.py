@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from hilos_correos import normalizar_id, referencias_correo
+from metricas import metricas
+
+# Rangos de fechas con hasta esta cantidad de correos se filtran con LIKE en lugar del índice de texto
+MAX_CORREOS_RANGO_SIN_INDICE = 5000
+
+class AlmacenCorreos:
+    """
+    Almacén local (SQLite) de la información extraída de cada correo.
+
+    Cada correo se guarda con la clave (carpeta, UIDVALIDITY, UID), que en IMAP
+    identifica un mensaje de forma inmutable. Si el servidor cambia el
+    UIDVALIDITY de una carpeta, lo guardado para esa carpeta deja de ser válido.
+    'version_datos' permite invalidar lo guardado cuando cambia el formato de extracción.
+
+    Además mantiene un índice de texto completo (FTS5) sobre asunto, remitente y
+    cuerpo para poder buscar sin depender del SEARCH del servidor. Si SQLite trae
+    el tokenizador 'trigram' se usa para permitir coincidencias parciales de palabras.
+
+    Para armar hilos guarda también, por correo, los Message-ID a los que responde
+    (References / In-Reply-To), indexados para encontrar todas las respuestas de un mensaje.
+    """
+
+    def __init__(self, ruta='correos.db', version_datos=1):
+        self.ruta = ruta
+        self.version_datos = version_datos
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.row_factory = sqlite3.Row
+        with self._lock, self._conexion:
+            if ruta != ':memory:':
+                self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.executescript("""
+                CREATE TABLE IF NOT EXISTS mensajes (
+                    carpeta TEXT NOT NULL,
+                    uidvalidity INTEGER NOT NULL,
+                    uid INTEGER NOT NULL,
+                    version INTEGER NOT NULL,
+                    fecha TEXT,
+                    dia TEXT,
+                    asunto TEXT,
+                    message_id TEXT,
+                    datos TEXT NOT NULL,
+                    PRIMARY KEY (carpeta, uidvalidity, uid)
+                );
+                CREATE TABLE IF NOT EXISTS resumenes_hilo (
+                    clave TEXT PRIMARY KEY,
+                    carpeta TEXT NOT NULL,
+                    uidvalidity INTEGER NOT NULL,
+                    uid_max INTEGER NOT NULL,
+                    cantidad INTEGER NOT NULL,
+                    resumen TEXT NOT NULL,
+                    actualizado REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_mensajes_message_id ON mensajes (carpeta, uidvalidity, message_id);
+                CREATE TABLE IF NOT EXISTS referencias (
+                    carpeta TEXT NOT NULL,
+                    uidvalidity INTEGER NOT NULL,
+                    uid INTEGER NOT NULL,
+                    referencia TEXT NOT NULL,
+                    PRIMARY KEY (carpeta, uidvalidity, uid, referencia)
+                );
+                CREATE INDEX IF NOT EXISTS idx_referencias ON referencias (carpeta, uidvalidity, referencia);
+                CREATE TABLE IF NOT EXISTS estado_carpetas (
+                    carpeta TEXT PRIMARY KEY,
+                    uidvalidity INTEGER NOT NULL,
+                    uidnext INTEGER NOT NULL,
+                    actualizado REAL NOT NULL
+                );
+            """)
+            columnas = {fila['name'] for fila in self._conexion.execute("PRAGMA table_info(mensajes)")}
+            if 'dia' not in columnas:
+                # Bases creadas antes de existir la columna del día: se completa con lo ya guardado
+                self._conexion.execute("ALTER TABLE mensajes ADD COLUMN dia TEXT")
+                self._conexion.execute("UPDATE mensajes SET dia = substr(fecha, 1, 10)")
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_mensajes_dia ON mensajes (carpeta, version, dia)")
+            sin_referencias = self._conexion.execute("SELECT NOT EXISTS (SELECT 1 FROM referencias)").fetchone()[0]
+            if sin_referencias:
+                # Bases creadas antes de existir el índice de hilos: se arma con lo ya guardado
+                filas = self._conexion.execute("SELECT carpeta, uidvalidity, datos FROM mensajes").fetchall()
+                self._conexion.executemany(
+                    "INSERT OR IGNORE INTO referencias (carpeta, uidvalidity, uid, referencia) VALUES (?, ?, ?, ?)",
+                    [fila for f in filas for fila in _filas_referencias(f['carpeta'], f['uidvalidity'], json.loads(f['datos']))]
+                )
+        self.tokenizador_fts = self._crear_indice_texto()
+
+    def _crear_indice_texto(self):
+        """Crea la tabla FTS5 si SQLite la soporta. Devuelve el tokenizador usado o None."""
+        for tokenizador in ('trigram', 'unicode61 remove_diacritics 2'):
+            try:
+                with self._lock, self._conexion:
+                    self._conexion.execute(f"""
+                        CREATE VIRTUAL TABLE IF NOT EXISTS mensajes_fts USING fts5(
+                            asunto, remitente, cuerpo,
+                            tokenize = '{tokenizador}'
+                        )
+                    """)
+                    fila = self._conexion.execute(
+                        "SELECT sql FROM sqlite_master WHERE name = 'mensajes_fts'"
+                    ).fetchone()
+                    sin_indexar = self._conexion.execute("SELECT NOT EXISTS (SELECT 1 FROM mensajes_fts)").fetchone()[0]
+                    if sin_indexar:
+                        # Bases creadas antes de existir el índice: se indexa lo ya guardado
+                        filas = self._conexion.execute("SELECT rowid, datos FROM mensajes").fetchall()
+                        self._conexion.executemany(
+                            "INSERT INTO mensajes_fts (rowid, asunto, remitente, cuerpo) VALUES (?, ?, ?, ?)",
+                            [_fila_fts(f['rowid'], json.loads(f['datos'])) for f in filas]
+                        )
+                return 'trigram' if 'trigram' in fila['sql'] else 'unicode61'
+            except sqlite3.OperationalError as e:
+                print(f"Índice de texto con tokenizador '{tokenizador}' no disponible: {e}")
+        return None
+
+    def obtener(self, carpeta, uidvalidity, uids):
+        """Devuelve {uid: datos} con los correos de 'uids' que ya están guardados."""
+        uids = [int(uid) for uid in uids]
+        encontrados = {}
+        with self._lock:
+            # SQLite limita la cantidad de parámetros por consulta
+            for inicio in range(0, len(uids), 500):
+                lote = uids[inicio:inicio + 500]
+                marcadores = ",".join("?" * len(lote))
+                filas = self._conexion.execute(
+                    f"SELECT uid, datos FROM mensajes WHERE carpeta = ? AND uidvalidity = ? AND version = ? AND uid IN ({marcadores})",
+                    [carpeta, uidvalidity, self.version_datos, *lote]
+                ).fetchall()
+                for fila in filas:
+                    encontrados[fila['uid']] = json.loads(fila['datos'])
+        metricas.incrementar('cache_consultas_total', len(encontrados), cache='almacen_correos', resultado='acierto')
+        metricas.incrementar('cache_consultas_total', len(uids) - len(encontrados), cache='almacen_correos', resultado='fallo')
+        return encontrados
+
+    def guardar(self, carpeta, uidvalidity, lista_datos):
+        """Guarda (o reemplaza) los diccionarios producidos por extraer_informacion_correo."""
+        filas = [
+            (carpeta, uidvalidity, int(datos['uid']), self.version_datos, datos.get('fecha', ''),
+             (datos.get('fecha') or '')[:10], datos.get('asunto', ''), normalizar_id(datos.get('message_id')) or '', json.dumps(datos, ensure_ascii=False))
+            for datos in lista_datos
+        ]
+        if not filas:
+            return
+        # La fila del índice de texto usa el mismo rowid que la fila en 'mensajes'
+        sql_rowid = "SELECT rowid FROM mensajes WHERE carpeta = ? AND uidvalidity = ? AND uid = ?"
+        with self._lock, self._conexion:
+            if self.tokenizador_fts:
+                for fila in filas:
+                    anterior = self._conexion.execute(sql_rowid, fila[:3]).fetchone()
+                    if anterior:
+                        self._conexion.execute("DELETE FROM mensajes_fts WHERE rowid = ?", (anterior[0],))
+            self._conexion.executemany(
+                "INSERT OR REPLACE INTO mensajes (carpeta, uidvalidity, uid, version, fecha, dia, asunto, message_id, datos) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                filas
+            )
+            self._conexion.executemany(
+                "DELETE FROM referencias WHERE carpeta = ? AND uidvalidity = ? AND uid = ?", [fila[:3] for fila in filas]
+            )
+            self._conexion.executemany(
+                "INSERT OR IGNORE INTO referencias (carpeta, uidvalidity, uid, referencia) VALUES (?, ?, ?, ?)",
+                [fila for datos in lista_datos for fila in _filas_referencias(carpeta, uidvalidity, datos)]
+            )
+            if self.tokenizador_fts:
+                self._conexion.executemany(
+                    "INSERT INTO mensajes_fts (rowid, asunto, remitente, cuerpo) VALUES (?, ?, ?, ?)",
+                    [_fila_fts(self._conexion.execute(sql_rowid, fila[:3]).fetchone()[0], datos)
+                     for fila, datos in zip(filas, lista_datos)]
+                )
+
+    def estado(self, carpeta):
+        """Devuelve (uidvalidity, uidnext) de la última sincronización de la carpeta, o (None, None)."""
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT uidvalidity, uidnext FROM estado_carpetas WHERE carpeta = ?", (carpeta,)
+            ).fetchone()
+        return (fila['uidvalidity'], fila['uidnext']) if fila else (None, None)
+
+    def actualizar_estado(self, carpeta, uidvalidity, uidnext):
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO estado_carpetas (carpeta, uidvalidity, uidnext, actualizado) VALUES (?, ?, ?, ?)",
+                (carpeta, uidvalidity, uidnext, time.time())
+            )
+
+    def invalidar(self, carpeta, uidvalidity_vigente):
+        """Borra lo guardado de la carpeta con un UIDVALIDITY distinto al vigente."""
+        with self._lock, self._conexion:
+            if self.tokenizador_fts:
+                self._conexion.execute(
+                    "DELETE FROM mensajes_fts WHERE rowid IN (SELECT rowid FROM mensajes WHERE carpeta = ? AND uidvalidity != ?)",
+                    (carpeta, uidvalidity_vigente)
+                )
+            borrados = self._conexion.execute(
+                "DELETE FROM mensajes WHERE carpeta = ? AND uidvalidity != ?", (carpeta, uidvalidity_vigente)
+            ).rowcount
+            self._conexion.execute(
+                "DELETE FROM referencias WHERE carpeta = ? AND uidvalidity != ?", (carpeta, uidvalidity_vigente)
+            )
+            self._conexion.execute(
+                "DELETE FROM estado_carpetas WHERE carpeta = ? AND uidvalidity != ?", (carpeta, uidvalidity_vigente)
+            )
+        return borrados
+
+    def buscar_texto(self, consulta, carpeta=None, fecha_desde=None, fecha_hasta=None, campos=('asunto',), limite=None):
+        """
+        Busca en los correos guardados todas las palabras de 'consulta' dentro de
+        los 'campos' indicados (asunto, remitente, cuerpo). Las fechas son
+        'YYYY-MM-DD'; fecha_hasta es exclusiva, igual que BEFORE en IMAP.
+        Devuelve la lista de diccionarios guardados.
+        """
+        palabras = [p for p in re.split(r'\s+', consulta or '') if p]
+        if not palabras:
+            return []
+        campos = [c for c in campos if c in ('asunto', 'remitente', 'cuerpo')] or ['asunto']
+
+        # 'dia' es el 'YYYY-MM-DD' de la fecha guardada; el rango usa el índice (carpeta, version, dia)
+        rango = []
+        parametros_rango = []
+        if fecha_desde:
+            rango.append("m.dia >= ?")
+            parametros_rango.append(fecha_desde)
+        if fecha_hasta:
+            rango.append("m.dia < ?")
+            parametros_rango.append(fecha_hasta)
+
+        with self._lock:
+            usar_fts = bool(self.tokenizador_fts)
+            if usar_fts and self.tokenizador_fts == 'trigram' and carpeta and rango:
+                # Si el rango tiene pocos correos se recorre entero con LIKE (mismo resultado que
+                # trigram): es más rápido que traer del índice todos los correos con esas palabras
+                en_rango = self._conexion.execute(
+                    "SELECT COUNT(*) FROM mensajes m WHERE m.carpeta = ? AND m.version = ? AND " + " AND ".join(rango),
+                    [carpeta, self.version_datos, *parametros_rango]
+                ).fetchone()[0]
+                usar_fts = en_rango > MAX_CORREOS_RANGO_SIN_INDICE
+
+            # Sin rango de fechas, el '+' impide usar los índices de la carpeta para que la
+            # búsqueda la guíe el índice de texto en lugar de recorrer toda la carpeta
+            prefijo = "+" if usar_fts and not rango else ""
+            condiciones = [f"{prefijo}m.version = ?"]
+            parametros = [self.version_datos]
+            if carpeta:
+                condiciones.append(f"{prefijo}m.carpeta = ?")
+                parametros.append(carpeta)
+            condiciones += rango
+            parametros += parametros_rango
+
+            sin_indice = palabras
+            if usar_fts:
+                consulta_fts = _consulta_fts(palabras, campos, self.tokenizador_fts)
+                # El tokenizador trigram no indexa palabras de menos de 3 letras: esas se filtran con LIKE
+                sin_indice = [p for p in palabras if self.tokenizador_fts == 'trigram' and len(p) < 3]
+                if consulta_fts:
+                    # El MATCH se evalúa una sola vez (subconsulta no correlacionada) y las filas se
+                    # buscan por rowid; con un JOIN se evaluaba una vez por cada fila de la carpeta
+                    condiciones.insert(0, "m.rowid IN (SELECT rowid FROM mensajes_fts WHERE mensajes_fts MATCH ?)")
+                    parametros.insert(0, consulta_fts)
+            for palabra in sin_indice:
+                condiciones.append("(" + " OR ".join(f"{_expresion_campo(c)} LIKE ?" for c in campos) + ")")
+                parametros.extend([f"%{palabra}%"] * len(campos))
+
+            sql = "SELECT m.datos FROM mensajes m WHERE " + " AND ".join(condiciones)
+            if limite:
+                sql += f" LIMIT {int(limite)}"
+            filas = self._conexion.execute(sql, parametros).fetchall()
+        return [json.loads(fila['datos']) for fila in filas]
+
+    def buscar_relevantes(self, palabras, limite=200):
+        """
+        Correos guardados que contienen alguna de las 'palabras' en asunto, remitente
+        o cuerpo, los más relevantes primero (rank bm25 de FTS5). Es la preselección
+        del asistente; sin índice de texto devuelve los 'limite' más recientes.
+        """
+        if not self.tokenizador_fts:
+            with self._lock:
+                filas = self._conexion.execute(
+                    "SELECT datos FROM mensajes WHERE version = ? ORDER BY fecha DESC LIMIT ?", (self.version_datos, limite)
+                ).fetchall()
+            return [json.loads(fila['datos']) for fila in filas]
+        consulta_fts = _consulta_fts(palabras, ('asunto', 'remitente', 'cuerpo'), self.tokenizador_fts, " OR ")
+        if not consulta_fts:
+            return []
+        # CROSS JOIN fija el orden: el índice de texto guía la consulta y cada correo se busca por
+        # rowid (si lo guiara un índice de 'mensajes', el MATCH se evaluaría una vez por fila)
+        with self._lock:
+            filas = self._conexion.execute(
+                """
+                SELECT m.datos FROM mensajes_fts f CROSS JOIN mensajes m ON m.rowid = f.rowid
+                WHERE mensajes_fts MATCH ? AND +m.version = ?
+                ORDER BY f.rank LIMIT ?
+                """,
+                (consulta_fts, self.version_datos, limite)
+            ).fetchall()
+        return [json.loads(fila['datos']) for fila in filas]
+
+    def obtener_hilo(self, carpeta, uidvalidity, ids_mensajes, max_mensajes=1000):
+        """
+        Devuelve los correos guardados de la conversación de 'ids_mensajes': los que
+        tienen alguno de esos Message-ID, los que los referencian y, repitiendo, todo
+        lo conectado por References / In-Reply-To (hasta 'max_mensajes' correos).
+        """
+        encontrados = {}
+        vistos = set()
+        pendientes = {normalizar_id(i) for i in ids_mensajes} - {None}
+        with self._lock:
+            while pendientes and len(encontrados) < max_mensajes:
+                lote = list(pendientes)[:400]
+                pendientes.difference_update(lote)
+                vistos.update(lote)
+                marcadores = ",".join("?" * len(lote))
+                filas = self._conexion.execute(
+                    f"""
+                    SELECT uid, datos FROM mensajes
+                    WHERE carpeta = ? AND uidvalidity = ? AND version = ? AND (
+                        message_id IN ({marcadores})
+                        OR uid IN (SELECT uid FROM referencias WHERE carpeta = ? AND uidvalidity = ? AND referencia IN ({marcadores}))
+                    )
+                    """,
+                    [carpeta, uidvalidity, self.version_datos, *lote, carpeta, uidvalidity, *lote]
+                ).fetchall()
+                for fila in filas:
+                    if fila['uid'] in encontrados:
+                        continue
+                    datos = json.loads(fila['datos'])
+                    encontrados[fila['uid']] = datos
+                    relacionados = set(referencias_correo(datos))
+                    relacionados.add(normalizar_id(datos.get('message_id')))
+                    pendientes.update(relacionados - vistos - {None})
+        return list(encontrados.values())[:max_mensajes]
+
+    def obtener_resumen_hilo(self, clave):
+        """Devuelve el último resumen guardado del hilo y hasta qué UID cubre, o None."""
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT carpeta, uidvalidity, uid_max, cantidad, resumen, actualizado FROM resumenes_hilo WHERE clave = ?", (clave,)
+            ).fetchone()
+        return dict(fila) if fila else None
+
+    def guardar_resumen_hilo(self, clave, carpeta, uidvalidity, uid_max, cantidad, resumen):
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO resumenes_hilo (clave, carpeta, uidvalidity, uid_max, cantidad, resumen, actualizado) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (clave, carpeta, uidvalidity, uid_max, cantidad, resumen, time.time())
+            )
+
+    def resumenes_hilo_recientes(self, limite=20):
+        """Últimos resúmenes de hilos guardados (modo incremental), del más reciente al más antiguo."""
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT carpeta, cantidad, resumen, actualizado FROM resumenes_hilo ORDER BY actualizado DESC LIMIT ?", (limite,)
+            ).fetchall()
+        return [dict(fila) for fila in filas]
+
+    def contar(self, carpeta=None):
+        with self._lock:
+            if carpeta:
+                fila = self._conexion.execute("SELECT COUNT(*) FROM mensajes WHERE carpeta = ?", (carpeta,)).fetchone()
+            else:
+                fila = self._conexion.execute("SELECT COUNT(*) FROM mensajes").fetchone()
+        return fila[0]
+
+# Nombre de cada campo del índice dentro del diccionario guardado
+_CAMPOS_DATOS = {'asunto': 'asunto', 'remitente': 'remitente', 'cuerpo': 'cuerpo_texto_plano'}
+
+def _expresion_campo(campo):
+    """Expresión SQL del campo en 'mensajes' (el asunto tiene columna propia; el resto está en 'datos')."""
+    return "m.asunto" if campo == 'asunto' else f"json_extract(m.datos, '$.{_CAMPOS_DATOS[campo]}')"
+
+def _filas_referencias(carpeta, uidvalidity, datos):
+    return [(carpeta, uidvalidity, int(datos['uid']), referencia) for referencia in referencias_correo(datos)]
+
+def _fila_fts(rowid, datos):
+    return (rowid, datos.get('asunto', ''), datos.get('remitente', ''), datos.get('cuerpo_texto_plano', ''))
+
+def _consulta_fts(palabras, campos, tokenizador, operador=" AND "):
+    """Arma la expresión MATCH: cada palabra debe aparecer (con " OR ", alguna) en alguno de los campos."""
+    terminos = []
+    for palabra in palabras:
+        if tokenizador == 'trigram' and len(palabra) < 3:
+            continue
+        frase = '"' + palabra.replace('"', '""') + '"'
+        if tokenizador != 'trigram':
+            frase += '*'  # Coincidencia por prefijo
+        terminos.append("{" + " ".join(campos) + "} : " + frase)
+    return operador.join(terminos)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+import json
+import math
+import re
+import statistics
+from array import array
+from collections import Counter
+from itertools import zip_longest
+
+NAN = float('nan')
+
+# Una columna se considera numérica si al menos esta fracción de sus celdas no vacías son números
+UMBRAL_NUMERICO = 0.8
+
+_SIMBOLOS = re.compile(r"[\s $€%]")
+_MILES_COMA = re.compile(r"[-+]?\d{1,3}(,\d{3}){2,}")
+_MILES_PUNTO = re.compile(r"[-+]?\d{1,3}(\.\d{3}){2,}")
+_DIGITO = re.compile(r"\d")
+
+def convertir_numero(celda):
+    """
+    Convierte el texto de una celda en float. Devuelve NaN si la celda está vacía
+    y None si tiene texto que no es un número.
+
+    Acepta negativos, '(12)' contable, símbolos de moneda/porcentaje, coma decimal
+    ('1,5'), separadores de miles ('1.234.567', '1,234,567') y la combinación de
+    ambos ('1.234,5' o '1,234.5': el último separador es el decimal).
+    """
+    if celda is None:
+        return NAN
+    if not isinstance(celda, str):
+        return float(celda)
+    texto = celda.strip()
+    if not texto:
+        return NAN
+    try:
+        # La mayoría de las celdas numéricas ya vienen en formato que float() entiende
+        valor = float(texto)
+        return valor if math.isfinite(valor) else None
+    except ValueError:
+        pass
+    if not _DIGITO.search(texto):
+        return None
+
+    negativo = texto.startswith('(') and texto.endswith(')')
+    if negativo:
+        texto = texto[1:-1]
+    texto = _SIMBOLOS.sub('', texto)
+    if ',' in texto and '.' in texto:
+        if texto.rfind(',') > texto.rfind('.'):
+            texto = texto.replace('.', '').replace(',', '.')
+        else:
+            texto = texto.replace(',', '')
+    elif ',' in texto:
+        texto = texto.replace(',', '') if _MILES_COMA.fullmatch(texto) else texto.replace(',', '.')
+    elif _MILES_PUNTO.fullmatch(texto):
+        texto = texto.replace('.', '')
+    try:
+        valor = float(texto)
+    except ValueError:
+        return None
+    if not math.isfinite(valor):
+        return None
+    return -valor if negativo else valor
+
+def _float_coma_decimal(celda):
+    return float(celda.replace(',', '.'))
+
+def tipar_columna(nombre, celdas):
+    """
+    Infiere el tipo de una columna y la convierte de una sola vez.
+
+    Devuelve un dict con:
+    - nombre, tipo ('numero', 'texto' o 'vacia')
+    - valores: array('d') con NaN en los faltantes si es numérica; la lista original si no
+    - validos: cantidad de celdas con valor (numérico, si la columna es numérica)
+    """
+    # Columnas sin vacíos con números simples, o simples con coma decimal ('1,5'):
+    # se convierten enteras en una sola pasada
+    for conversion in (float, _float_coma_decimal):
+        try:
+            valores = array('d', map(conversion, celdas))
+        except (ValueError, TypeError, AttributeError):
+            continue
+        if celdas and all(map(math.isfinite, valores)):
+            return {"nombre": nombre, "tipo": "numero", "valores": valores, "validos": len(valores)}
+        break
+    # Cada texto distinto se convierte una sola vez (las columnas suelen repetir valores)
+    tabla = {celda: convertir_numero(celda) for celda in set(celdas)}
+    convertidos = [tabla[celda] for celda in celdas]
+    no_vacios = sum(1 for v in convertidos if v is None or v == v)
+    numeros = sum(1 for v in convertidos if v is not None and v == v)
+    if no_vacios == 0:
+        return {"nombre": nombre, "tipo": "vacia", "valores": array('d', [NAN] * len(convertidos)), "validos": 0}
+    if numeros / no_vacios >= UMBRAL_NUMERICO:
+        # Los textos sueltos en una columna numérica quedan como faltantes
+        valores = array('d', (NAN if v is None else v for v in convertidos))
+        return {"nombre": nombre, "tipo": "numero", "valores": valores, "validos": numeros}
+    return {"nombre": nombre, "tipo": "texto", "valores": list(celdas), "validos": no_vacios}
+
+def tipar_columnas(encabezados, filas):
+    """
+    Transpone las filas (que pueden tener distinto largo) y tipa cada columna.
+    Devuelve una lista de columnas (ver tipar_columna) en el orden de 'encabezados'.
+    """
+    if not filas:
+        return [tipar_columna(nombre, []) for nombre in encabezados]
+    ancho = len(encabezados)
+    # Se agrega una fila guía del ancho de los encabezados para que zip_longest complete todas las columnas
+    transpuestas = list(zip_longest(*filas, [""] * ancho, fillvalue=""))
+    return [tipar_columna(nombre, transpuestas[i][:-1]) for i, nombre in enumerate(encabezados)]
+
+def a_lista(valores):
+    """array('d') -> lista con None en lugar de NaN (serializable a JSON)."""
+    return [None if v != v else v for v in valores]
+
+def _recortar(texto, largo=60):
+    texto = str(texto)
+    return texto if len(texto) <= largo else texto[:largo - 1] + "…"
+
+def _redondear(valor):
+    return round(valor, 4) if isinstance(valor, float) else valor
+
+def _tendencia(valores):
+    """Pendiente de la recta de mínimos cuadrados respecto al número de fila y dirección resultante."""
+    puntos = [(i, v) for i, v in enumerate(valores) if v == v]
+    n = len(puntos)
+    if n < 3:
+        return None
+    media_x = sum(i for i, _ in puntos) / n
+    media_y = sum(v for _, v in puntos) / n
+    varianza_x = sum((i - media_x) ** 2 for i, _ in puntos)
+    if not varianza_x:
+        return None
+    pendiente = sum((i - media_x) * (v - media_y) for i, v in puntos) / varianza_x
+    # Cambio total a lo largo de las filas, relativo a la media
+    cambio = pendiente * (puntos[-1][0] - puntos[0][0])
+    relativo = cambio / abs(media_y) if media_y else cambio
+    if abs(relativo) < 0.05:
+        direccion = "estable"
+    else:
+        direccion = "creciente" if relativo > 0 else "decreciente"
+    return {"pendiente_por_fila": _redondear(pendiente), "cambio_relativo": _redondear(relativo), "direccion": direccion}
+
+def estadisticas_columna(columna, etiquetas, top=5):
+    """Resumen acotado de una columna: su tamaño no depende de la cantidad de filas."""
+    resumen = {"nombre": _recortar(columna["nombre"]), "tipo": columna["tipo"], "validos": columna["validos"]}
+    if columna["tipo"] == "texto":
+        conteo = Counter(v for v in columna["valores"] if v)
+        resumen["distintos"] = len(conteo)
+        resumen["mas_frecuentes"] = [(_recortar(v), n) for v, n in conteo.most_common(top)]
+        return resumen
+    if columna["tipo"] != "numero":
+        return resumen
+
+    indices = [i for i, v in enumerate(columna["valores"]) if v == v]
+    valores = [columna["valores"][i] for i in indices]
+    resumen["faltantes"] = len(columna["valores"]) - len(valores)
+    ordenados = sorted(valores)
+    resumen.update({
+        "min": ordenados[0],
+        "max": ordenados[-1],
+        "media": _redondear(statistics.fmean(valores)),
+        "desvio": _redondear(statistics.pstdev(valores)),
+        "suma": _redondear(math.fsum(valores))
+    })
+    if len(valores) >= 2:
+        p25, p50, p75 = statistics.quantiles(ordenados, n=4, method='inclusive')
+        p90 = statistics.quantiles(ordenados, n=10, method='inclusive')[-1]
+        resumen["percentiles"] = {"p25": _redondear(p25), "p50": _redondear(p50), "p75": _redondear(p75), "p90": _redondear(p90)}
+
+        # Valores atípicos por rango intercuartil; se informan solo los más alejados
+        rango = p75 - p25
+        bajo, alto = p25 - 1.5 * rango, p75 + 1.5 * rango
+        atipicos = [i for i in indices if not bajo <= columna["valores"][i] <= alto]
+        atipicos.sort(key=lambda i: abs(columna["valores"][i] - p50), reverse=True)
+        resumen["atipicos"] = {
+            "cantidad": len(atipicos),
+            "principales": [
+                (_recortar(etiquetas[i]) if i < len(etiquetas) else i, columna["valores"][i]) for i in atipicos[:top]
+            ]
+        }
+    pares = sorted(((columna["valores"][i], i) for i in indices), reverse=True)
+    resumen["mayores"] = [(_recortar(etiquetas[i]) if i < len(etiquetas) else i, v) for v, i in pares[:top]]
+    resumen["tendencia"] = _tendencia(columna["valores"])
+    return resumen
+
+def generar_digesto(etiquetas, columnas, top=5, filas_muestra=0, max_columnas=30):
+    """
+    Digesto estadístico de una hoja: estadísticas por columna y, opcionalmente, una
+    muestra de filas repartidas a lo largo de la hoja. Su tamaño está acotado por
+    'max_columnas', 'top' y 'filas_muestra', no por la cantidad de filas.
+    """
+    total_filas = max([len(etiquetas)] + [len(c["valores"]) for c in columnas])
+    incluidas = columnas[:max_columnas]
+    digesto = {
+        "filas": total_filas,
+        "columnas": len(columnas),
+        "columnas_omitidas": len(columnas) - len(incluidas),
+        "estadisticas": [estadisticas_columna(c, etiquetas, top) for c in incluidas]
+    }
+    if filas_muestra and total_filas:
+        paso = max(1, total_filas / filas_muestra)
+        indices = sorted({min(int(k * paso), total_filas - 1) for k in range(min(filas_muestra, total_filas))})
+        muestra = []
+        for i in indices:
+            fila = {"etiqueta": _recortar(etiquetas[i]) if i < len(etiquetas) else ""}
+            for c in incluidas:
+                valor = c["valores"][i] if i < len(c["valores"]) else None
+                fila[_recortar(c["nombre"], 30)] = None if valor != valor else (_recortar(valor, 30) if isinstance(valor, str) else valor)
+            muestra.append(fila)
+        digesto["muestra"] = muestra
+    return digesto
+
+def formatear_digesto(digesto, max_chars=12000):
+    """
+    Texto JSON compacto del digesto para el prompt. Si pasa de 'max_chars' se quitan
+    partes enteras para que el JSON siga siendo válido: primero filas de la muestra
+    (desde el final) y después las últimas columnas de las estadísticas, que se suman
+    a 'columnas_omitidas'. El digesto recibido no se modifica.
+    """
+    def serializar(d):
+        return json.dumps(d, ensure_ascii=False, separators=(',', ':'))
+
+    texto = serializar(digesto)
+    if len(texto) <= max_chars:
+        return texto
+    recortado = dict(digesto)
+    muestra = list(recortado.get("muestra") or [])
+    estadisticas = list(recortado.get("estadisticas") or [])
+    while len(texto) > max_chars and (muestra or estadisticas):
+        if muestra:
+            muestra.pop()
+            recortado["muestra"] = muestra
+            recortado["filas_muestra_omitidas"] = recortado.get("filas_muestra_omitidas", 0) + 1
+        else:
+            estadisticas.pop()
+            recortado["estadisticas"] = estadisticas
+            recortado["columnas_omitidas"] = recortado.get("columnas_omitidas", 0) + 1
+        texto = serializar(recortado)
+    return texto
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks de los endpoints principales sin red ni credenciales.
+
+Levanta un servidor IMAP falso en el mismo proceso con buzones sintéticos y
+reemplaza Google Sheets/Drive y Gemini por servicios simulados con latencia
+configurable. Para cada tamaño informa la latencia de la primera solicitud (en
+frío), los percentiles de las siguientes, los round-trips a cada servicio y el
+pico de memoria de Python (tracemalloc, en una corrida aparte en frío).
+
+También mide las búsquedas en el índice local de correos (origen=local) sobre un
+almacén de --mensajes-locales correos y termina con código 1 si alguna de las
+exigidas (ver BUSQUEDAS_LOCALES) supera --objetivo-local-ms en el p95.
+
+Uso:
+    python benchmark.py
+    python benchmark.py --correos 100,1000 --filas 10000 --repeticiones 10 --json resultados.json
+    python benchmark.py --mensajes-locales 100000 --correos "" --filas ""
+
+El pico de memoria incluye a los servicios simulados (corren en el mismo proceso)
+y no incluye a los procesos de parseo MIME.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+from email import policy
+from email.message import EmailMessage
+from email.utils import format_datetime
+from urllib.parse import urlencode
+
+from servidor_imap_falso import ServidorIMAPFalso, Buzon
+
+ENCABEZADOS_BBDD = ["TrackID", "Family", "TestCode", "Process", "Date", "Station", "Result", "Operator"]
+FAMILIAS = [f"FAM{k:02d}" for k in range(12)]
+PROCESOS = ["SMT", "ICT", "FCT", "RF", "MMI", "PACK"]
+PALABRAS = ("linea placa lote falla proveedor envio stock prueba ajuste turno revision "
+            "cliente pedido modelo cambio equipo reporte planta calidad material").split()
+
+# --- Datos sintéticos ---
+
+def _cuerpo(numero, tamano_cuerpo, correos_por_hilo=5):
+    palabras = []
+    largo = 0
+    k = numero
+    while largo < tamano_cuerpo:
+        palabra = PALABRAS[k % len(PALABRAS)]
+        palabras.append(palabra)
+        largo += len(palabra) + 1
+        k = k * 7 + 3
+    return f"Mensaje {numero} del hilo {numero // correos_por_hilo}.\n" + " ".join(palabras)
+
+def generar_correo(numero, tamano_cuerpo=1500, tamano_adjunto=0, correos_por_hilo=5):
+    """Correo número 'numero' de un buzón sintético: hilos de 'correos_por_hilo' respuestas encadenadas."""
+    hilo, posicion = divmod(numero, correos_por_hilo)
+    mensaje = EmailMessage()
+    asunto = f"Proyecto {hilo % 10} reporte {hilo}"
+    mensaje['Subject'] = asunto if posicion == 0 else f"Re: {asunto}"
+    mensaje['From'] = f"usuario{numero % 37}@ejemplo.com"
+    mensaje['Date'] = format_datetime(datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=17 * numero))
+    mensaje['Message-ID'] = f"<bench{numero}@ejemplo.com>"
+    if posicion:
+        anteriores = " ".join(f"<bench{n}@ejemplo.com>" for n in range(numero - posicion, numero))
+        mensaje['In-Reply-To'] = f"<bench{numero - 1}@ejemplo.com>"
+        mensaje['References'] = anteriores
+    mensaje.set_content(_cuerpo(numero, tamano_cuerpo, correos_por_hilo))
+    if tamano_adjunto:
+        mensaje.add_attachment(bytes(tamano_adjunto), maintype='application', subtype='octet-stream', filename='datos.bin')
+    return mensaje.as_bytes(policy=policy.SMTP)
+
+def cargar_buzon(buzon, cantidad, tamano_cuerpo=1500, tamano_adjunto=0):
+    for numero in range(cantidad):
+        buzon.agregar(generar_correo(numero, tamano_cuerpo, tamano_adjunto))
+
+def datos_correo(numero, tamano_cuerpo=1000, correos_por_hilo=5):
+    """Lo que extraería la aplicación del correo 'numero' (sin armar ni parsear el MIME)."""
+    hilo, posicion = divmod(numero, correos_por_hilo)
+    asunto = f"Proyecto {hilo % 10} reporte {hilo}"
+    return {
+        'uid': str(numero + 1),
+        'asunto': asunto if posicion == 0 else f"Re: {asunto}",
+        'remitente': f"usuario{numero % 37}@ejemplo.com",
+        'fecha': (datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=17 * numero)).isoformat(),
+        'message_id': f"<bench{numero}@ejemplo.com>",
+        'in_reply_to': f"<bench{numero - 1}@ejemplo.com>" if posicion else '',
+        'references': " ".join(f"<bench{n}@ejemplo.com>" for n in range(numero - posicion, numero)),
+        'cuerpo_texto_plano': _cuerpo(numero, tamano_cuerpo, correos_por_hilo)[:1000]
+    }
+
+def cargar_almacen(almacen, carpeta, cantidad, tamano_cuerpo=1000):
+    for inicio in range(0, cantidad, 5000):
+        almacen.guardar(carpeta, 1, [datos_correo(numero, tamano_cuerpo) for numero in range(inicio, min(cantidad, inicio + 5000))])
+
+# Búsquedas en el índice local (origen=local): (consulta, argumentos de buscar_texto, se exige el objetivo).
+# "Proyecto 12" es el peor caso: "Proyecto" está en todos los asuntos y "12" es demasiado corto
+# para el índice trigram, así que se recorren todos los correos; se informa pero no se exige
+BUSQUEDAS_LOCALES = [
+    ("Proyecto 123", {}, True),
+    ("reporte planta", {}, True),
+    ("Proyecto 12", {}, False),
+    ("reporte 12", {'fecha_desde': '2024-03-01', 'fecha_hasta': '2024-03-08'}, True)
+]
+
+# Preselección del asistente (buscar_relevantes), que busca cualquiera de las palabras y ordena
+# por bm25: con palabras que están en casi todos los correos se ordenan todos, así que se informa
+# sin exigir el objetivo (el asistente después espera varios segundos a Gemini)
+BUSQUEDAS_RELEVANTES = [
+    ["proyecto", "123"],
+    ["calidad", "planta"]
+]
+
+def fila_bbdd(numero):
+    """Fila 'numero' (desde 0) de la base de fallas sintética, calculada sin guardarla."""
+    return [
+        f"TR{numero:08d}",
+        FAMILIAS[(numero * 7) % len(FAMILIAS)],
+        f"TC{(numero * 31) % 200:03d}",
+        PROCESOS[numero % len(PROCESOS)],
+        (date(2024, 1, 1) + timedelta(days=numero // 500)).isoformat(),
+        f"ST{numero % 40:02d}",
+        "FAIL" if numero % 3 else "RETEST",
+        f"OP{numero % 25:02d}"
+    ]
+
+# --- Servicios simulados ---
+
+class _Pedido:
+    def __init__(self, funcion, latencia):
+        self._funcion = funcion
+        self._latencia = latencia
+
+    def execute(self):
+        if self._latencia:
+            time.sleep(self._latencia)
+        return self._funcion()
+
+class SheetsFalso:
+    """Imita spreadsheets().get, values().get y values().batchGet sobre la base sintética."""
+
+    def __init__(self, filas, latencia, contadores):
+        self.filas = filas
+        self.latencia = latencia
+        self.contadores = contadores
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def _valores(self, rango):
+        from lector_hojas import parsear_rango
+        partes = parsear_rango(rango)
+        if partes is None:
+            col_ini, fila_ini, col_fin, fila_fin = 0, 1, len(ENCABEZADOS_BBDD) - 1, None
+        else:
+            _, col_ini, fila_ini, col_fin, fila_fin = partes
+        ultima = min(fila_fin or self.filas + 1, self.filas + 1)
+        valores = []
+        for numero_fila in range(fila_ini, ultima + 1):
+            fila = ENCABEZADOS_BBDD if numero_fila == 1 else fila_bbdd(numero_fila - 2)
+            valores.append(fila[col_ini:col_fin + 1])
+        return valores
+
+    def get(self, spreadsheetId=None, range=None, ranges=None, fields=None):
+        self.contadores['sheets'] += 1
+        if range is None:
+            # Metadatos: se reservan filas vacías al final, como en una hoja real
+            meta = {'sheets': [{'properties': {'gridProperties': {'rowCount': self.filas + 1001}}}]}
+            return _Pedido(lambda: meta, self.latencia)
+        return _Pedido(lambda: {'values': self._valores(range)}, self.latencia)
+
+    def batchGet(self, spreadsheetId=None, ranges=(), majorDimension=None):
+        self.contadores['sheets'] += 1
+        return _Pedido(lambda: {'valueRanges': [{'values': self._valores(r)} for r in ranges]}, self.latencia)
+
+class DriveFalso:
+    """Imita files().get(fields='version, modifiedTime') con una versión fija por tamaño de hoja."""
+
+    def __init__(self, version, latencia, contadores):
+        self.version = version
+        self.latencia = latencia
+        self.contadores = contadores
+
+    def files(self):
+        return self
+
+    def get(self, fileId=None, fields=None):
+        self.contadores['drive'] += 1
+        return _Pedido(lambda: {'version': str(self.version), 'modifiedTime': '2024-01-01T00:00:00Z'}, self.latencia)
+
+class _RespuestaFalsa:
+    def __init__(self, texto):
+        self.text = texto
+
+class ModeloGeminiFalso:
+    """Imita GenerativeModel.generate_content (con y sin stream) con una demora fija por llamada."""
+
+    def __init__(self, latencia, contadores):
+        self.latencia = latencia
+        self.contadores = contadores
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.contadores['gemini'] += 1
+        self.contadores['gemini_caracteres'] += len(prompt)
+        time.sleep(self.latencia)
+        texto = f"Resumen simulado de un prompt de {len(prompt)} caracteres."
+        if stream:
+            return [_RespuestaFalsa(parte) for parte in texto.split(' ')]
+        return _RespuestaFalsa(texto)
+
+# --- Medición ---
+
+def percentil(valores, p):
+    if len(valores) == 1:
+        return valores[0]
+    return statistics.quantiles(valores, n=100, method='inclusive')[p - 1]
+
+def medir(nombre, tamano, ejecutar, preparar_frio, contar, repeticiones, detallado):
+    """
+    Corre 'ejecutar' una vez en frío y 'repeticiones' veces más, y otra vez en frío
+    con tracemalloc para el pico de memoria. 'contar()' devuelve los contadores
+    acumulados de llamadas a cada servicio. Devuelve el resultado como dict.
+    """
+    salida = contextlib.nullcontext() if detallado else contextlib.redirect_stdout(io.StringIO())
+
+    def una_corrida():
+        antes = contar()
+        inicio = time.perf_counter()
+        with salida:
+            ejecutar()
+        duracion = time.perf_counter() - inicio
+        despues = contar()
+        return duracion, {clave: despues[clave] - antes[clave] for clave in despues}
+
+    preparar_frio()
+    frio, llamadas_frio = una_corrida()
+    calientes = [una_corrida() for _ in range(repeticiones)]
+    latencias = sorted(duracion for duracion, _ in calientes) or [frio]
+    llamadas_caliente = calientes[-1][1] if calientes else llamadas_frio
+
+    preparar_frio()
+    tracemalloc.start()
+    try:
+        una_corrida()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    resultado = {
+        "endpoint": nombre,
+        "tamano": tamano,
+        "frio_ms": round(frio * 1000, 1),
+        "p50_ms": round(percentil(latencias, 50) * 1000, 1),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 1),
+        "max_ms": round(latencias[-1] * 1000, 1),
+        "llamadas_frio": llamadas_frio,
+        "llamadas_caliente": llamadas_caliente,
+        "pico_memoria_mb": round(pico / 2 ** 20, 1)
+    }
+    print(formatear_fila(resultado), flush=True)
+    return resultado
+
+def _llamadas(llamadas):
+    return " ".join(f"{clave}={valor}" for clave, valor in llamadas.items() if valor and clave != 'gemini_caracteres') or "-"
+
+def formatear_fila(r):
+    return (f"{r['endpoint']:<28}{r['tamano']:>9}{r['frio_ms']:>11}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['max_ms']:>10}"
+            f"{r['pico_memoria_mb']:>10}   frío: {_llamadas(r['llamadas_frio'])} | caliente: {_llamadas(r['llamadas_caliente'])}")
+
+def _lista_enteros(texto):
+    return [int(valor) for valor in texto.split(',') if valor.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks sin red de buscar_correos, analizar_bbdd y el resumen con Gemini.")
+    parser.add_argument('--correos', type=_lista_enteros, default=[100, 1000, 10000], help="Tamaños de buzón (ej: 100,1000,10000)")
+    parser.add_argument('--filas', type=_lista_enteros, default=[10000, 100000, 1000000], help="Filas de la hoja (ej: 10000,100000)")
+    parser.add_argument('--mensajes-locales', type=_lista_enteros, default=[100000], help="Correos del almacén local para las búsquedas de origen=local")
+    parser.add_argument('--objetivo-local-ms', type=float, default=50, help="p95 máximo aceptado para las búsquedas locales")
+    parser.add_argument('--repeticiones', type=int, default=5, help="Solicitudes medidas después de la primera")
+    parser.add_argument('--tamano-cuerpo', type=int, default=1500, help="Bytes de texto por correo")
+    parser.add_argument('--tamano-adjunto', type=int, default=0, help="Bytes del adjunto de cada correo (0 = sin adjunto)")
+    parser.add_argument('--latencia-imap', type=float, default=0.02, help="Segundos por comando IMAP")
+    parser.add_argument('--latencia-sheets', type=float, default=0.05, help="Segundos por llamada a Sheets/Drive")
+    parser.add_argument('--latencia-gemini', type=float, default=0.2, help="Segundos por llamada a Gemini")
+    parser.add_argument('--gemini-por-minuto', type=int, default=0, help="Límite de llamadas a Gemini por minuto (0 = sin límite)")
+    parser.add_argument('--json', help="Archivo donde guardar los resultados")
+    parser.add_argument('--detallado', action='store_true', help="Mostrar los mensajes de la aplicación")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix='benchmark_')
+    servidor = ServidorIMAPFalso(latencia=args.latencia_imap).iniciar()
+
+    # La configuración se lee al importar main: se apunta todo a los servicios locales
+    os.environ.update({
+        'IMAP_SERVER': '127.0.0.1',
+        'IMAP_PUERTO': str(servidor.puerto),
+        'IMAP_SSL': '0',
+        'EMAIL_USUARIO': 'benchmark@ejemplo.com',
+        'CONTRASENA_APP': 'benchmark',
+        'GOOGLE_API_KEY': 'benchmark',
+        'ALMACEN_CORREOS_RUTA': os.path.join(directorio, 'correos.db'),
+        'CACHE_RESUMENES_RUTA': os.path.join(directorio, 'resumenes.db'),
+        'GEMINI_POR_MINUTO': str(args.gemini_por_minuto)
+    })
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main as app_main
+    import lector_hojas
+    from almacen_correos import AlmacenCorreos
+    from cache_resumenes import CacheResumenes
+
+    contadores = {'sheets': 0, 'drive': 0, 'gemini': 0, 'gemini_caracteres': 0}
+    hoja = SheetsFalso(0, args.latencia_sheets, contadores)
+    drive = DriveFalso(0, args.latencia_sheets, contadores)
+    app_main.crear_servicios = lector_hojas.crear_servicios = lambda: (drive, hoja)
+    app_main.genai.GenerativeModel = lambda *a, **k: ModeloGeminiFalso(args.latencia_gemini, contadores)
+    app_main.GEMINI_API_KEY_CONFIGURADA = True
+    cliente = app_main.app.test_client()
+
+    def contar():
+        return {'imap': servidor.estado.round_trips, **contadores}
+
+    print(f"{'endpoint':<28}{'tamaño':>9}{'frío ms':>11}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'pico MB':>10}   llamadas")
+    resultados = []
+    generaciones = 0
+
+    def nuevas_bases():
+        nonlocal generaciones
+        generaciones += 1
+        app_main.almacen_correos = AlmacenCorreos(os.path.join(directorio, f'correos_{generaciones}.db'), app_main.VERSION_EXTRACCION)
+        app_main.cache_resumenes = CacheResumenes(os.path.join(directorio, f'resumenes_{generaciones}.db'))
+
+    lentas = []
+    try:
+        for cantidad in args.mensajes_locales:
+            almacen_local = AlmacenCorreos(os.path.join(directorio, f'local_{cantidad}.db'), app_main.VERSION_EXTRACCION)
+            cargar_almacen(almacen_local, 'INBOX', cantidad, min(args.tamano_cuerpo, 1000))
+            for consulta, opciones, exigir in BUSQUEDAS_LOCALES:
+                def buscar_local():
+                    almacen_local.buscar_texto(consulta, 'INBOX', **opciones)
+
+                nombre = f"local '{consulta}'" + (" +fechas" if opciones else "")
+                resultado = medir(nombre, cantidad, buscar_local, lambda: None, contar, args.repeticiones, args.detallado)
+                resultados.append(resultado)
+                if exigir and resultado["p95_ms"] > args.objetivo_local_ms:
+                    lentas.append(nombre)
+            for palabras in BUSQUEDAS_RELEVANTES:
+                def buscar_relevantes():
+                    almacen_local.buscar_relevantes(palabras)
+
+                nombre = f"relevantes '{' '.join(palabras)}'"
+                resultados.append(medir(nombre, cantidad, buscar_relevantes, lambda: None, contar, args.repeticiones, args.detallado))
+
+        for cantidad in args.correos:
+            # Cada tamaño es una carpeta distinta del mismo servidor
+            carpeta = f"benchmark_{cantidad}"
+            servidor.estado.buzones[carpeta] = Buzon()
+            cargar_buzon(servidor.estado.buzones[carpeta], cantidad, args.tamano_cuerpo, args.tamano_adjunto)
+            # "Proyecto 3" coincide con uno de cada diez hilos
+            url = '/api/buscar_correos?' + urlencode({'asunto': 'Proyecto 3', 'carpetas': carpeta})
+
+            def buscar():
+                respuesta = cliente.get(url)
+                if respuesta.status_code != 200:
+                    raise RuntimeError(f"buscar_correos devolvió {respuesta.status_code}: {respuesta.get_data(as_text=True)[:200]}")
+
+            resultados.append(medir("buscar_correos", cantidad, buscar, nuevas_bases, contar, args.repeticiones, args.detallado))
+
+            textos = [
+                f"FECHA: 2024-01-01\nDE: usuario{n % 37}@ejemplo.com\nASUNTO: Proyecto\nCUERPO:\n" + "texto " * (args.tamano_cuerpo // 6)
+                for n in range(cantidad)
+            ]
+            corrida = 0
+
+            def resumir():
+                # Cada corrida cambia el primer texto para no acertar en la caché de resúmenes
+                nonlocal corrida
+                corrida += 1
+                app_main.generar_resumen_consolidado_ia([f"CORRIDA {corrida}\n" + textos[0]] + textos[1:], {})
+
+            resultados.append(medir("generar_resumen_consolidado", cantidad, resumir, lambda: None, contar, args.repeticiones, args.detallado))
+
+        for filas in args.filas:
+            hoja.filas = filas
+            drive.version = filas
+
+            def analizar():
+                respuesta = cliente.get('/api/analizar_bbdd')
+                if respuesta.status_code != 200:
+                    raise RuntimeError(f"analizar_bbdd devolvió {respuesta.status_code}: {respuesta.get_data(as_text=True)[:200]}")
+
+            resultados.append(medir("analizar_bbdd", filas, analizar, app_main.cache_hojas.invalidar, contar, args.repeticiones, args.detallado))
+    finally:
+        app_main.procesador_correos.cerrar()
+        servidor.detener()
+
+    if lentas:
+        print(f"Búsquedas locales por encima de {args.objetivo_local_ms} ms (p95): {', '.join(lentas)}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as archivo:
+            json.dump({"parametros": vars(args), "resultados": resultados}, archivo, ensure_ascii=False, indent=2)
+        print(f"Resultados guardados en {args.json}")
+    return 1 if lentas else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
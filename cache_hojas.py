@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from metricas import metricas
+
+class CacheHojas:
+    """
+    Caché en memoria de los valores de rangos de Google Sheets.
+
+    Antes de reutilizar un rango se compara la versión del archivo en Drive
+    (versión / modifiedTime) con la de la copia guardada, y solo se vuelve a
+    descargar si el archivo cambió. Durante 'revalidar_cada' segundos la copia
+    se usa sin consultar a Drive. Si varias solicitudes piden el mismo rango
+    mientras se actualiza, esperan esa única descarga en lugar de repetirla.
+
+    - descargar(sheet_id, rango, columnas) -> lista de filas (columnas=None: todas)
+    - obtener_version(sheet_id) -> cadena que cambia cuando cambia el archivo
+    """
+
+    def __init__(self, descargar, obtener_version, revalidar_cada=10):
+        self.descargar = descargar
+        self.obtener_version = obtener_version
+        self.revalidar_cada = revalidar_cada
+        self._entradas = {}
+        self._en_curso = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, sheet_id, rango, columnas=None):
+        """
+        Devuelve (valores, info). 'info' indica la versión y de dónde salieron los
+        valores: 'memoria', 'revalidado' (Drive confirmó que no cambió) o 'descargado'.
+        Cada combinación de rango y columnas se guarda por separado.
+        """
+        valores, info = self._obtener((sheet_id, rango, tuple(columnas) if columnas else None))
+        metricas.incrementar('cache_consultas_total', cache='hojas',
+                             resultado='fallo' if info['origen'] == 'descargado' else 'acierto')
+        return valores, info
+
+    def _obtener(self, clave):
+        while True:
+            with self._lock:
+                entrada = self._entradas.get(clave)
+                if entrada and time.monotonic() - entrada['verificado'] < self.revalidar_cada:
+                    return entrada['valores'], {"version": entrada['version'], "origen": "memoria"}
+                evento = self._en_curso.get(clave)
+                if evento is None:
+                    evento = threading.Event()
+                    self._en_curso[clave] = evento
+                    break
+            # Otra solicitud ya está actualizando este rango: se espera su resultado
+            evento.wait()
+            with self._lock:
+                entrada = self._entradas.get(clave)
+                if entrada:
+                    return entrada['valores'], {"version": entrada['version'], "origen": "memoria"}
+            # La actualización falló: se reintenta desde el principio
+
+        try:
+            return self._actualizar(clave, entrada)
+        finally:
+            with self._lock:
+                del self._en_curso[clave]
+            evento.set()
+
+    def invalidar(self, sheet_id=None):
+        with self._lock:
+            for clave in list(self._entradas):
+                if sheet_id is None or clave[0] == sheet_id:
+                    del self._entradas[clave]
+
+    def _actualizar(self, clave, entrada):
+        sheet_id, rango, columnas = clave
+        try:
+            version = self.obtener_version(sheet_id)
+        except Exception as e:
+            print(f"No se pudo consultar la versión de la hoja {sheet_id}: {e}")
+            version = None
+
+        if entrada and version is not None and version == entrada['version']:
+            with self._lock:
+                entrada['verificado'] = time.monotonic()
+            return entrada['valores'], {"version": version, "origen": "revalidado"}
+
+        print(f"Descargando la hoja {sheet_id} ({rango}), versión {version}.")
+        valores = self.descargar(sheet_id, rango, columnas)
+        with self._lock:
+            self._entradas[clave] = {
+                'valores': valores,
+                'version': version,
+                # Sin versión conocida no se puede revalidar: se vuelve a descargar la próxima vez
+                'verificado': time.monotonic() if version is not None else float('-inf')
+            }
+        return valores, {"version": version, "origen": "descargado"}
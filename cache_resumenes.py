@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from metricas import metricas
+
+class CacheResumenes:
+    """
+    Caché en disco (SQLite) de resúmenes generados por IA, direccionada por contenido.
+
+    La clave es un hash del modelo, la versión de la plantilla del prompt y los
+    textos enviados, así que un hilo sin correos nuevos reutiliza el resumen anterior.
+    Se acota por cantidad de entradas (se desalojan las menos usadas recientemente)
+    y por antigüedad (ttl en segundos).
+    """
+
+    def __init__(self, ruta='resumenes.db', max_entradas=500, ttl=7 * 24 * 3600):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        with self._lock, self._conexion:
+            self._conexion.execute("""
+                CREATE TABLE IF NOT EXISTS resumenes (
+                    clave TEXT PRIMARY KEY,
+                    resumen TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    accedido REAL NOT NULL
+                )
+            """)
+
+    @staticmethod
+    def clave(modelo, version_prompt, textos):
+        contenido = json.dumps([modelo, version_prompt, list(textos)], ensure_ascii=False)
+        return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+    def obtener(self, clave):
+        """Devuelve el resumen guardado o None si no existe o está vencido."""
+        ahora = time.time()
+        with self._lock, self._conexion:
+            fila = self._conexion.execute(
+                "SELECT resumen, creado FROM resumenes WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila and ahora - fila[1] <= self.ttl:
+                self._conexion.execute("UPDATE resumenes SET accedido = ? WHERE clave = ?", (ahora, clave))
+                self.aciertos += 1
+                metricas.incrementar('cache_consultas_total', cache='resumenes', resultado='acierto')
+                return fila[0]
+            if fila:
+                self._conexion.execute("DELETE FROM resumenes WHERE clave = ?", (clave,))
+            self.fallos += 1
+            metricas.incrementar('cache_consultas_total', cache='resumenes', resultado='fallo')
+            return None
+
+    def guardar(self, clave, resumen):
+        ahora = time.time()
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO resumenes (clave, resumen, creado, accedido) VALUES (?, ?, ?, ?)",
+                (clave, resumen, ahora, ahora)
+            )
+            self._conexion.execute("DELETE FROM resumenes WHERE creado < ?", (ahora - self.ttl,))
+            self._conexion.execute("""
+                DELETE FROM resumenes WHERE clave IN (
+                    SELECT clave FROM resumenes ORDER BY accedido DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entradas,))
+
+    def recientes(self, limite=20):
+        """Resúmenes vigentes usados más recientemente: [(resumen, creado), ...]."""
+        with self._lock:
+            return self._conexion.execute(
+                "SELECT resumen, creado FROM resumenes WHERE creado >= ? ORDER BY accedido DESC LIMIT ?",
+                (time.time() - self.ttl, limite)
+            ).fetchall()
+
+    def estadisticas(self):
+        with self._lock:
+            entradas = self._conexion.execute("SELECT COUNT(*) FROM resumenes").fetchone()[0]
+            total = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / total, 3) if total else 0.0,
+                "entradas": entradas,
+                "max_entradas": self.max_entradas,
+                "ttl_segundos": self.ttl
+            }
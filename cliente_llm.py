@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+
+from metricas import metricas
+
+# Códigos HTTP que indican cuota agotada o una falla transitoria del servicio
+CODIGOS_REINTENTABLES = (429, 500, 502, 503, 504)
+
+def es_reintentable(error):
+    """True si vale la pena reintentar: 429/5xx (google.api_core expone el código HTTP en 'code') o errores de red."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return getattr(error, 'code', None) in CODIGOS_REINTENTABLES
+
+class CubetaTokens:
+    """
+    Limitador de tasa: se acumula 'tasa' permisos por segundo hasta 'capacidad'
+    (lo que permite ráfagas cortas) y cada llamada consume uno.
+    """
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self._disponibles = float(capacidad)
+        self._ultima = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tomar(self, timeout=None):
+        """Espera hasta obtener un permiso. Devuelve False si pasan 'timeout' segundos sin obtenerlo."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._disponibles = min(self.capacidad, self._disponibles + (ahora - self._ultima) * self.tasa)
+                self._ultima = ahora
+                if self._disponibles >= 1:
+                    self._disponibles -= 1
+                    return True
+                espera = (1 - self._disponibles) / self.tasa
+            if limite is not None:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return False
+                espera = min(espera, restante)
+            time.sleep(espera)
+
+class _LlamadaEnCurso:
+    def __init__(self):
+        self.evento = threading.Event()
+        self.texto = None
+        self.error = None
+
+class ClienteLLM:
+    """
+    Cliente compartido para el modelo generativo (Gemini).
+
+    - El modelo se crea una sola vez con 'crear_modelo()' y se reutiliza.
+    - Como mucho 'max_concurrentes' llamadas al servicio al mismo tiempo.
+    - Limitador de tasa de 'por_minuto' llamadas por minuto con ráfagas de hasta
+      'rafaga' (0 = sin límite); cada reintento también consume un permiso.
+    - Los errores 429/5xx se reintentan hasta 'reintentos' veces con espera
+      exponencial con jitter ('espera_base' * 2^intento, como mucho 'espera_max').
+    - Si varias solicitudes piden el mismo prompt al mismo tiempo se hace una sola
+      llamada: las demás esperan el resultado de la primera.
+
+    Las llamadas son bloqueantes, como el resto de la aplicación (Flask con hilos):
+    las esperas solo ocupan el hilo de la solicitud que las hizo.
+    """
+
+    def __init__(self, crear_modelo, max_concurrentes=4, por_minuto=60, rafaga=10, reintentos=4,
+                 espera_base=1.0, espera_max=30.0, timeout_cola=120):
+        self.crear_modelo = crear_modelo
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_max = espera_max
+        self.timeout_cola = timeout_cola
+        self._modelo = None
+        self._lock = threading.Lock()
+        self._semaforo = threading.BoundedSemaphore(max_concurrentes)
+        self._cubeta = CubetaTokens(por_minuto / 60, max(1, rafaga)) if por_minuto > 0 else None
+        self._en_curso = {}  # prompt -> _LlamadaEnCurso
+
+    @property
+    def modelo(self):
+        with self._lock:
+            if self._modelo is None:
+                self._modelo = self.crear_modelo()
+            return self._modelo
+
+    def generar(self, prompt, al_recibir_token=None):
+        """
+        Devuelve el texto generado (o None). Con 'al_recibir_token' se usa la API de
+        streaming y se entrega cada fragmento; si la respuesta llega de una llamada
+        idéntica que ya estaba en curso, se entrega completa en un solo fragmento.
+        """
+        with self._lock:
+            llamada = self._en_curso.get(prompt)
+            propia = llamada is None
+            if propia:
+                llamada = self._en_curso[prompt] = _LlamadaEnCurso()
+
+        if not propia:
+            metricas.incrementar('gemini_coalescidas_total')
+            llamada.evento.wait()
+            if llamada.error is not None:
+                raise llamada.error
+            if al_recibir_token and llamada.texto:
+                al_recibir_token(llamada.texto)
+            return llamada.texto
+
+        try:
+            llamada.texto = self._llamar_con_reintentos(prompt, al_recibir_token)
+            return llamada.texto
+        except Exception as e:
+            llamada.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_curso[prompt]
+            llamada.evento.set()
+
+    def _llamar_con_reintentos(self, prompt, al_recibir_token):
+        for intento in range(self.reintentos + 1):
+            fragmentos = []
+            try:
+                return self._llamar(prompt, al_recibir_token, fragmentos)
+            except Exception as e:
+                # Si ya se transmitieron fragmentos no se reintenta: se repetirían
+                if fragmentos or intento >= self.reintentos or not es_reintentable(e):
+                    raise
+                espera = min(self.espera_max, self.espera_base * 2 ** intento)
+                espera = random.uniform(espera / 2, espera)
+                metricas.incrementar('gemini_reintentos_total')
+                print(f"Gemini respondió con un error transitorio ({e}); reintento {intento + 1} de {self.reintentos} en {espera:.1f}s.")
+                time.sleep(espera)
+
+    def _llamar(self, prompt, al_recibir_token, fragmentos):
+        if self._cubeta is not None and not self._cubeta.tomar(self.timeout_cola):
+            raise RuntimeError("Se superó el límite de solicitudes a Gemini; intenta de nuevo en unos segundos.")
+        if not self._semaforo.acquire(timeout=self.timeout_cola):
+            raise RuntimeError("Demasiadas solicitudes a Gemini en curso; intenta de nuevo en unos segundos.")
+        try:
+            metricas.incrementar('gemini_llamadas_total')
+            metricas.incrementar('gemini_caracteres_prompt_total', len(prompt))
+            if not al_recibir_token:
+                response = self.modelo.generate_content(prompt)
+                return response.text if response else None
+            for fragmento in self.modelo.generate_content(prompt, stream=True):
+                texto = fragmento.text
+                if texto:
+                    fragmentos.append(texto)
+                    al_recibir_token(texto)
+            return "".join(fragmentos) if fragmentos else None
+        finally:
+            self._semaforo.release()
@@ -1,9 +1,20 @@
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+import google_auth_httplib2
+import httplib2
+import json
 import os
 import pickle
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta, timezone
+
+from metricas import metricas
+
+try:
+    from googleapiclient.discovery_cache import get_static_doc
+except ImportError:  # versiones antiguas de google-api-python-client
+    get_static_doc = None
 
 # Alcances necesarios para Google Drive y Google Sheets
 SCOPES = [
@@ -30,12 +41,84 @@ def autenticar():
             pickle.dump(creds, token)
     return creds
 
+# --- Registro de servicios compartido por todo el proceso ---
+# Las credenciales se guardan en memoria y se renuevan antes de vencer; el documento
+# discovery de cada API se carga una sola vez; cada hilo reutiliza su propio transporte
+# HTTP (httplib2 no es seguro entre hilos) y los servicios construidos sobre él.
+MARGEN_RENOVACION = timedelta(minutes=5)
+DIRECTORIO_DISCOVERY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discovery')
+TIMEOUT_HTTP = 60
+
+_credenciales = None
+_lock_credenciales = threading.Lock()
+_documentos_discovery = {}
+_lock_discovery = threading.Lock()
+_servicios_hilo = threading.local()
+
+def _requiere_renovacion(creds):
+    if not creds.valid:
+        return True
+    # google-auth guarda 'expiry' como UTC sin zona horaria
+    ahora_utc = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry is not None and creds.expiry - MARGEN_RENOVACION <= ahora_utc
+
+def obtener_credenciales():
+    """Devuelve las credenciales en memoria, renovándolas si están por vencer."""
+    global _credenciales
+    with _lock_credenciales:
+        if _credenciales is None:
+            _credenciales = autenticar()
+        elif _requiere_renovacion(_credenciales):
+            if _credenciales.refresh_token:
+                _credenciales.refresh(Request())
+                with open('token.pickle', 'wb') as token:
+                    pickle.dump(_credenciales, token)
+            else:
+                _credenciales = autenticar()
+        return _credenciales
+
+def _documento_discovery(api, version):
+    """
+    Documento discovery de la API, cargado una sola vez: primero desde la carpeta
+    local 'discovery/' (ej: discovery/sheets.v4.json) y si no existe, desde la copia
+    estática que trae google-api-python-client. Devuelve None si no hay ninguna.
+    """
+    clave = (api, version)
+    with _lock_discovery:
+        if clave not in _documentos_discovery:
+            contenido = None
+            ruta = os.path.join(DIRECTORIO_DISCOVERY, f"{api}.{version}.json")
+            if os.path.exists(ruta):
+                with open(ruta, encoding='utf-8') as archivo:
+                    contenido = archivo.read()
+            elif get_static_doc:
+                contenido = get_static_doc(api, version)
+            if contenido is None:
+                print(f"No hay copia local del discovery de {api} {version}; se descargará en cada construcción.")
+            _documentos_discovery[clave] = json.loads(contenido) if contenido else None
+        return _documentos_discovery[clave]
+
+def _construir_servicio(api, version, http):
+    documento = _documento_discovery(api, version)
+    if documento is None:
+        return build(api, version, http=http)
+    return build_from_document(documento, http=http)
+
 # Crear servicios para Google Drive y Google Sheets
+@metricas.medir('google_servicios')
 def crear_servicios():
-    creds = autenticar()
-    drive_service = build('drive', 'v3', credentials=creds)
-    sheets_service = build('sheets', 'v4', credentials=creds)
-    return drive_service, sheets_service
+    creds = obtener_credenciales()
+    servicios = getattr(_servicios_hilo, 'servicios', None)
+    # Si las credenciales se reemplazaron (nueva autenticación) se reconstruyen los servicios;
+    # una renovación modifica el mismo objeto y el transporte la ve sin reconstruir nada.
+    if servicios is None or _servicios_hilo.credenciales is not creds:
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=TIMEOUT_HTTP))
+        drive_service = _construir_servicio('drive', 'v3', http)
+        sheets_service = _construir_servicio('sheets', 'v4', http)
+        servicios = (drive_service, sheets_service)
+        _servicios_hilo.servicios = servicios
+        _servicios_hilo.credenciales = creds
+    return servicios
 
 # Ejemplo 1: Listar archivos en Google Drive
 def listar_archivos(drive_service):
@@ -51,7 +134,8 @@ def listar_archivos(drive_service):
 # Ejemplo 2: Leer datos de una hoja de cálculo de Google Sheets
 def leer_hoja_de_calculo(sheets_service, sheet_id, rango):
     sheet = sheets_service.spreadsheets()
-    result = sheet.values().get(spreadsheetId=sheet_id, range=rango).execute()
+    with metricas.medir('sheets_leer'):
+        result = sheet.values().get(spreadsheetId=sheet_id, range=rango).execute()
     valores = result.get('values', [])
     if not valores:
         print("No se encontraron datos.")
@@ -59,6 +143,15 @@ def leer_hoja_de_calculo(sheets_service, sheet_id, rango):
         for fila in valores:
             print(fila)
 
+def obtener_version_archivo(drive_service, file_id):
+    """
+    Devuelve una cadena que cambia cada vez que se modifica el archivo en Drive,
+    armada con los campos 'version' y 'modifiedTime' de sus metadatos.
+    """
+    with metricas.medir('drive_version'):
+        meta = drive_service.files().get(fileId=file_id, fields='version, modifiedTime').execute()
+    return f"{meta.get('version', '')}|{meta.get('modifiedTime', '')}"
+
 def buscar_archivos_drive(drive_service, query, max_results=10):
     """
     Busca archivos en Google Drive según los criterios especificados.
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import re
+from datetime import datetime, timezone
+
+_PATRON_ID = re.compile(r"<[^<>\s]+>")
+
+def extraer_ids(texto):
+    """Message-IDs ('<...>') que aparecen en un encabezado, en orden."""
+    return _PATRON_ID.findall(texto or '')
+
+def normalizar_id(texto):
+    """'abc@x' o ' <abc@x> ' -> '<abc@x>'; None si está vacío."""
+    texto = (texto or '').strip()
+    if not texto:
+        return None
+    ids = extraer_ids(texto)
+    return ids[0] if ids else f"<{texto.strip('<>')}>"
+
+def referencias_correo(datos):
+    """IDs a los que responde el correo, del más antiguo al más reciente (References + In-Reply-To)."""
+    referencias = extraer_ids(datos.get('references'))
+    for id_respuesta in extraer_ids(datos.get('in_reply_to'))[:1]:
+        if id_respuesta not in referencias:
+            referencias.append(id_respuesta)
+    return referencias
+
+def deduplicar_correos(lista_datos):
+    """
+    Deja la primera copia de cada Message-ID (el mismo correo puede aparecer en
+    varias carpetas o etiquetas). Los correos sin Message-ID se conservan todos.
+    """
+    vistos = set()
+    unicos = []
+    for datos in lista_datos:
+        id_mensaje = normalizar_id(datos.get('message_id'))
+        if id_mensaje is not None:
+            if id_mensaje in vistos:
+                continue
+            vistos.add(id_mensaje)
+        unicos.append(datos)
+    return unicos
+
+def marca_tiempo(datos):
+    """Fecha completa del correo como timestamp (las fechas sin zona se toman como UTC)."""
+    try:
+        fecha = datetime.fromisoformat(datos.get('fecha') or '')
+    except ValueError:
+        return float('-inf')
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return fecha.timestamp()
+
+def _clave_orden(datos):
+    return (marca_tiempo(datos), int(datos['uid']) if str(datos.get('uid', '')).isdigit() else 0)
+
+def _es_ancestro(posible, contenedor):
+    while contenedor is not None:
+        if contenedor is posible:
+            return True
+        contenedor = contenedor['padre']
+    return False
+
+def _enlazar(padre, hijo):
+    if hijo['padre'] is not None:
+        hijo['padre']['hijos'].remove(hijo)
+    hijo['padre'] = padre
+    padre['hijos'].append(hijo)
+
+def construir_hilos(lista_datos):
+    """
+    Arma las conversaciones con el algoritmo de hilos de JWZ sobre Message-ID,
+    In-Reply-To y References (sin agrupar por asunto: dos correos con asuntos
+    parecidos pero sin referencias en común quedan en hilos distintos).
+
+    Devuelve una lista de hilos ordenada por el primer correo de cada uno:
+    {"id": Message-ID de la raíz, "asunto", "mensajes": [datos en orden cronológico
+    completo], "arbol": [nodos en orden de lectura con 'padre' (Message-ID) y 'nivel']}.
+    Los UIDs no alcanzan para identificar nodos porque los correos pueden venir de varias carpetas.
+    Si falta el mensaje raíz (no se descargó), los que le responden quedan en el mismo hilo.
+    """
+    contenedores = {}
+
+    def contenedor(id_mensaje):
+        if id_mensaje not in contenedores:
+            contenedores[id_mensaje] = {"id": id_mensaje, "datos": None, "padre": None, "hijos": []}
+        return contenedores[id_mensaje]
+
+    for posicion, datos in enumerate(lista_datos):
+        id_mensaje = normalizar_id(datos.get('message_id'))
+        if id_mensaje is None or (id_mensaje in contenedores and contenedores[id_mensaje]['datos'] is not None):
+            # Sin Message-ID o repetido: se le da uno propio para no pisar al otro
+            id_mensaje = f"<sin-id-{datos.get('uid')}-{posicion}>"
+        actual = contenedor(id_mensaje)
+        actual['datos'] = datos
+
+        # Cada referencia es hija de la anterior, salvo que ya tenga padre o se forme un ciclo
+        anterior = None
+        for referencia in referencias_correo(datos):
+            siguiente = contenedor(referencia)
+            if anterior is not None and siguiente['padre'] is None and not _es_ancestro(siguiente, anterior):
+                _enlazar(anterior, siguiente)
+            anterior = siguiente
+
+        # El padre del correo es su última referencia (reemplaza lo que se haya supuesto antes)
+        if anterior is not None and anterior is not actual and not _es_ancestro(actual, anterior):
+            _enlazar(anterior, actual)
+
+    # Primer correo (por fecha) de cada subárbol, para ordenar hermanos e hilos
+    primera = {}
+    pila = [(c, False) for c in contenedores.values() if c['padre'] is None]
+    while pila:
+        nodo, procesado = pila.pop()
+        if not procesado:
+            pila.append((nodo, True))
+            pila.extend((hijo, False) for hijo in nodo['hijos'])
+            continue
+        candidatos = [primera[id(hijo)] for hijo in nodo['hijos']]
+        if nodo['datos'] is not None:
+            candidatos.append(_clave_orden(nodo['datos']))
+        primera[id(nodo)] = min(candidatos) if candidatos else None
+
+    raices = [c for c in contenedores.values() if c['padre'] is None and primera[id(c)] is not None]
+    raices.sort(key=lambda c: primera[id(c)])
+
+    hilos = []
+    for raiz in raices:
+        arbol = []
+        mensajes = []
+        # Recorrido en profundidad; los contenedores vacíos no se muestran y sus hijos suben de nivel
+        pila = [(raiz, None, 0)]
+        while pila:
+            nodo, id_padre, nivel = pila.pop()
+            hijos = sorted((h for h in nodo['hijos'] if primera[id(h)] is not None), key=lambda h: primera[id(h)])
+            if nodo['datos'] is not None:
+                datos = nodo['datos']
+                mensajes.append(datos)
+                arbol.append({
+                    "uid": datos.get('uid'),
+                    "carpeta": datos.get('carpeta', 'INBOX'),
+                    "message_id": nodo['id'],
+                    "padre": id_padre,
+                    "nivel": nivel,
+                    "fecha": datos.get('fecha', ''),
+                    "remitente": datos.get('remitente', ''),
+                    "asunto": datos.get('asunto', '')
+                })
+                id_padre, nivel = nodo['id'], nivel + 1
+            pila.extend((hijo, id_padre, nivel) for hijo in reversed(hijos))
+        mensajes.sort(key=_clave_orden)
+        hilos.append({
+            "id": raiz['id'],
+            "asunto": mensajes[0].get('asunto', '') if mensajes else '',
+            "mensajes": mensajes,
+            "arbol": arbol
+        })
+    return hilos
+
+def buscar_hilo(hilos, id_mensaje):
+    """Devuelve el hilo que contiene el Message-ID indicado (raíz o cualquier correo), o None."""
+    id_mensaje = normalizar_id(id_mensaje)
+    for hilo in hilos:
+        if hilo['id'] == id_mensaje or any(nodo['message_id'] == id_mensaje for nodo in hilo['arbol']):
+            return hilo
+    return None
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import re
+
+# Tokens de una respuesta IMAP: paréntesis, cadenas entre comillas, NIL y átomos
+_TOKEN_IMAP = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+
+def parsear_lista_imap(texto):
+    """
+    Convierte una lista IMAP entre paréntesis (ej: un BODYSTRUCTURE) en listas
+    anidadas de Python. Las cadenas se devuelven como str y NIL como None.
+    """
+    pila = [[]]
+    for token in _TOKEN_IMAP.findall(texto):
+        if token == b'(':
+            nueva = []
+            pila[-1].append(nueva)
+            pila.append(nueva)
+        elif token == b')':
+            if len(pila) == 1:
+                break
+            pila.pop()
+            if len(pila) == 1:
+                break
+        elif token.upper() == b'NIL':
+            pila[-1].append(None)
+        elif token.startswith(b'"'):
+            valor = re.sub(rb'\\(.)', rb'\1', token[1:-1])
+            pila[-1].append(valor.decode('utf-8', errors='replace'))
+        else:
+            pila[-1].append(token.decode('utf-8', errors='replace'))
+    return pila[0][0] if pila[0] else None
+
+def extraer_bodystructure(meta):
+    """Busca el BODYSTRUCTURE dentro del texto de una respuesta FETCH y lo parsea."""
+    posicion = meta.upper().find(b'BODYSTRUCTURE')
+    if posicion == -1:
+        return None
+    return parsear_lista_imap(meta[posicion + len(b'BODYSTRUCTURE'):])
+
+def _partes(estructura, prefijo=''):
+    """Recorre el BODYSTRUCTURE devolviendo (numero_de_seccion, parte) de cada parte simple."""
+    if not isinstance(estructura, list) or not estructura:
+        return
+    if isinstance(estructura[0], list):
+        # Multipart: las primeras posiciones son las partes hijas, luego el subtipo
+        numero = 0
+        for hijo in estructura:
+            if not isinstance(hijo, list):
+                break
+            numero += 1
+            yield from _partes(hijo, f"{prefijo}{numero}.")
+    else:
+        yield (prefijo[:-1] if prefijo else '1'), estructura
+
+def buscar_parte_texto(estructura, subtipos=('plain',)):
+    """
+    Devuelve la primera parte de texto del BODYSTRUCTURE cuyo subtipo esté en
+    'subtipos' como un diccionario con la sección, el tipo, la codificación y el charset.
+    """
+    if not estructura:
+        return None
+    for subtipo_buscado in subtipos:
+        for seccion, parte in _partes(estructura):
+            if len(parte) < 7:
+                continue
+            tipo = (parte[0] or '').lower()
+            subtipo = (parte[1] or '').lower()
+            if tipo != 'text' or subtipo != subtipo_buscado:
+                continue
+            parametros = parte[2] if isinstance(parte[2], list) else []
+            charset = 'utf-8'
+            for clave, valor in zip(parametros[::2], parametros[1::2]):
+                if (clave or '').lower() == 'charset' and valor:
+                    charset = valor
+            return {
+                'seccion': seccion,
+                'tipo': f"{tipo}/{subtipo}",
+                'codificacion': (parte[5] or '7bit').lower(),
+                'charset': charset,
+                'tamano': int(parte[6]) if str(parte[6]).isdigit() else None
+            }
+    return None
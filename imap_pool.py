@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import imaplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Errores que indican que la conexión ya no sirve y hay que descartarla
+ERRORES_CONEXION = (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError)
+
+class PoolIMAP:
+    """
+    Pool acotado y thread-safe de conexiones IMAP ya autenticadas.
+
+    - max_conexiones: cantidad máxima de conexiones prestadas al mismo tiempo.
+    - max_inactividad: segundos que una conexión libre puede quedar sin uso antes de cerrarse.
+    - verificar_tras: segundos de inactividad a partir de los cuales se hace NOOP antes de prestarla.
+    - timeout: segundos que se espera por una conexión libre antes de rendirse.
+    """
+
+    def __init__(self, fabrica, max_conexiones=4, max_inactividad=300, verificar_tras=30, timeout=30):
+        self.fabrica = fabrica
+        self.max_conexiones = max_conexiones
+        self.max_inactividad = max_inactividad
+        self.verificar_tras = verificar_tras
+        self.timeout = timeout
+        self._libres = deque()  # (conexion, ultimo_uso)
+        self._prestadas = set()
+        self._lock = threading.Lock()
+        self._cupos = threading.BoundedSemaphore(max_conexiones)
+
+    def obtener(self):
+        """Presta una conexión sana del pool o crea una nueva. Devuelve None si no fue posible."""
+        if not self._cupos.acquire(timeout=self.timeout):
+            print(f"Pool IMAP: no hay conexiones libres tras esperar {self.timeout}s.")
+            return None
+        try:
+            conexion = self._tomar_libre()
+            if conexion is None:
+                conexion = self.fabrica()
+            if conexion is None:
+                self._cupos.release()
+                return None
+            with self._lock:
+                self._prestadas.add(id(conexion))
+            return conexion
+        except Exception:
+            self._cupos.release()
+            raise
+
+    def devolver(self, conexion, descartar=False):
+        """Devuelve una conexión prestada. Si está rota o se pide descartarla, se cierra."""
+        if conexion is None:
+            return
+        with self._lock:
+            if id(conexion) not in self._prestadas:
+                return
+            self._prestadas.discard(id(conexion))
+        try:
+            if not descartar and conexion.state == 'SELECTED':
+                conexion.close()
+        except ERRORES_CONEXION as e:
+            print(f"Pool IMAP: conexión descartada al devolverla ({e}).")
+            descartar = True
+        if descartar or conexion.state == 'LOGOUT':
+            _cerrar(conexion)
+        else:
+            with self._lock:
+                self._libres.append((conexion, time.monotonic()))
+        self._cupos.release()
+
+    @contextmanager
+    def conexion(self):
+        """Context manager que presta una conexión y la devuelve al salir."""
+        conexion = self.obtener()
+        descartar = False
+        try:
+            yield conexion
+        except imaplib.IMAP4.abort:
+            descartar = True
+            raise
+        finally:
+            self.devolver(conexion, descartar)
+
+    def ejecutar(self, funcion, reintentos=1):
+        """
+        Ejecuta funcion(conexion) con una conexión del pool. Si el servidor
+        corta la conexión (IMAP4.abort) se descarta y se reintenta con otra.
+        """
+        for intento in range(reintentos + 1):
+            conexion = self.obtener()
+            if conexion is None:
+                return None
+            try:
+                resultado = funcion(conexion)
+            except imaplib.IMAP4.abort as e:
+                self.devolver(conexion, descartar=True)
+                if intento >= reintentos:
+                    raise
+                print(f"Pool IMAP: conexión abortada ({e}), reconectando...")
+                continue
+            except Exception:
+                self.devolver(conexion)
+                raise
+            self.devolver(conexion)
+            return resultado
+
+    def cerrar_todas(self):
+        """Cierra todas las conexiones libres (las prestadas se cierran al devolverse)."""
+        with self._lock:
+            libres = list(self._libres)
+            self._libres.clear()
+        for conexion, _ in libres:
+            _cerrar(conexion)
+
+    def estado(self):
+        with self._lock:
+            return {
+                "libres": len(self._libres),
+                "prestadas": len(self._prestadas),
+                "max_conexiones": self.max_conexiones
+            }
+
+    def _tomar_libre(self):
+        ahora = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._libres:
+                    return None
+                # La más reciente primero: las viejas quedan al fondo y se desalojan
+                conexion, ultimo_uso = self._libres.pop()
+                vencidas = [c for c, uso in self._libres if ahora - uso > self.max_inactividad]
+                self._libres = deque((c, uso) for c, uso in self._libres if ahora - uso <= self.max_inactividad)
+            for vieja in vencidas:
+                _cerrar(vieja)
+            if ahora - ultimo_uso > self.max_inactividad:
+                _cerrar(conexion)
+                continue
+            if ahora - ultimo_uso > self.verificar_tras:
+                try:
+                    status, _ = conexion.noop()
+                    if status != 'OK':
+                        raise imaplib.IMAP4.error(f"NOOP devolvió {status}")
+                except ERRORES_CONEXION as e:
+                    print(f"Pool IMAP: conexión inactiva descartada ({e}).")
+                    _cerrar(conexion)
+                    continue
+            return conexion
+
+def _cerrar(conexion):
+    try:
+        conexion.logout()
+    except Exception:
+        pass
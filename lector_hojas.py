@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+from google_api import crear_servicios
+from metricas import metricas
+
+# Rango en notación A1 con columnas explícitas: Hoja!A1:Z, Hoja!A:Z, Hoja!B2:F500
+_PATRON_RANGO = re.compile(r"^(?:(?P<hoja>.+)!)?(?P<col_ini>[A-Za-z]+)(?P<fila_ini>\d*):(?P<col_fin>[A-Za-z]+)(?P<fila_fin>\d*)$")
+
+# Hilos compartidos por todas las lecturas: viven mientras viva el proceso, así cada uno
+# conserva sus servicios de Sheets y su transporte HTTP (ver crear_servicios)
+_executor = None
+_lock_executor = threading.Lock()
+
+def _obtener_executor(max_workers):
+    """Executor de lectura de bloques; se crea en la primera lectura con 'max_workers' hilos."""
+    global _executor
+    with _lock_executor:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lector_hojas')
+        return _executor
+
+def columna_a_indice(columna):
+    """'A' -> 0, 'Z' -> 25, 'AA' -> 26"""
+    indice = 0
+    for letra in columna.upper():
+        indice = indice * 26 + (ord(letra) - ord('A') + 1)
+    return indice - 1
+
+def indice_a_columna(indice):
+    """0 -> 'A', 25 -> 'Z', 26 -> 'AA'"""
+    columna = ""
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        columna = chr(ord('A') + resto) + columna
+    return columna
+
+def parsear_rango(rango):
+    """Devuelve (hoja, col_ini, fila_ini, col_fin, fila_fin) con índices de columna desde 0, o None."""
+    coincidencia = _PATRON_RANGO.match(rango.strip())
+    if not coincidencia:
+        return None
+    return (
+        coincidencia.group('hoja'),
+        columna_a_indice(coincidencia.group('col_ini')),
+        int(coincidencia.group('fila_ini') or 1),
+        columna_a_indice(coincidencia.group('col_fin')),
+        int(coincidencia.group('fila_fin')) if coincidencia.group('fila_fin') else None
+    )
+
+def _tramos_contiguos(indices):
+    """[1, 2, 3, 7] -> [(1, 3), (7, 7)]: así cada tramo se pide como un solo rango."""
+    tramos = []
+    for indice in sorted(indices):
+        if tramos and indice == tramos[-1][1] + 1:
+            tramos[-1] = (tramos[-1][0], indice)
+        else:
+            tramos.append((indice, indice))
+    return tramos
+
+def _a1(hoja, col_ini, fila_ini, col_fin, fila_fin):
+    prefijo = f"{hoja}!" if hoja else ""
+    return f"{prefijo}{indice_a_columna(col_ini)}{fila_ini}:{indice_a_columna(col_fin)}{fila_fin}"
+
+@metricas.medir('sheets_leer')
+def _cantidad_filas(sheets_service, sheet_id, hoja):
+    respuesta = sheets_service.spreadsheets().get(
+        spreadsheetId=sheet_id,
+        ranges=[hoja] if hoja else None,
+        fields='sheets(properties(gridProperties(rowCount)))'
+    ).execute()
+    return respuesta['sheets'][0]['properties']['gridProperties']['rowCount']
+
+def _leer_bloque(sheet_id, rangos, anchos, cantidad, completar):
+    """
+    Pide con un solo batchGet los rangos de un bloque de filas y arma las filas
+    uniendo los tramos de columnas. Devuelve exactamente 'cantidad' filas.
+    """
+    # httplib2 no es seguro entre hilos: cada hilo usa sus propios servicios
+    _, sheets_service = crear_servicios()
+    with metricas.medir('sheets_leer'):
+        respuesta = sheets_service.spreadsheets().values().batchGet(
+            spreadsheetId=sheet_id, ranges=rangos, majorDimension='ROWS'
+        ).execute()
+    por_tramo = [rango_valores.get('values', []) for rango_valores in respuesta.get('valueRanges', [])]
+
+    filas = []
+    for i in range(cantidad):
+        fila = []
+        for numero, (valores, ancho) in enumerate(zip(por_tramo, anchos)):
+            celdas = valores[i] if i < len(valores) else []
+            if completar or numero < len(anchos) - 1:
+                # Los tramos intermedios se completan para que las columnas no se corran.
+                # Sin proyección el último queda recortado como lo devuelve values().get;
+                # con proyección se completa, porque la API recorta por las columnas pedidas
+                # y no por la fila entera (una celda vacía no debe verse como faltante)
+                celdas = celdas + [""] * (ancho - len(celdas))
+            fila.extend(celdas)
+        filas.append(fila if any(fila) else [])
+    return filas
+
+def leer_filas(sheet_id, rango, columnas=None, filas_por_bloque=5000, max_workers=4):
+    """
+    Lee un rango grande de Google Sheets por bloques de filas.
+
+    Devuelve (encabezados, filas) donde 'filas' es un generador que entrega las
+    filas en orden a medida que llegan los bloques. Los bloques se piden con
+    values().batchGet, con hasta 'max_workers' pedidos en paralelo en un executor
+    compartido por todas las lecturas.
+
+    - columnas: nombres de columnas a descargar (sin distinguir mayúsculas); si se
+      indican, solo se piden esas columnas y encabezados/filas quedan en ese orden
+      de hoja. Los nombres que no existen se omiten.
+
+    Si el rango no tiene columnas explícitas (ej: 'Hoja1') se lee con un solo values().get.
+    """
+    _, sheets_service = crear_servicios()
+    partes = parsear_rango(rango)
+    if partes is None:
+        with metricas.medir('sheets_leer'):
+            valores = sheets_service.spreadsheets().values().get(spreadsheetId=sheet_id, range=rango).execute().get('values', [])
+        return (valores[0] if valores else []), iter(valores[1:])
+
+    hoja, col_ini, fila_ini, col_fin, fila_fin = partes
+    with metricas.medir('sheets_leer'):
+        encabezados = sheets_service.spreadsheets().values().get(
+            spreadsheetId=sheet_id, range=_a1(hoja, col_ini, fila_ini, col_fin, fila_ini)
+        ).execute().get('values', [[]])
+    encabezados = encabezados[0] if encabezados else []
+
+    if columnas:
+        buscadas = {c.strip().lower() for c in columnas}
+        indices = [i for i, h in enumerate(encabezados) if isinstance(h, str) and h.strip().lower() in buscadas]
+    else:
+        indices = list(range(col_fin - col_ini + 1))
+    if not indices:
+        return [], iter(())
+    if columnas:
+        encabezados = [encabezados[i] for i in indices]
+    tramos = _tramos_contiguos(indices)
+
+    ultima_fila = _cantidad_filas(sheets_service, sheet_id, hoja)
+    if fila_fin:
+        ultima_fila = min(ultima_fila, fila_fin)
+
+    bloques = []
+    for inicio in range(fila_ini + 1, ultima_fila + 1, filas_por_bloque):
+        fin = min(inicio + filas_por_bloque - 1, ultima_fila)
+        rangos = [_a1(hoja, col_ini + a, inicio, col_ini + b, fin) for a, b in tramos]
+        bloques.append((rangos, fin - inicio + 1))
+    anchos = [b - a + 1 for a, b in tramos]
+    completar = bool(columnas)
+    print(f"Leyendo {rango} en {len(bloques)} bloque(s) de hasta {filas_por_bloque} filas, {len(tramos)} tramo(s) de columnas.")
+
+    # Los bloques corren en otros hilos pero sus tiempos cuentan para la solicitud que lee la hoja
+    leer_bloque = metricas.propagar(_leer_bloque)
+
+    def generar():
+        vacias_pendientes = 0
+        executor = _obtener_executor(max_workers)
+        en_vuelo = deque()
+        pendientes = iter(bloques)
+        try:
+            for rangos, cantidad in pendientes:
+                en_vuelo.append(executor.submit(leer_bloque, sheet_id, rangos, anchos, cantidad, completar))
+                if len(en_vuelo) >= max_workers:
+                    break
+            while en_vuelo:
+                filas = en_vuelo.popleft().result()
+                siguiente = next(pendientes, None)
+                if siguiente:
+                    en_vuelo.append(executor.submit(leer_bloque, sheet_id, siguiente[0], anchos, siguiente[1], completar))
+                for fila in filas:
+                    if not fila:
+                        # Igual que values().get: las filas vacías del final no se devuelven
+                        vacias_pendientes += 1
+                        continue
+                    for _ in range(vacias_pendientes):
+                        yield []
+                    vacias_pendientes = 0
+                    yield fila
+        finally:
+            # Si la lectura se corta, los bloques que no empezaron no ocupan el executor compartido
+            for futuro in en_vuelo:
+                futuro.cancel()
+
+    return encabezados, generar()
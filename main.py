@@ -1,76 +1,241 @@
 # -*- coding: utf-8 -*-
 import imaplib
-import email
-from email.header import decode_header
-from email.utils import parsedate_to_datetime
 import json
 import os
 from datetime import datetime, timedelta
 import re  # Importar re para limpieza de texto si es necesario
+import threading
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 import random  # Importar random para generar colores aleatorios
 
 # Importaciones de IA Generativa de Google
 import google.generativeai as genai
 
 # Importaciones de Flask
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
 
 # Importaciones de Google API
-from google_api import crear_servicios, listar_archivos, leer_hoja_de_calculo, buscar_archivos_drive
+from imap_pool import PoolIMAP
+from parseo_correos import ProcesadorCorreos
+from cache_hojas import CacheHojas
+from lector_hojas import leer_filas
+from rollups import RollupsFallas, GRANULARIDADES
+from analisis_columnas import tipar_columnas, a_lista, generar_digesto, formatear_digesto
+from agregacion import agregar_filas, indices_columnas, top_n, top_n_por_grupo
+from imap_estructura import extraer_bodystructure, buscar_parte_texto
+from almacen_correos import AlmacenCorreos
+from hilos_correos import construir_hilos, buscar_hilo, deduplicar_correos
+from cache_resumenes import CacheResumenes
+from trabajos import GestorTrabajos, ColaLlena
+from metricas import metricas
+from cliente_llm import ClienteLLM
+from recuperacion import IndiceBM25, palabras_clave, seleccionar_dentro_de_presupuesto, describir_datos_analisis
+from google_api import (crear_servicios, listar_archivos, leer_hoja_de_calculo, buscar_archivos_drive,
+                        obtener_version_archivo)
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
 
 # --- Configuración ---
-IMAP_SERVER = 'imap.gmail.com'
+IMAP_SERVER = os.getenv('IMAP_SERVER', 'imap.gmail.com')
+# Puerto y SSL configurables para poder apuntar a un servidor local (ver benchmark.py)
+IMAP_PUERTO = int(os.getenv('IMAP_PUERTO', '993'))
+IMAP_SSL = os.getenv('IMAP_SSL', '1') != '0'
 EMAIL_USUARIO_FIJO = os.getenv('EMAIL_USUARIO')
 CONTRASENA_APP_FIJA = os.getenv('CONTRASENA_APP')
 
+# Cantidad de UIDs que se piden en cada UID FETCH (un round-trip por lote)
+IMAP_FETCH_TAMANO_LOTE = int(os.getenv('IMAP_FETCH_TAMANO_LOTE', '200'))
+IMAP_FETCH_TAMANO_LOTE_MAX = 1000
+
+# Modo de descarga: 'parcial' pide solo encabezados y los primeros bytes del texto,
+# 'completo' descarga el RFC822 entero (adjuntos incluidos)
+IMAP_FETCH_MODO = os.getenv('IMAP_FETCH_MODO', 'parcial')
+IMAP_FETCH_BYTES_CUERPO = int(os.getenv('IMAP_FETCH_BYTES_CUERPO', '4096'))
+# Si el correo solo tiene HTML se pide más, porque las etiquetas ocupan buena parte de los bytes
+IMAP_FETCH_BYTES_CUERPO_HTML = int(os.getenv('IMAP_FETCH_BYTES_CUERPO_HTML', '16384'))
+CAMPOS_ENCABEZADO_PARCIAL = "SUBJECT FROM DATE MESSAGE-ID IN-REPLY-TO REFERENCES"
+
+# Almacén local de correos ya descargados (solo se pide al servidor lo nuevo)
+ALMACEN_CORREOS_RUTA = os.getenv('ALMACEN_CORREOS_RUTA', 'correos.db')
+# Subir este número cuando cambie el diccionario que arma extraer_informacion_correo
+VERSION_EXTRACCION = 2
+
+# Pool de conexiones IMAP compartido entre solicitudes
+IMAP_POOL_MAX_CONEXIONES = int(os.getenv('IMAP_POOL_MAX_CONEXIONES', '4'))
+IMAP_POOL_MAX_INACTIVIDAD = int(os.getenv('IMAP_POOL_MAX_INACTIVIDAD', '300'))
+IMAP_POOL_TIMEOUT = int(os.getenv('IMAP_POOL_TIMEOUT', '30'))
+
+# Carpetas/etiquetas donde se buscan los correos de un asunto, separadas por coma
+# (ej: "INBOX,[Gmail]/Enviados"). Cada una se busca en paralelo con su propia conexión del pool
+IMAP_CARPETAS_BUSQUEDA = [c.strip() for c in os.getenv('IMAP_CARPETAS_BUSQUEDA', 'INBOX').split(',') if c.strip()]
+
+# Parseo MIME en un pool de procesos, en paralelo con la descarga (0 = parsear en el mismo hilo).
+# Por defecto se deja un núcleo libre para el servidor; con un solo núcleo no se usa el pool
+MIME_PROCESOS = int(os.getenv('MIME_PROCESOS', str(min(4, (os.cpu_count() or 1) - 1))))
+MIME_TAMANO_TAREA = int(os.getenv('MIME_TAMANO_TAREA', '20'))
+# Con menos correos que esto no conviene pagar el envío a otros procesos
+MIME_MINIMO_PARALELO = int(os.getenv('MIME_MINIMO_PARALELO', '50'))
+
+def _registrar_parseo(cantidad, segundos):
+    metricas.registrar_etapa('mime_parseo', segundos)
+    metricas.incrementar('correos_parseados_total', cantidad)
+
+procesador_correos = ProcesadorCorreos(MIME_PROCESOS, MIME_TAMANO_TAREA, MIME_MINIMO_PARALELO, _registrar_parseo)
+
+# Agrega a cada respuesta el encabezado Server-Timing con el tiempo de cada etapa
+# (IMAP, parseo, Gemini, Google APIs). Las métricas acumuladas se leen en /api/metrics
+METRICAS_SERVER_TIMING = os.getenv('METRICAS_SERVER_TIMING', '0') != '0'
+
 # API Key de Google
 GOOGLE_API_KEY_FIJA = os.getenv('GOOGLE_API_KEY')
 GEMINI_API_KEY_CONFIGURADA = False
-if GOOGLE_API_KEY_FIJA and GOOGLE_API_KEY_FIJA != "TU_GEMINI_API_KEY_AQUI":
-    try:
-        genai.configure(api_key=GOOGLE_API_KEY_FIJA)
-        GEMINI_API_KEY_CONFIGURADA = True
-        print("INFO: API Key de Google Gemini configurada directamente desde el código.")
-    except Exception as e:
-        print(f"ERROR: No se pudo configurar la API Key de Gemini: {e}")
+
+# Modelo de Gemini y versión de la plantilla del prompt de resumen.
+# Cambiar la versión cuando cambia el prompt para no reutilizar resúmenes viejos.
+MODELO_GEMINI = 'gemini-1.5-flash'
+VERSION_PROMPT_RESUMEN = 1
+
+# Cliente compartido de Gemini: llamadas simultáneas, llamadas por minuto (0 = sin límite),
+# ráfaga permitida y reintentos ante errores 429/5xx
+GEMINI_MAX_CONCURRENTES = int(os.getenv('GEMINI_MAX_CONCURRENTES', '4'))
+GEMINI_POR_MINUTO = int(os.getenv('GEMINI_POR_MINUTO', '60'))
+GEMINI_RAFAGA = int(os.getenv('GEMINI_RAFAGA', '10'))
+GEMINI_REINTENTOS = int(os.getenv('GEMINI_REINTENTOS', '4'))
+
+# 'completo' resume todo el hilo; 'incremental' resume solo lo nuevo y lo combina con el resumen anterior
+RESUMEN_MODO = os.getenv('RESUMEN_MODO', 'completo')
+
+# Resumen jerárquico (map-reduce) para hilos que no entran en un solo prompt
+MAX_CHARS_FOR_SUMMARY = int(os.getenv('RESUMEN_MAX_CHARS', '180000'))
+RESUMEN_TOKENS_POR_BLOQUE = int(os.getenv('RESUMEN_TOKENS_POR_BLOQUE', '30000'))
+RESUMEN_MAX_WORKERS = int(os.getenv('RESUMEN_MAX_WORKERS', '4'))
+
+# Caché de resúmenes ya generados
+CACHE_RESUMENES_RUTA = os.getenv('CACHE_RESUMENES_RUTA', 'resumenes.db')
+CACHE_RESUMENES_MAX_ENTRADAS = int(os.getenv('CACHE_RESUMENES_MAX_ENTRADAS', '500'))
+CACHE_RESUMENES_TTL = int(os.getenv('CACHE_RESUMENES_TTL', str(7 * 24 * 3600)))
+
+# Trabajos en segundo plano para búsquedas largas
+TRABAJOS_MAX_WORKERS = int(os.getenv('TRABAJOS_MAX_WORKERS', '2'))
+TRABAJOS_MAX_EN_COLA = int(os.getenv('TRABAJOS_MAX_EN_COLA', '20'))
+TRABAJOS_TTL_RESULTADOS = int(os.getenv('TRABAJOS_TTL_RESULTADOS', '3600'))
+
+# Copia en memoria de la base de datos de fallas (Google Sheets)
+BBDD_SHEET_ID = "1UeO_fORpKELd15gOzitXD3VMCZPMSIQpR6aX9A-eyaA"
+BBDD_RANGO = "Import!A1:Z"
+# Columnas que se descargan de la base de fallas (el resto de A:Z no se pide)
+# Columna con la fecha de cada falla, para las tendencias por día/semana
+BBDD_COLUMNA_FECHA = os.getenv('BBDD_COLUMNA_FECHA', 'Date')
+# Formato strptime de esa columna (ej: %m/%d/%Y); si no se indica se prueban los más comunes
+BBDD_FORMATO_FECHA = os.getenv('BBDD_FORMATO_FECHA') or None
+BBDD_COLUMNAS = ("TrackID", "Family", "TestCode", "Process", BBDD_COLUMNA_FECHA)
+# Segundos durante los que se usa la copia sin preguntar a Drive si el archivo cambió
+CACHE_HOJAS_REVALIDAR_CADA = float(os.getenv('CACHE_HOJAS_REVALIDAR_CADA', '10'))
+# Lectura por bloques de filas con values().batchGet
+HOJAS_FILAS_POR_BLOQUE = int(os.getenv('HOJAS_FILAS_POR_BLOQUE', '5000'))
+HOJAS_MAX_WORKERS = int(os.getenv('HOJAS_MAX_WORKERS', '4'))
+
+# Digesto estadístico que se envía a Gemini en lugar de las filas de la hoja
+ANALISIS_TOP = int(os.getenv('ANALISIS_TOP', '5'))
+ANALISIS_FILAS_MUESTRA = int(os.getenv('ANALISIS_FILAS_MUESTRA', '10'))
+ANALISIS_FILAS_MUESTRA_MAX = 50
+ANALISIS_MAX_CHARS_PROMPT = int(os.getenv('ANALISIS_MAX_CHARS_PROMPT', '12000'))
+
+# Asistente: fragmentos de correos guardados, resúmenes y agregados de la BBDD que se
+# agregan al prompt (los de mayor puntaje BM25 que entren en el presupuesto de tokens)
+ASISTENTE_PRESUPUESTO_TOKENS = int(os.getenv('ASISTENTE_PRESUPUESTO_TOKENS', '3000'))
+ASISTENTE_FRAGMENTOS = int(os.getenv('ASISTENTE_FRAGMENTOS', '8'))
+ASISTENTE_CANDIDATOS_CORREOS = int(os.getenv('ASISTENTE_CANDIDATOS_CORREOS', '200'))
+ASISTENTE_RESUMENES = int(os.getenv('ASISTENTE_RESUMENES', '20'))
+ASISTENTE_TURNOS_CONTEXTO = int(os.getenv('ASISTENTE_TURNOS_CONTEXTO', '6'))
+
+def leer_hoja(sheet_id, rango, columnas=None):
+    """Lee el rango por bloques y devuelve las filas con los encabezados como primera fila."""
+    encabezados, filas = leer_filas(sheet_id, rango, columnas, HOJAS_FILAS_POR_BLOQUE, HOJAS_MAX_WORKERS)
+    if not encabezados:
+        return []
+    return [encabezados] + list(filas)
+
+def _version_hoja(sheet_id):
+    drive_service, _ = crear_servicios()
+    return obtener_version_archivo(drive_service, sheet_id)
+
+cache_hojas = CacheHojas(leer_hoja, _version_hoja, CACHE_HOJAS_REVALIDAR_CADA)
+
+# Conteos por día/semana de la base de fallas, actualizados cuando cambia la copia de la hoja
+rollups_fallas = RollupsFallas({
+    "family": ("Family", "Sin Familia"),
+    "testcode": ("TestCode", "Sin TestCode"),
+    "proceso": ("Process", "Sin Proceso")
+}, BBDD_COLUMNA_FECHA, BBDD_FORMATO_FECHA)
+
+def inicializar_servicios():
+    """
+    Configura Gemini y crea el almacén de correos, la caché de resúmenes, el cliente
+    de Gemini y el gestor de trabajos. Solo lo llama el proceso de la aplicación: los
+    procesos del pool de parseo (spawn) vuelven a importar este script como
+    '__mp_main__' y no deben abrir las bases ni correr sus migraciones.
+    """
+    global GEMINI_API_KEY_CONFIGURADA, almacen_correos, cliente_gemini, cache_resumenes, gestor_trabajos
+    if GOOGLE_API_KEY_FIJA and GOOGLE_API_KEY_FIJA != "TU_GEMINI_API_KEY_AQUI":
+        try:
+            genai.configure(api_key=GOOGLE_API_KEY_FIJA)
+            GEMINI_API_KEY_CONFIGURADA = True
+            print("INFO: API Key de Google Gemini configurada directamente desde el código.")
+        except Exception as e:
+            print(f"ERROR: No se pudo configurar la API Key de Gemini: {e}")
+            GEMINI_API_KEY_CONFIGURADA = False
+    else:
+        print("ADVERTENCIA: La variable GOOGLE_API_KEY_FIJA no está configurada o es el valor placeholder. Los resúmenes IA con Gemini no funcionarán.")
         GEMINI_API_KEY_CONFIGURADA = False
-else:
-    print("ADVERTENCIA: La variable GOOGLE_API_KEY_FIJA no está configurada o es el valor placeholder. Los resúmenes IA con Gemini no funcionarán.")
-    GEMINI_API_KEY_CONFIGURADA = False
+
+    almacen_correos = AlmacenCorreos(ALMACEN_CORREOS_RUTA, VERSION_EXTRACCION)
+    cliente_gemini = ClienteLLM(lambda: genai.GenerativeModel(MODELO_GEMINI), GEMINI_MAX_CONCURRENTES,
+                                GEMINI_POR_MINUTO, GEMINI_RAFAGA, GEMINI_REINTENTOS)
+    cache_resumenes = CacheResumenes(CACHE_RESUMENES_RUTA, CACHE_RESUMENES_MAX_ENTRADAS, CACHE_RESUMENES_TTL)
+    gestor_trabajos = GestorTrabajos(TRABAJOS_MAX_WORKERS, TRABAJOS_MAX_EN_COLA, TRABAJOS_TTL_RESULTADOS)
+
+if __name__ != '__mp_main__':
+    inicializar_servicios()
 
 # --- Inicialización de Flask ---
 app = Flask(__name__)
 CORS(app)  # Esto es crucial para resolver el error de CORS
 
-def decodificar_asunto(header_string):
-    """Decodifica el encabezado del correo, manejando diferentes codificaciones."""
-    if not header_string:
-        return ""
-    decoded_parts = decode_header(header_string)
-    asunto_decodificado = []
-    for part, charset in decoded_parts:
-        if isinstance(part, bytes):
-            try:
-                asunto_decodificado.append(part.decode(charset or 'utf-8', errors='replace'))
-            except LookupError:
-                asunto_decodificado.append(part.decode('utf-8', errors='replace'))
-        else:
-            asunto_decodificado.append(part)
-    return "".join(asunto_decodificado)
+@app.before_request
+def iniciar_metricas_solicitud():
+    g.inicio_solicitud = time.perf_counter()
+    g.tiempos_etapas = metricas.iniciar_solicitud()
 
-def conectar_imap(email_usuario, contrasena_app):
+@app.after_request
+def registrar_metricas_solicitud(response):
+    if 'inicio_solicitud' not in g:
+        return response
+    duracion = time.perf_counter() - g.inicio_solicitud
+    ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+    metricas.observar('solicitud_segundos', duracion, ruta=ruta, metodo=request.method, codigo=response.status_code)
+    if METRICAS_SERVER_TIMING:
+        # En respuestas por streaming solo incluye lo ocurrido antes de empezar a transmitir
+        response.headers['Server-Timing'] = metricas.server_timing(g.tiempos_etapas, duracion)
+    return response
+
+@metricas.medir('imap_conectar')
+def _crear_conexion_imap(email_usuario, contrasena_app):
     """
     Se conecta al servidor IMAP de Gmail usando las credenciales proporcionadas.
     Devuelve el objeto de conexión IMAP.
     """
     try:
         print(f"Conectando a {IMAP_SERVER} como {email_usuario}...")
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
+        if IMAP_SSL:
+            mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PUERTO)
+        else:
+            mail = imaplib.IMAP4(IMAP_SERVER, IMAP_PUERTO)
         mail.login(email_usuario, contrasena_app)
         print("Conexión IMAP exitosa.")
         return mail
@@ -81,13 +246,45 @@ def conectar_imap(email_usuario, contrasena_app):
         print(f"Ocurrió un error inesperado durante la conexión: {e}")
         return None
 
-def buscar_correos_imap(mail_connection, asunto_buscado, fecha_desde_str=None, fecha_hasta_str=None):
+_pools_imap = {}
+_pools_imap_lock = threading.Lock()
+
+def obtener_pool_imap(email_usuario, contrasena_app):
+    """Devuelve (creándolo si hace falta) el pool de conexiones IMAP de una cuenta."""
+    with _pools_imap_lock:
+        pool = _pools_imap.get(email_usuario)
+        if pool is None:
+            pool = PoolIMAP(
+                lambda: _crear_conexion_imap(email_usuario, contrasena_app),
+                max_conexiones=IMAP_POOL_MAX_CONEXIONES,
+                max_inactividad=IMAP_POOL_MAX_INACTIVIDAD,
+                timeout=IMAP_POOL_TIMEOUT
+            )
+            _pools_imap[email_usuario] = pool
+        return pool
+
+def conectar_imap(email_usuario, contrasena_app):
+    """
+    Presta una conexión IMAP autenticada del pool de la cuenta.
+    Debe devolverse con liberar_imap cuando se termina de usar.
+    """
+    return obtener_pool_imap(email_usuario, contrasena_app).obtener()
+
+def liberar_imap(conexion, descartar=False):
+    """Devuelve al pool una conexión obtenida con conectar_imap."""
+    with _pools_imap_lock:
+        pools = list(_pools_imap.values())
+    for pool in pools:
+        pool.devolver(conexion, descartar)
+
+@metricas.medir('imap_buscar')
+def buscar_correos_imap(mail_connection, asunto_buscado, fecha_desde_str=None, fecha_hasta_str=None, carpeta='INBOX'):
     if not mail_connection:
         return []
     try:
-        status, _ = mail_connection.select('inbox', readonly=True)
+        status, _ = mail_connection.select(f'"{carpeta}"', readonly=True)
         if status != 'OK':
-            print("Error al seleccionar la bandeja de entrada.")
+            print(f"Error al seleccionar la carpeta {carpeta}.")
             return []
         
         # Construcción del criterio de búsqueda
@@ -121,7 +318,7 @@ def buscar_correos_imap(mail_connection, asunto_buscado, fecha_desde_str=None, f
         if not search_query.strip():
             return []
 
-        print(f"Buscando correos con el criterio: {search_query}")
+        print(f"Buscando correos en {carpeta} con el criterio: {search_query}")
         
         status, email_uids_bytes_list = mail_connection.uid('search', None, search_query)
 
@@ -134,93 +331,281 @@ def buscar_correos_imap(mail_connection, asunto_buscado, fecha_desde_str=None, f
             return []
         
         email_uids = email_uids_bytes_list[0].split()
-        print(f"Se encontraron {len(email_uids)} UIDs de correos.")
+        print(f"Se encontraron {len(email_uids)} UIDs de correos en {carpeta}.")
         return email_uids
+    except imaplib.IMAP4.abort:
+        # La conexión se cortó: el pool la descarta y reintenta con otra
+        raise
     except Exception as e:
         print(f"Ocurrió un error al buscar correos por IMAP: {e}")
         return []
 
-def obtener_y_parsear_correo_imap(mail_connection, email_uid):
-    if not mail_connection:
-        return None
+def compactar_uids(email_uids):
+    """
+    Convierte una lista de UIDs en un conjunto de secuencia IMAP compacto.
+    Por ejemplo [1, 5, 9, 10, 11] se convierte en '1,5,9:11'.
+    """
+    numeros = sorted({int(uid) for uid in email_uids})
+    rangos = []
+    for numero in numeros:
+        if rangos and numero == rangos[-1][1] + 1:
+            rangos[-1][1] = numero
+        else:
+            rangos.append([numero, numero])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in rangos)
+
+def _agrupar_respuesta_fetch(data):
+    """
+    Agrupa la respuesta de imaplib a un UID FETCH de varios mensajes.
+    Devuelve una lista de diccionarios con el texto de la respuesta ('meta')
+    y los literales recibidos por nombre de item (ej: 'RFC822', 'BODY[1]<0>').
+    """
+    mensajes = []
+    actual = None
+    for elemento in data or []:
+        if isinstance(elemento, tuple):
+            cabecera, literal = elemento
+            if re.match(rb'^\d+ \(', cabecera):
+                actual = {'meta': b'', 'literales': {}}
+                mensajes.append(actual)
+            elif actual is None:
+                continue
+            nombre = re.search(rb'((?:RFC822(?:\.HEADER|\.TEXT)?|BODY\[[^\]]*\](?:<\d+>)?)) \{\d+\}$', cabecera, re.IGNORECASE)
+            if nombre:
+                actual['meta'] += cabecera[:nombre.start()]
+                actual['literales'][nombre.group(1).upper().decode()] = literal
+            else:
+                # Literal que forma parte de otra estructura (ej: BODYSTRUCTURE)
+                texto = literal.replace(b'\\', b'\\\\').replace(b'"', b'\\"')
+                actual['meta'] += re.sub(rb'\{\d+\}$', b'', cabecera) + b'"' + texto + b'"'
+        elif isinstance(elemento, bytes):
+            if re.match(rb'^\d+ \(', elemento):
+                actual = {'meta': elemento, 'literales': {}}
+                mensajes.append(actual)
+            elif actual is not None:
+                actual['meta'] += elemento
+    return mensajes
+
+def descargar_correos_por_lotes(mail_connection, email_uids, tamano_lote=None, items='(RFC822)', estadisticas=None):
+    """
+    Descarga varios correos con un UID FETCH por lote en lugar de uno por mensaje.
+    Es un generador que devuelve (uid, literales, meta) a medida que llega cada lote.
+    Si se pasa el diccionario 'estadisticas' se acumulan los round-trips realizados.
+    """
+    if not mail_connection or not email_uids:
+        return
+    tamano_lote = max(1, min(tamano_lote or IMAP_FETCH_TAMANO_LOTE, IMAP_FETCH_TAMANO_LOTE_MAX))
+    if estadisticas is not None:
+        estadisticas.setdefault('round_trips', 0)
+        estadisticas['tamano_lote'] = tamano_lote
+
+    uids = [uid.decode() if isinstance(uid, bytes) else str(uid) for uid in email_uids]
+    for inicio in range(0, len(uids), tamano_lote):
+        lote = uids[inicio:inicio + tamano_lote]
+        conjunto = compactar_uids(lote)
+        try:
+            with metricas.medir('imap_fetch'):
+                status, data = mail_connection.uid('fetch', conjunto, items)
+        except imaplib.IMAP4.abort:
+            raise
+        except Exception as e:
+            print(f"Error al obtener el lote de correos {conjunto}: {e}")
+            continue
+        finally:
+            metricas.incrementar('imap_round_trips_total')
+            if estadisticas is not None:
+                estadisticas['round_trips'] += 1
+        metricas.incrementar('imap_bytes_descargados_total', sum(
+            sum(len(p) for p in elemento) if isinstance(elemento, tuple) else len(elemento or b'') for elemento in data or []
+        ))
+
+        if status != 'OK':
+            print(f"Error al obtener el lote de correos {conjunto}")
+            continue
+
+        pedidos = set(lote)
+        for mensaje in _agrupar_respuesta_fetch(data):
+            encontrado = re.search(rb'UID (\d+)', mensaje['meta'])
+            if not encontrado:
+                continue
+            uid = encontrado.group(1)
+            if uid.decode() not in pedidos:
+                continue
+            yield uid, mensaje['literales'], mensaje['meta']
+
+def descargar_correos_completos(mail_connection, email_uids, tamano_lote=None, estadisticas=None):
+    """
+    Descarga el RFC822 completo de los correos indicados, por lotes y sin parsear.
+    Devuelve (uid, bytes del correo) a medida que se descarga cada lote.
+    """
+    for uid, literales, _ in descargar_correos_por_lotes(mail_connection, email_uids, tamano_lote, '(RFC822)', estadisticas):
+        raw_email = literales.get('RFC822')
+        if not raw_email:
+            print(f"Error al obtener el correo con UID {uid}")
+            continue
+        yield uid, raw_email
+
+def _literal_por_prefijo(literales, prefijo):
+    """Busca un literal de la respuesta FETCH cuyo nombre empiece con el prefijo dado."""
+    for nombre, valor in literales.items():
+        if nombre.startswith(prefijo):
+            return valor
+    return None
+
+def descargar_correos_parciales(mail_connection, email_uids, tamano_lote=None, estadisticas=None, max_bytes_cuerpo=None):
+    """
+    Descarga solo lo que usa extraer_informacion_correo: los encabezados principales,
+    el BODYSTRUCTURE y los primeros 'max_bytes_cuerpo' bytes de la parte text/plain
+    (o de la text/html, hasta IMAP_FETCH_BYTES_CUERPO_HTML, si no hay texto plano).
+    Así el tamaño descargado por correo queda acotado aunque tenga adjuntos grandes.
+    Devuelve (uid, bytes de un correo simple armado con esas partes) a medida que se procesa cada lote.
+    """
+    if not mail_connection or not email_uids:
+        return
+    tamano_lote = max(1, min(tamano_lote or IMAP_FETCH_TAMANO_LOTE, IMAP_FETCH_TAMANO_LOTE_MAX))
+    max_bytes_cuerpo = max_bytes_cuerpo or IMAP_FETCH_BYTES_CUERPO
+    items_encabezados = f"(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({CAMPOS_ENCABEZADO_PARCIAL})])"
+
+    for inicio in range(0, len(email_uids), tamano_lote):
+        lote = email_uids[inicio:inicio + tamano_lote]
+
+        # 1. Encabezados y estructura de todo el lote en un solo FETCH
+        encabezados = {}
+        partes_texto = {}
+        for uid, literales, meta in descargar_correos_por_lotes(mail_connection, lote, tamano_lote, items_encabezados, estadisticas):
+            encabezados[uid] = _literal_por_prefijo(literales, 'BODY[HEADER') or b''
+            partes_texto[uid] = buscar_parte_texto(extraer_bodystructure(meta), ('plain', 'html'))
+
+        # 2. Un FETCH por cada número de sección y tipo distinto (normalmente '1' o '1.1')
+        uids_por_seccion = {}
+        for uid, parte in partes_texto.items():
+            if parte:
+                bytes_parte = max_bytes_cuerpo if parte['tipo'] == 'text/plain' else max(max_bytes_cuerpo, IMAP_FETCH_BYTES_CUERPO_HTML)
+                uids_por_seccion.setdefault((parte['seccion'], bytes_parte), []).append(uid)
+        cuerpos = {}
+        for (seccion, bytes_parte), uids_seccion in uids_por_seccion.items():
+            items_cuerpo = f"(UID BODY.PEEK[{seccion}]<0.{bytes_parte}>)"
+            for uid, literales, _ in descargar_correos_por_lotes(mail_connection, uids_seccion, tamano_lote, items_cuerpo, estadisticas):
+                cuerpos[uid] = _literal_por_prefijo(literales, f"BODY[{seccion}]") or b''
+
+        # 3. Rearmar un mensaje simple con los encabezados y el fragmento de texto
+        for uid in [u if isinstance(u, bytes) else str(u).encode() for u in lote]:
+            if uid not in encabezados:
+                print(f"Error al obtener el correo con UID {uid}")
+                continue
+            parte = partes_texto.get(uid)
+            raw_email = encabezados[uid].rstrip(b'\r\n') + b'\r\n'
+            if parte:
+                raw_email += (
+                    f"Content-Type: {parte['tipo']}; charset=\"{parte['charset']}\"\r\n"
+                    f"Content-Transfer-Encoding: {parte['codificacion']}\r\n"
+                ).encode()
+            raw_email += b'\r\n' + cuerpos.get(uid, b'')
+            yield uid, raw_email
+
+def descargar_informacion_correos(mail_connection, email_uids, modo_fetch=None, tamano_lote=None, estadisticas=None, progreso=None):
+    """
+    Descarga los correos indicados y devuelve la lista de diccionarios de extraer_informacion_correo.
+    'progreso(cantidad)' (opcional) se llama cada vez que se procesa un correo.
+    """
+    if not email_uids:
+        return []
+    if (modo_fetch or IMAP_FETCH_MODO) == 'parcial':
+        correos_crudos = descargar_correos_parciales(mail_connection, email_uids, tamano_lote, estadisticas)
+    else:
+        correos_crudos = descargar_correos_completos(mail_connection, email_uids, tamano_lote, estadisticas)
+    # El parseo corre en el pool de procesos mientras se descargan los lotes siguientes;
+    # los resultados llegan en el mismo orden de los UIDs
+    datos_extraidos = []
+    for email_uid, informacion in procesador_correos.parsear(correos_crudos, len(email_uids)):
+        if informacion:
+            datos_extraidos.append(informacion)
+            if progreso:
+                progreso(len(datos_extraidos))
+    return datos_extraidos
+
+def obtener_estado_carpeta(mail_connection, carpeta='INBOX'):
+    """Devuelve (uidvalidity, uidnext) de la carpeta según el servidor, o (None, None) si falla."""
     try:
-        status, data = mail_connection.uid('fetch', email_uid, '(RFC822)')
+        status, data = mail_connection.status(f'"{carpeta}"', '(UIDVALIDITY UIDNEXT)')
         if status != 'OK' or not data or not data[0]:
-            print(f"Error al obtener el correo con UID {email_uid}")
-            return None
-        
-        raw_email = data[0][1]
-        mensaje_parseado = email.message_from_bytes(raw_email)
-        return mensaje_parseado
+            return None, None
+        respuesta = data[0] if isinstance(data[0], bytes) else b''
+        uidvalidity = re.search(rb'UIDVALIDITY (\d+)', respuesta)
+        uidnext = re.search(rb'UIDNEXT (\d+)', respuesta)
+        return (int(uidvalidity.group(1)) if uidvalidity else None,
+                int(uidnext.group(1)) if uidnext else None)
+    except imaplib.IMAP4.abort:
+        raise
     except Exception as e:
-        print(f"Error al parsear correo UID {email_uid}: {e}")
-        return None
+        print(f"Error al consultar el estado de la carpeta {carpeta}: {e}")
+        return None, None
 
-def extraer_informacion_correo(mensaje_parseado, email_uid):
-    """Extrae información relevante del correo parseado."""
-    try:
-        # Extraer información básica
-        asunto = decodificar_asunto(mensaje_parseado.get('Subject', ''))
-        remitente = mensaje_parseado.get('From', '')
-        fecha_str = mensaje_parseado.get('Date', '')
-        
-        # Convertir fecha
-        fecha_datetime = None
-        if fecha_str:
-            try:
-                fecha_datetime = parsedate_to_datetime(fecha_str)
-            except Exception as e:
-                print(f"Error al parsear fecha: {e}")
-        
-        # Extraer cuerpo del correo
-        cuerpo_texto = ""
-        if mensaje_parseado.is_multipart():
-            for part in mensaje_parseado.walk():
-                if part.get_content_type() == "text/plain":
-                    try:
-                        cuerpo_texto = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                        break
-                    except Exception as e:
-                        print(f"Error al decodificar parte del correo: {e}")
-        else:
-            try:
-                cuerpo_texto = mensaje_parseado.get_payload(decode=True).decode('utf-8', errors='ignore')
-            except Exception as e:
-                print(f"Error al decodificar correo: {e}")
-        
-        return {
-            'uid': email_uid.decode() if isinstance(email_uid, bytes) else str(email_uid),
-            'asunto': asunto,
-            'remitente': remitente,
-            'fecha': fecha_datetime.isoformat() if fecha_datetime else '',
-            'cuerpo_texto_plano': cuerpo_texto[:1000]  # Limitar tamaño
-        }
-    except Exception as e:
-        print(f"Error al extraer información del correo: {e}")
-        return None
+def obtener_correos_con_almacen(mail_connection, email_uids, carpeta='INBOX', modo_fetch=None, tamano_lote=None, estadisticas=None, progreso=None):
+    """
+    Devuelve la información de los correos indicados leyendo primero del almacén
+    local y descargando del servidor solo los UIDs que todavía no están guardados.
+    """
+    if not email_uids:
+        return []
+    uidvalidity, _ = obtener_estado_carpeta(mail_connection, carpeta)
+    if uidvalidity is None:
+        return descargar_informacion_correos(mail_connection, email_uids, modo_fetch, tamano_lote, estadisticas, progreso)
 
-def generar_resumen_consolidado_ia(lista_textos_correos_ordenados):
+    if estadisticas is not None:
+        estadisticas['uidvalidity'] = uidvalidity
+    guardados = almacen_correos.obtener(carpeta, uidvalidity, email_uids)
+    faltantes = [uid for uid in email_uids if int(uid) not in guardados]
+    progreso_total = (lambda cantidad: progreso(len(guardados) + cantidad)) if progreso else None
+    if progreso and guardados:
+        progreso(len(guardados))
+    nuevos = descargar_informacion_correos(mail_connection, faltantes, modo_fetch, tamano_lote, estadisticas, progreso_total)
+    almacen_correos.guardar(carpeta, uidvalidity, nuevos)
+    if estadisticas is not None:
+        estadisticas['desde_almacen'] = len(guardados)
+        estadisticas['descargados'] = len(nuevos)
+    return list(guardados.values()) + nuevos
+
+def sincronizar_carpeta(mail_connection, carpeta='INBOX', modo_fetch=None, tamano_lote=None, estadisticas=None):
     """
-    Genera un resumen consolidado de una lista de textos de correos usando Gemini.
+    Sincroniza el almacén local con la carpeta: descarga solo los UIDs mayores
+    al último UIDNEXT visto. Si cambió el UIDVALIDITY se descarta lo guardado.
+    Devuelve la cantidad de correos nuevos guardados.
     """
-    global GEMINI_API_KEY_CONFIGURADA
-    if not GEMINI_API_KEY_CONFIGURADA:
-        return "Resumen consolidado no disponible (API Key de Gemini no configurada)."
-    
-    if not lista_textos_correos_ordenados:
-        return "No hay correos para resumir."
+    uidvalidity, uidnext = obtener_estado_carpeta(mail_connection, carpeta)
+    if uidvalidity is None:
+        print(f"No se pudo obtener el estado de la carpeta {carpeta}.")
+        return 0
 
-    texto_completo_para_resumir = "\n\n--- SIGUIENTE CORREO EN LA SECUENCIA ---\n\n".join(lista_textos_correos_ordenados)
-    
-    MAX_CHARS_FOR_SUMMARY = 180000
-    if len(texto_completo_para_resumir) > MAX_CHARS_FOR_SUMMARY:
-        texto_completo_para_resumir = texto_completo_para_resumir[:MAX_CHARS_FOR_SUMMARY] + "...[TEXTO TRUNCADO]"
-    
-    try:
-        # Cambiar el modelo a uno disponible actualmente
-        model = genai.GenerativeModel('gemini-1.5-flash')  # Cambio de gemini-pro a gemini-1.5-flash
-        prompt = f"""
-        Actúa como un analista experto en comunicaciones internas de una fábrica de ensamblaje de celulares (marca Motorola). Analiza cuidadosamente la siguiente secuencia de correos electrónicos. Tu objetivo es ayudarme a entender por completo el contenido, sin que se me escape ningún detalle relevante.
+    uidvalidity_guardado, uidnext_guardado = almacen_correos.estado(carpeta)
+    if uidvalidity_guardado != uidvalidity:
+        if uidvalidity_guardado is not None:
+            print(f"Cambió el UIDVALIDITY de {carpeta}: se descartan {almacen_correos.invalidar(carpeta, uidvalidity)} correos guardados.")
+        uidnext_guardado = 1
+
+    if uidnext is not None and uidnext_guardado >= uidnext:
+        return 0
+
+    status, _ = mail_connection.select(f'"{carpeta}"', readonly=True)
+    if status != 'OK':
+        print(f"Error al seleccionar la carpeta {carpeta}.")
+        return 0
+    status, data = mail_connection.uid('search', None, f'UID {uidnext_guardado}:*')
+    if status != 'OK':
+        print(f"Error al buscar los correos nuevos de {carpeta}.")
+        return 0
+    # 'N:*' siempre incluye el último mensaje aunque su UID sea menor que N
+    uids_nuevos = [uid for uid in (data[0] or b'').split() if int(uid) >= uidnext_guardado]
+
+    nuevos = descargar_informacion_correos(mail_connection, uids_nuevos, modo_fetch, tamano_lote, estadisticas)
+    almacen_correos.guardar(carpeta, uidvalidity, nuevos)
+    if uidnext is None:
+        uidnext = max([int(uid) for uid in uids_nuevos], default=uidnext_guardado - 1) + 1
+    almacen_correos.actualizar_estado(carpeta, uidvalidity, uidnext)
+    print(f"Sincronización de {carpeta}: {len(nuevos)} correos nuevos guardados.")
+    return len(nuevos)
+
+INSTRUCCIONES_INFORME_CORREOS = """Actúa como un analista experto en comunicaciones internas de una fábrica de ensamblaje de celulares (marca Motorola). Analiza cuidadosamente la siguiente secuencia de correos electrónicos. Tu objetivo es ayudarme a entender por completo el contenido, sin que se me escape ningún detalle relevante.
 
 Genera un informe claro, ordenado y cronológico que incluya lo siguiente:
 
@@ -234,7 +619,58 @@ Una narrativa cronológica redactada naturalmente: incluye quién envió cada co
 
 Datos adicionales que ayuden a comprender el contexto, como nombres de modelos, cantidades, plazos, problemas técnicos, propuestas, acuerdos o temas pendientes.
 
-Redacta el informe de forma clara, completa y explicativa, como si se lo contaras a alguien que no leyó los correos. No omitas detalles, incluso si parecen pequeños.
+Redacta el informe de forma clara, completa y explicativa, como si se lo contaras a alguien que no leyó los correos. No omitas detalles, incluso si parecen pequeños."""
+
+@metricas.medir('gemini')
+def _generar_texto(prompt, al_recibir_token=None):
+    """
+    Llama a Gemini a través del cliente compartido (límites de concurrencia y tasa,
+    reintentos) y devuelve el texto generado (o None). Si se pasa 'al_recibir_token'
+    se usa la API de streaming y se le entrega cada fragmento.
+    """
+    return cliente_gemini.generar(prompt, al_recibir_token)
+
+def generar_resumen_consolidado_ia(lista_textos_correos_ordenados, estadisticas=None, al_recibir_token=None):
+    """
+    Genera un resumen consolidado de una lista de textos de correos usando Gemini.
+    Si ya se resumió exactamente el mismo contenido se devuelve el resumen guardado.
+    En 'estadisticas' (opcional) se indica si hubo acierto de caché.
+    'al_recibir_token' (opcional) recibe el resumen por fragmentos a medida que se genera.
+    """
+    global GEMINI_API_KEY_CONFIGURADA
+    if not GEMINI_API_KEY_CONFIGURADA:
+        return "Resumen consolidado no disponible (API Key de Gemini no configurada)."
+    
+    if not lista_textos_correos_ordenados:
+        return "No hay correos para resumir."
+
+    clave_cache = CacheResumenes.clave(MODELO_GEMINI, VERSION_PROMPT_RESUMEN, lista_textos_correos_ordenados)
+    resumen_guardado = cache_resumenes.obtener(clave_cache)
+    if estadisticas is not None:
+        estadisticas['cache'] = 'acierto' if resumen_guardado is not None else 'fallo'
+    if resumen_guardado is not None:
+        print("Resumen obtenido de la caché (sin cambios en los correos).")
+        estadisticas_generado(estadisticas)
+        if al_recibir_token:
+            al_recibir_token(resumen_guardado)
+        return resumen_guardado
+
+    texto_completo_para_resumir = "\n\n--- SIGUIENTE CORREO EN LA SECUENCIA ---\n\n".join(lista_textos_correos_ordenados)
+    
+    if len(texto_completo_para_resumir) > MAX_CHARS_FOR_SUMMARY:
+        # En lugar de truncar, se resume por partes y luego se combinan los resúmenes
+        try:
+            resumen = resumir_jerarquico(lista_textos_correos_ordenados, estadisticas=estadisticas, al_recibir_token=al_recibir_token)
+        except Exception as e:
+            print(f"Error al generar resumen jerárquico con IA: {e}")
+            return f"Error al generar resumen: {str(e)}"
+        cache_resumenes.guardar(clave_cache, resumen)
+        estadisticas_generado(estadisticas)
+        return resumen
+    
+    try:
+        prompt = f"""
+        {INSTRUCCIONES_INFORME_CORREOS}
         
         Correos a analizar:
         {texto_completo_para_resumir}
@@ -242,102 +678,469 @@ Redacta el informe de forma clara, completa y explicativa, como si se lo contara
         Por favor, proporciona un resumen claro y estructurado.
         """
         
-        response = model.generate_content(prompt)
-        return response.text if response else "No se pudo generar el resumen."
+        texto = _generar_texto(prompt, al_recibir_token)
+        if not texto:
+            return "No se pudo generar el resumen."
+        cache_resumenes.guardar(clave_cache, texto)
+        estadisticas_generado(estadisticas)
+        return texto
     
     except Exception as e:
         print(f"Error al generar resumen con IA: {e}")
         return f"Error al generar resumen: {str(e)}"
 
-@app.route('/api/buscar_correos', methods=['GET'])
-def buscar_correos():
+def estadisticas_generado(estadisticas):
+    """Marca en 'estadisticas' que se obtuvo un resumen válido (y no un mensaje de error)."""
+    if estadisticas is not None:
+        estadisticas['generado'] = True
+
+def generar_resumen_incremental_ia(resumen_previo, lista_textos_correos_nuevos, estadisticas=None, al_recibir_token=None):
+    """
+    Actualiza un resumen previo con los correos nuevos del hilo. Solo se envían
+    a Gemini el resumen anterior y los correos nuevos, no el hilo completo.
+    """
+    if not GEMINI_API_KEY_CONFIGURADA:
+        return "Resumen consolidado no disponible (API Key de Gemini no configurada)."
+
+    if not lista_textos_correos_nuevos:
+        estadisticas_generado(estadisticas)
+        if al_recibir_token:
+            al_recibir_token(resumen_previo)
+        return resumen_previo
+
+    clave_cache = CacheResumenes.clave(MODELO_GEMINI, f"{VERSION_PROMPT_RESUMEN}-incremental", [resumen_previo] + list(lista_textos_correos_nuevos))
+    resumen_guardado = cache_resumenes.obtener(clave_cache)
+    if estadisticas is not None:
+        estadisticas['cache'] = 'acierto' if resumen_guardado is not None else 'fallo'
+    if resumen_guardado is not None:
+        estadisticas_generado(estadisticas)
+        if al_recibir_token:
+            al_recibir_token(resumen_guardado)
+        return resumen_guardado
+
+    texto_nuevo = "\n\n--- SIGUIENTE CORREO EN LA SECUENCIA ---\n\n".join(lista_textos_correos_nuevos)
+    if len(texto_nuevo) > MAX_CHARS_FOR_SUMMARY:
+        try:
+            resumen = resumir_jerarquico(lista_textos_correos_nuevos, resumen_previo=resumen_previo, estadisticas=estadisticas,
+                                         al_recibir_token=al_recibir_token)
+        except Exception as e:
+            print(f"Error al generar resumen jerárquico con IA: {e}")
+            return f"Error al generar resumen: {str(e)}"
+        cache_resumenes.guardar(clave_cache, resumen)
+        estadisticas_generado(estadisticas)
+        return resumen
+
     try:
-        asunto_a_buscar_param = request.args.get('asunto')
-        fecha_desde_param = request.args.get('fecha_desde')
-        fecha_hasta_param = request.args.get('fecha_hasta')
+        prompt = f"""
+        {INSTRUCCIONES_INFORME_CORREOS}
 
-        if not asunto_a_buscar_param:
-            return jsonify({"error": "El parámetro 'asunto' es requerido"}), 400
+        Ya existe un informe previo que cubre los correos anteriores de esta secuencia. Actualízalo incorporando los correos nuevos que se muestran a continuación, manteniendo la narrativa cronológica y todos los detalles del informe previo. Devuelve el informe completo actualizado, no solo los cambios.
 
-        print(f"Solicitud API recibida para buscar correos con asunto: '{asunto_a_buscar_param}', Desde: {fecha_desde_param}, Hasta: {fecha_hasta_param}")
-        
-        # Verificar que las credenciales estén configuradas
-        if not EMAIL_USUARIO_FIJO or not CONTRASENA_APP_FIJA:
-            error_msg = "Las credenciales de Gmail no están configuradas correctamente. Verifica las variables de entorno EMAIL_USUARIO y CONTRASENA_APP."
-            print(f"ERROR: {error_msg}")
-            return jsonify({"error": error_msg}), 500
-        
-        conexion_imap = conectar_imap(EMAIL_USUARIO_FIJO, CONTRASENA_APP_FIJA)
-        if not conexion_imap:
-            error_msg = "No se pudo conectar a Gmail vía IMAP. Verifica las credenciales y configuración de la cuenta."
-            print(f"ERROR: {error_msg}")
-            return jsonify({"error": error_msg}), 500
+        Informe previo:
+        {resumen_previo}
 
-        uids_correos_encontrados = buscar_correos_imap(conexion_imap, asunto_a_buscar_param, fecha_desde_param, fecha_hasta_param)
-        
-        # Aunque no mostraremos correos individuales, los necesitamos para generar el resumen.
-        todos_los_datos_extraidos = [] 
-        textos_para_resumen_consolidado = []
-
-        if uids_correos_encontrados:
-            for i, email_uid in enumerate(uids_correos_encontrados):
-                try:
-                    mensaje_parseado = obtener_y_parsear_correo_imap(conexion_imap, email_uid)
-                    if mensaje_parseado:
-                        informacion = extraer_informacion_correo(mensaje_parseado, email_uid)
-                        if informacion:
-                            todos_los_datos_extraidos.append(informacion)
-                except Exception as e:
-                    print(f"Error al procesar correo UID {email_uid}: {e}")
-                    continue
-        
-        if todos_los_datos_extraidos:
-            try:
-                # Ordenar por fecha para que el resumen tenga sentido cronológico
-                todos_los_datos_extraidos.sort(key=lambda x: datetime.fromisoformat(x['fecha'].split('T')[0]) if x.get('fecha') else datetime.min, reverse=False)
-                
-                for info_correo_ordenado in todos_los_datos_extraidos:
-                     # Formato más estructurado para la IA
-                     texto_correo_info = (
-                        f"FECHA: {info_correo_ordenado.get('fecha', 'N/A')}\n"
-                        f"DE: {info_correo_ordenado.get('remitente', 'N/A')}\n"
-                        f"ASUNTO: {info_correo_ordenado.get('asunto', 'N/A')}\n"
-                        f"CUERPO:\n{info_correo_ordenado.get('cuerpo_texto_plano', '')}"
-                     )
-                     textos_para_resumen_consolidado.append(texto_correo_info)
-            except Exception as e:
-                print(f"Error al intentar ordenar u obtener textos de correos para el resumen: {e}. El resumen podría no estar en orden cronológico.")
+        Correos nuevos a incorporar:
+        {texto_nuevo}
+        """
 
-        resumen_final_consolidado = "No se generó resumen consolidado."
-        if GEMINI_API_KEY_CONFIGURADA and textos_para_resumen_consolidado:
-            print(f"Intentando generar resumen consolidado para {len(textos_para_resumen_consolidado)} correos (ordenados cronológicamente).")
-            try:
-                resumen_final_consolidado = generar_resumen_consolidado_ia(textos_para_resumen_consolidado)
-            except Exception as e:
-                print(f"Error al generar resumen con IA: {e}")
-                resumen_final_consolidado = f"Error al generar resumen: {str(e)}"
-        elif not GEMINI_API_KEY_CONFIGURADA:
-            resumen_final_consolidado = "Resumen consolidado no disponible (API Key de Gemini no configurada)."
-        elif not textos_para_resumen_consolidado:
-             resumen_final_consolidado = "No se encontraron correos para generar un resumen consolidado con los filtros aplicados."
-
-        # Cerrar conexión IMAP de forma segura
-        if conexion_imap:
-            try:
-                conexion_imap.close()
-                conexion_imap.logout()
-            except Exception as e:
-                print(f"Error al cerrar conexión IMAP: {e}")
-        
-        respuesta_final = {
-            "resumen_consolidado": resumen_final_consolidado,
-            "total_correos": len(todos_los_datos_extraidos)
+        texto = _generar_texto(prompt, al_recibir_token)
+        if not texto:
+            return "No se pudo generar el resumen."
+        cache_resumenes.guardar(clave_cache, texto)
+        estadisticas_generado(estadisticas)
+        return texto
+
+    except Exception as e:
+        print(f"Error al generar resumen incremental con IA: {e}")
+        return f"Error al generar resumen: {str(e)}"
+
+def estimar_tokens(texto):
+    """Estimación aproximada de tokens (en promedio ~4 caracteres por token)."""
+    return len(texto) // 4 + 1
+
+def dividir_en_bloques(textos, max_tokens):
+    """
+    Agrupa los textos (ya ordenados cronológicamente) en bloques consecutivos que
+    no superen 'max_tokens'. Un texto que por sí solo supera el límite se parte en trozos.
+    """
+    max_chars = max_tokens * 4
+    bloques = []
+    actual = []
+    tokens_actual = 0
+    for texto in textos:
+        trozos = [texto[i:i + max_chars] for i in range(0, len(texto), max_chars)] or ['']
+        for trozo in trozos:
+            tokens = estimar_tokens(trozo)
+            if actual and tokens_actual + tokens > max_tokens:
+                bloques.append(actual)
+                actual = []
+                tokens_actual = 0
+            actual.append(trozo)
+            tokens_actual += tokens
+    if actual:
+        bloques.append(actual)
+    return bloques
+
+def _resumir_bloque(numero, total, textos_bloque):
+    """Paso 'map': resume una parte del hilo conservando los datos concretos."""
+    texto_bloque = "\n\n--- SIGUIENTE CORREO EN LA SECUENCIA ---\n\n".join(textos_bloque)
+    prompt = f"""
+        Actúa como un analista experto en comunicaciones internas de una fábrica de ensamblaje de celulares (marca Motorola).
+        Los siguientes correos son la parte {numero} de {total} de una secuencia más larga, en orden cronológico.
+        Resume esta parte en forma cronológica sin omitir detalles: quién escribió, en qué fecha, qué dijo,
+        decisiones, acciones propuestas, nombres de modelos, cantidades, plazos, problemas y temas pendientes.
+        Este resumen parcial se combinará luego con los de las otras partes.
+
+        Correos de esta parte:
+        {texto_bloque}
+        """
+    texto = _generar_texto(prompt)
+    if not texto:
+        raise RuntimeError(f"No se pudo resumir la parte {numero} de {total}.")
+    return texto
+
+def _combinar_resumenes(resumenes_parciales, resumen_previo=None, al_recibir_token=None):
+    """Paso 'reduce': arma el informe final a partir de los resúmenes parciales."""
+    partes = "\n\n--- SIGUIENTE PARTE DE LA SECUENCIA ---\n\n".join(
+        f"PARTE {i} DE {len(resumenes_parciales)}:\n{texto}" for i, texto in enumerate(resumenes_parciales, 1)
+    )
+    previo = ""
+    if resumen_previo:
+        previo = f"""
+        Ya existe un informe previo que cubre los correos anteriores a estas partes. Incorpóralo y devuelve el informe completo actualizado.
+
+        Informe previo:
+        {resumen_previo}
+        """
+    prompt = f"""
+        {INSTRUCCIONES_INFORME_CORREOS}
+
+        La secuencia era demasiado larga para analizarla de una vez, así que se resumió por partes consecutivas.
+        A continuación tienes los resúmenes parciales en orden cronológico; úsalos como si fueran los correos originales.
+        {previo}
+        Resúmenes parciales:
+        {partes}
+
+        Por favor, proporciona un resumen claro y estructurado.
+        """
+    texto = _generar_texto(prompt, al_recibir_token)
+    if not texto:
+        raise RuntimeError("No se pudieron combinar los resúmenes parciales.")
+    return texto
+
+def resumir_jerarquico(textos_ordenados, resumen_previo=None, tokens_por_bloque=None, max_workers=None, estadisticas=None, al_recibir_token=None):
+    """
+    Resumen map-reduce para hilos largos: divide los correos en bloques según un
+    presupuesto de tokens, resume los bloques en paralelo con un pool acotado y
+    combina los resúmenes parciales en el informe final. Si los resúmenes parciales
+    tampoco entran en un prompt, se repite el proceso sobre ellos.
+    """
+    tokens_por_bloque = tokens_por_bloque or RESUMEN_TOKENS_POR_BLOQUE
+    max_workers = max_workers or RESUMEN_MAX_WORKERS
+    inicio = time.monotonic()
+
+    parciales = list(textos_ordenados)
+    total_bloques = 0
+    niveles = 0
+    while True:
+        bloques = dividir_en_bloques(parciales, tokens_por_bloque)
+        niveles += 1
+        total_bloques += len(bloques)
+        print(f"Resumen jerárquico: nivel {niveles}, {len(bloques)} bloques con hasta {max_workers} en paralelo.")
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(bloques))) as executor:
+            parciales = list(executor.map(
+                metricas.propagar(lambda args: _resumir_bloque(*args)),
+                [(i, len(bloques), bloque) for i, bloque in enumerate(bloques, 1)]
+            ))
+        tokens_parciales = sum(estimar_tokens(p) for p in parciales) + estimar_tokens(resumen_previo or '')
+        # Se limita la profundidad por si los resúmenes parciales no se achican lo suficiente
+        if len(parciales) == 1 or tokens_parciales <= tokens_por_bloque or niveles >= 3:
+            break
+
+    # Solo el paso final se transmite por fragmentos; los parciales no se muestran
+    resumen = _combinar_resumenes(parciales, resumen_previo, al_recibir_token)
+    if estadisticas is not None:
+        estadisticas['modo_ia'] = 'jerarquico'
+        estadisticas['bloques'] = total_bloques
+        estadisticas['niveles'] = niveles
+        estadisticas['tiempo_segundos'] = round(time.monotonic() - inicio, 3)
+    return resumen
+
+def generar_resumen_hilo(clave_hilo, carpeta, uidvalidity, datos_ordenados, textos_ordenados, estadisticas=None, al_recibir_token=None):
+    """
+    Resumen incremental de un hilo: si ya existe un resumen que cubre hasta cierto
+    UID, solo se resumen los correos con UID mayor y se combinan con el anterior.
+    Si no hay resumen previo (o cambió el UIDVALIDITY) se resume el hilo completo.
+    """
+    estadisticas = estadisticas if estadisticas is not None else {}
+    estadisticas['modo'] = 'incremental'
+    uid_max = max(int(d['uid']) for d in datos_ordenados)
+    previo = almacen_correos.obtener_resumen_hilo(clave_hilo) if uidvalidity is not None else None
+
+    if previo and previo['carpeta'] == carpeta and previo['uidvalidity'] == uidvalidity and previo['uid_max'] <= uid_max:
+        textos_nuevos = [texto for datos, texto in zip(datos_ordenados, textos_ordenados) if int(datos['uid']) > previo['uid_max']]
+        estadisticas['correos_nuevos'] = len(textos_nuevos)
+        print(f"Resumen incremental: {len(textos_nuevos)} correos nuevos desde el UID {previo['uid_max']}.")
+        resumen = generar_resumen_incremental_ia(previo['resumen'], textos_nuevos, estadisticas, al_recibir_token)
+    else:
+        estadisticas['correos_nuevos'] = len(textos_ordenados)
+        resumen = generar_resumen_consolidado_ia(textos_ordenados, estadisticas, al_recibir_token)
+
+    if estadisticas.get('generado') and uidvalidity is not None:
+        almacen_correos.guardar_resumen_hilo(clave_hilo, carpeta, uidvalidity, uid_max, len(datos_ordenados), resumen)
+    return resumen
+
+def leer_parametros_busqueda(args):
+    """Valida los parámetros de búsqueda de correos. Devuelve (parametros, mensaje_de_error)."""
+    asunto = args.get('asunto')
+    if not asunto:
+        return None, "El parámetro 'asunto' es requerido"
+
+    try:
+        tamano_lote = int(args.get('tamano_lote') or IMAP_FETCH_TAMANO_LOTE)
+    except ValueError:
+        return None, "El parámetro 'tamano_lote' debe ser un número entero"
+    modo_fetch = args.get('modo_fetch') or IMAP_FETCH_MODO
+    if modo_fetch not in ('parcial', 'completo'):
+        return None, "El parámetro 'modo_fetch' debe ser 'parcial' o 'completo'"
+    # 'imap' usa el SEARCH del servidor; 'local' busca en el índice de texto del almacén
+    origen = args.get('origen') or 'imap'
+    if origen not in ('imap', 'local'):
+        return None, "El parámetro 'origen' debe ser 'imap' o 'local'"
+    carpetas = list(dict.fromkeys(c.strip() for c in (args.get('carpetas') or '').split(',') if c.strip())) or IMAP_CARPETAS_BUSQUEDA
+    modo_resumen = args.get('modo_resumen') or RESUMEN_MODO
+    if modo_resumen not in ('completo', 'incremental'):
+        return None, "El parámetro 'modo_resumen' debe ser 'completo' o 'incremental'"
+
+    return {
+        "asunto": asunto,
+        "fecha_desde": args.get('fecha_desde') or None,
+        "fecha_hasta": args.get('fecha_hasta') or None,
+        "tamano_lote": max(1, min(tamano_lote, IMAP_FETCH_TAMANO_LOTE_MAX)),
+        "modo_fetch": modo_fetch,
+        "origen": origen,
+        "sincronizar": args.get('sincronizar', '1') != '0',
+        "campos": ('asunto', 'remitente', 'cuerpo') if args.get('buscar_en') == 'todo' else ('asunto',),
+        "modo_resumen": modo_resumen,
+        "carpetas": carpetas,
+        # Message-ID de cualquier correo de la conversación: se resume solo ese hilo
+        "hilo": (args.get('hilo') or '').strip() or None
+    }, None
+
+def ejecutar_busqueda_correos(parametros, notificar=None, transmitir=False):
+    """
+    Busca los correos del asunto, los obtiene (del almacén local o del servidor)
+    y genera el resumen consolidado. Devuelve (respuesta, codigo_http).
+
+    Si se pasa 'notificar(evento, datos)' se informa el progreso a medida que ocurre:
+    'uids' (correos encontrados), 'descarga' (N de M obtenidos) y 'resumen' (inicio
+    del resumen). Con 'transmitir' el resumen se pide a Gemini por streaming y se
+    emite también 'token' con cada fragmento; sin streaming los errores 429/5xx se
+    pueden reintentar durante toda la llamada.
+    """
+    notificar = notificar or (lambda evento, datos: None)
+    asunto_a_buscar_param = parametros['asunto']
+    fecha_desde_param = parametros['fecha_desde']
+    fecha_hasta_param = parametros['fecha_hasta']
+    tamano_lote = parametros['tamano_lote']
+    modo_fetch = parametros['modo_fetch']
+    origen = parametros['origen']
+    campos_busqueda = parametros['campos']
+    id_hilo = parametros.get('hilo')
+
+    print(f"Solicitud API recibida para buscar correos con asunto: '{asunto_a_buscar_param}', Desde: {fecha_desde_param}, Hasta: {fecha_hasta_param}")
+    
+    # Verificar que las credenciales estén configuradas
+    usa_imap = origen == 'imap' or parametros['sincronizar']
+    if usa_imap and (not EMAIL_USUARIO_FIJO or not CONTRASENA_APP_FIJA):
+        error_msg = "Las credenciales de Gmail no están configuradas correctamente. Verifica las variables de entorno EMAIL_USUARIO y CONTRASENA_APP."
+        print(f"ERROR: {error_msg}")
+        return {"error": error_msg}, 500
+    
+    carpetas = parametros.get('carpetas') or ['INBOX']
+    estadisticas_por_carpeta = {carpeta: {} for carpeta in carpetas}
+
+    def progreso_descarga(carpeta, total):
+        def progreso(descargados):
+            if descargados == total or descargados % 20 == 0:
+                notificar('descarga', {"carpeta": carpeta, "descargados": descargados, "total": total})
+        return progreso
+
+    def buscar_en_almacen(carpeta):
+        datos_locales = almacen_correos.buscar_texto(asunto_a_buscar_param, carpeta, fecha_desde_param, fecha_hasta_param, campos_busqueda)
+        print(f"Se encontraron {len(datos_locales)} correos de {carpeta} en el índice local.")
+        notificar('uids', {"carpeta": carpeta, "encontrados": len(datos_locales), "origen": 'local'})
+        return [d['uid'] for d in datos_locales], datos_locales
+
+    def buscar_y_descargar(conexion_imap, carpeta):
+        estadisticas = estadisticas_por_carpeta[carpeta]
+        estadisticas.clear()
+        estadisticas.update({'modo': modo_fetch, 'tamano_lote': tamano_lote, 'round_trips': 0})
+        if origen == 'local':
+            # Solo se trae lo que llegó desde la última sincronización y se busca localmente
+            sincronizar_carpeta(conexion_imap, carpeta, modo_fetch, tamano_lote, estadisticas)
+            return buscar_en_almacen(carpeta)
+        uids_encontrados = buscar_correos_imap(conexion_imap, asunto_a_buscar_param, fecha_desde_param, fecha_hasta_param, carpeta)
+        notificar('uids', {"carpeta": carpeta, "encontrados": len(uids_encontrados), "origen": 'imap'})
+        datos_extraidos = obtener_correos_con_almacen(conexion_imap, uids_encontrados, carpeta, modo_fetch, tamano_lote, estadisticas,
+                                                      progreso_descarga(carpeta, len(uids_encontrados)))
+        if uids_encontrados:
+            print(f"Se obtuvieron {len(datos_extraidos)} correos de {carpeta} ({estadisticas.get('desde_almacen', 0)} del almacén local) en {estadisticas['round_trips']} round-trips de FETCH (lotes de {tamano_lote}).")
+        return uids_encontrados, datos_extraidos
+
+    def buscar_en_carpeta(carpeta):
+        if usa_imap:
+            # Cada carpeta usa su propia conexión del pool compartido, que vuelve a él al terminar
+            return obtener_pool_imap(EMAIL_USUARIO_FIJO, CONTRASENA_APP_FIJA).ejecutar(
+                lambda conexion_imap: buscar_y_descargar(conexion_imap, carpeta)
+            )
+        return buscar_en_almacen(carpeta)
+
+    if len(carpetas) > 1:
+        # Las carpetas se buscan al mismo tiempo: el pool acota cuántas conexiones se abren
+        with ThreadPoolExecutor(max_workers=min(len(carpetas), IMAP_POOL_MAX_CONEXIONES)) as executor:
+            resultados_carpetas = list(executor.map(metricas.propagar(buscar_en_carpeta), carpetas))
+    else:
+        resultados_carpetas = [buscar_en_carpeta(carpetas[0])]
+
+    if all(resultado is None for resultado in resultados_carpetas):
+        error_msg = "No se pudo conectar a Gmail vía IMAP. Verifica las credenciales y configuración de la cuenta."
+        print(f"ERROR: {error_msg}")
+        return {"error": error_msg}, 500
+
+    # Aunque no mostraremos correos individuales, los necesitamos para generar el resumen.
+    uids_correos_encontrados = []
+    todos_los_datos_extraidos = []
+    uidvalidities = {}
+    for carpeta, resultado in zip(carpetas, resultados_carpetas):
+        if resultado is None:
+            print(f"No se pudo buscar en la carpeta {carpeta}; se sigue con las demás.")
+            estadisticas_por_carpeta[carpeta]['error'] = "sin conexión"
+            continue
+        uids, datos_carpeta = resultado
+        uids_correos_encontrados.extend(uids)
+        # Se marca la carpeta de origen en una copia: lo guardado en el almacén no cambia
+        todos_los_datos_extraidos.extend(dict(datos, carpeta=carpeta) for datos in datos_carpeta)
+        uidvalidities[carpeta] = (estadisticas_por_carpeta[carpeta].get('uidvalidity') if origen == 'imap'
+                                  else almacen_correos.estado(carpeta)[0])
+
+    if id_hilo:
+        # Se completa la conversación con los correos guardados que la referencian (o a los que responde)
+        ids_conocidos = [id_hilo] + [d.get('message_id') for d in todos_los_datos_extraidos]
+        for carpeta, uidvalidity_carpeta in uidvalidities.items():
+            if uidvalidity_carpeta is None:
+                continue
+            uids_presentes = {str(d['uid']) for d in todos_los_datos_extraidos if d['carpeta'] == carpeta}
+            relacionados = almacen_correos.obtener_hilo(carpeta, uidvalidity_carpeta, ids_conocidos)
+            todos_los_datos_extraidos.extend(dict(d, carpeta=carpeta) for d in relacionados if str(d['uid']) not in uids_presentes)
+
+    # Un mismo correo puede estar en varias carpetas (etiquetas de Gmail): se deja una sola copia
+    total_antes = len(todos_los_datos_extraidos)
+    todos_los_datos_extraidos = deduplicar_correos(todos_los_datos_extraidos)
+    if len(todos_los_datos_extraidos) < total_antes:
+        print(f"Se descartaron {total_antes - len(todos_los_datos_extraidos)} correos repetidos entre carpetas.")
+
+    if len(carpetas) > 1:
+        estadisticas_fetch = {
+            'modo': modo_fetch,
+            'tamano_lote': tamano_lote,
+            'round_trips': sum(e.get('round_trips', 0) for e in estadisticas_por_carpeta.values()),
+            'desde_almacen': sum(e.get('desde_almacen', 0) for e in estadisticas_por_carpeta.values()),
+            'descargados': sum(e.get('descargados', 0) for e in estadisticas_por_carpeta.values()),
+            'repetidos': total_antes - len(todos_los_datos_extraidos),
+            'carpetas': estadisticas_por_carpeta
         }
-        
-        if not uids_correos_encontrados:
-             respuesta_final["mensaje_general"] = f"No se encontraron correos con el asunto: '{asunto_a_buscar_param}' y los filtros de fecha aplicados."
+    else:
+        estadisticas_fetch = estadisticas_por_carpeta[carpetas[0]]
+
+    if id_hilo:
+        with metricas.medir('hilos'):
+            hilo_elegido = buscar_hilo(construir_hilos(todos_los_datos_extraidos), id_hilo)
+        if hilo_elegido is None:
+            return {"error": f"No se encontró el hilo '{id_hilo}' entre los correos del asunto '{asunto_a_buscar_param}'."}, 404
+        hilos = [hilo_elegido]
+        print(f"Se resume solo el hilo {hilo_elegido['id']} ({len(hilo_elegido['mensajes'])} correos).")
+    else:
+        with metricas.medir('hilos'):
+            hilos = construir_hilos(todos_los_datos_extraidos)
+        print(f"Los {len(todos_los_datos_extraidos)} correos forman {len(hilos)} hilo(s) de conversación.")
+
+    # Hilo por hilo y, dentro de cada uno, en orden cronológico (fecha y hora completas)
+    todos_los_datos_extraidos = [datos for hilo in hilos for datos in hilo['mensajes']]
+    textos_para_resumen_consolidado = []
+    for numero_hilo, hilo in enumerate(hilos, start=1):
+        for posicion, info_correo_ordenado in enumerate(hilo['mensajes']):
+            # Formato más estructurado para la IA
+            texto_correo_info = (
+                f"FECHA: {info_correo_ordenado.get('fecha', 'N/A')}\n"
+                f"DE: {info_correo_ordenado.get('remitente', 'N/A')}\n"
+                f"ASUNTO: {info_correo_ordenado.get('asunto', 'N/A')}\n"
+                f"CUERPO:\n{info_correo_ordenado.get('cuerpo_texto_plano', '')}"
+            )
+            if len(hilos) > 1 and posicion == 0:
+                texto_correo_info = f"HILO {numero_hilo}: {hilo['asunto']}\n" + texto_correo_info
+            textos_para_resumen_consolidado.append(texto_correo_info)
+
+    resumen_final_consolidado = "No se generó resumen consolidado."
+    estadisticas_resumen = {}
+    if GEMINI_API_KEY_CONFIGURADA and textos_para_resumen_consolidado:
+        print(f"Intentando generar resumen consolidado para {len(textos_para_resumen_consolidado)} correos (ordenados cronológicamente).")
+        notificar('resumen', {"correos": len(textos_para_resumen_consolidado)})
+        # La API de streaming de Gemini solo se usa si alguien está escuchando los fragmentos
+        al_recibir_token = (lambda texto: notificar('token', {"texto": texto})) if transmitir else None
+        try:
+            # El resumen incremental se apoya en los UIDs, que solo son comparables dentro de una carpeta
+            if parametros['modo_resumen'] == 'incremental' and len(carpetas) > 1:
+                print("Resumen incremental no disponible al buscar en varias carpetas; se genera completo.")
+            if parametros['modo_resumen'] == 'incremental' and len(carpetas) == 1:
+                carpeta = carpetas[0]
+                clave_hilo = "|".join([carpeta, asunto_a_buscar_param.strip().lower(), origen, ",".join(campos_busqueda),
+                                       fecha_desde_param or '', fecha_hasta_param or '', hilos[0]['id'] if id_hilo else ''])
+                resumen_final_consolidado = generar_resumen_hilo(clave_hilo, carpeta, uidvalidities.get(carpeta), todos_los_datos_extraidos,
+                                                                 textos_para_resumen_consolidado, estadisticas_resumen, al_recibir_token)
+            else:
+                resumen_final_consolidado = generar_resumen_consolidado_ia(textos_para_resumen_consolidado, estadisticas_resumen, al_recibir_token)
+        except Exception as e:
+            print(f"Error al generar resumen con IA: {e}")
+            resumen_final_consolidado = f"Error al generar resumen: {str(e)}"
+    elif not GEMINI_API_KEY_CONFIGURADA:
+        resumen_final_consolidado = "Resumen consolidado no disponible (API Key de Gemini no configurada)."
+    elif not textos_para_resumen_consolidado:
+         resumen_final_consolidado = "No se encontraron correos para generar un resumen consolidado con los filtros aplicados."
 
-        return jsonify(respuesta_final)
+    respuesta_final = {
+        "resumen_consolidado": resumen_final_consolidado,
+        "total_correos": len(todos_los_datos_extraidos),
+        "fetch": estadisticas_fetch,
+        "origen": origen,
+        "carpetas": carpetas,
+        "resumen": estadisticas_resumen,
+        "hilos": [
+            {
+                "id": hilo['id'],
+                "asunto": hilo['asunto'],
+                "cantidad": len(hilo['mensajes']),
+                "desde": hilo['mensajes'][0].get('fecha', ''),
+                "hasta": hilo['mensajes'][-1].get('fecha', ''),
+                "arbol": hilo['arbol']
+            }
+            for hilo in hilos
+        ]
+    }
+    
+    if not uids_correos_encontrados:
+         respuesta_final["mensaje_general"] = f"No se encontraron correos con el asunto: '{asunto_a_buscar_param}' y los filtros de fecha aplicados."
+
+    return respuesta_final, 200
+
+@app.route('/api/buscar_correos', methods=['GET'])
+def buscar_correos():
+    try:
+        parametros, error_msg = leer_parametros_busqueda(request.args)
+        if error_msg:
+            return jsonify({"error": error_msg}), 400
+        respuesta, codigo = ejecutar_busqueda_correos(parametros)
+        return jsonify(respuesta), codigo
         
     except Exception as e:
         print(f"Error general en buscar_correos: {str(e)}")
@@ -345,6 +1148,127 @@ def buscar_correos():
         traceback.print_exc()
         return jsonify({"error": f"Error interno del servidor: {str(e)}"}), 500
 
+@app.route('/api/buscar_correos/stream', methods=['GET'])
+def buscar_correos_stream():
+    """
+    Variante de /api/buscar_correos que responde con Server-Sent Events: envía el
+    progreso de la búsqueda y los fragmentos del resumen a medida que se generan,
+    y al final un evento 'resultado' con la misma respuesta que el endpoint normal.
+    """
+    parametros, error_msg = leer_parametros_busqueda(request.args)
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+
+    eventos = queue.Queue()
+
+    def trabajar():
+        try:
+            respuesta, codigo = ejecutar_busqueda_correos(parametros, lambda evento, datos: eventos.put((evento, datos)), transmitir=True)
+            eventos.put(('resultado' if codigo == 200 else 'error', respuesta))
+        except Exception as e:
+            print(f"Error general en buscar_correos_stream: {str(e)}")
+            eventos.put(('error', {"error": f"Error interno del servidor: {str(e)}"}))
+        finally:
+            eventos.put(None)
+
+    # La búsqueda sigue en otro hilo aunque el cliente se desconecte (el resultado queda en caché)
+    threading.Thread(target=trabajar, daemon=True).start()
+
+    def generar_eventos():
+        yield ": conectado\n\n"
+        while True:
+            try:
+                item = eventos.get(timeout=15)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                break
+            evento, datos = item
+            yield f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+    return Response(generar_eventos(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/trabajos/buscar_correos', methods=['POST'])
+def crear_trabajo_buscar_correos():
+    """
+    Encola una búsqueda de correos y devuelve enseguida el ID del trabajo.
+    Acepta los mismos parámetros que /api/buscar_correos (en el cuerpo JSON o en la URL).
+    Si ya hay un trabajo idéntico en curso se devuelve ese mismo ID.
+    """
+    try:
+        argumentos = dict(request.args)
+        argumentos.update({k: str(v) for k, v in (request.get_json(silent=True) or {}).items()})
+        parametros, error_msg = leer_parametros_busqueda(argumentos)
+        if error_msg:
+            return jsonify({"error": error_msg}), 400
+
+        clave = json.dumps({**parametros, "asunto": parametros['asunto'].strip().lower()}, sort_keys=True)
+        trabajo_id, duplicado = gestor_trabajos.enviar(
+            clave, lambda notificar: ejecutar_busqueda_correos(parametros, notificar)
+        )
+        return jsonify({
+            "job_id": trabajo_id,
+            "duplicado": duplicado,
+            "estado_url": f"/api/trabajos/{trabajo_id}"
+        }), 202
+    except ColaLlena as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        print(f"Error al crear trabajo de búsqueda: {str(e)}")
+        return jsonify({"error": f"Error interno del servidor: {str(e)}"}), 500
+
+@app.route('/api/trabajos/<trabajo_id>', methods=['GET'])
+def estado_trabajo(trabajo_id):
+    """Devuelve el estado de un trabajo y, cuando terminó, su resultado."""
+    trabajo = gestor_trabajos.obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({"error": "El trabajo no existe o su resultado ya expiró"}), 404
+    return jsonify(trabajo)
+
+@app.route('/api/trabajos', methods=['GET'])
+def estado_trabajos():
+    return jsonify(gestor_trabajos.estado())
+
+@app.route('/api/sincronizar_correos', methods=['POST'])
+def sincronizar_correos():
+    """Trae al almacén local solo los correos de la bandeja de entrada que llegaron desde la última sincronización."""
+    try:
+        if not EMAIL_USUARIO_FIJO or not CONTRASENA_APP_FIJA:
+            return jsonify({"error": "Las credenciales de Gmail no están configuradas correctamente."}), 500
+
+        carpeta = request.args.get('carpeta') or 'INBOX'
+        estadisticas_fetch = {'round_trips': 0}
+        nuevos = obtener_pool_imap(EMAIL_USUARIO_FIJO, CONTRASENA_APP_FIJA).ejecutar(
+            lambda conexion_imap: sincronizar_carpeta(conexion_imap, carpeta, estadisticas=estadisticas_fetch)
+        )
+        if nuevos is None:
+            return jsonify({"error": "No se pudo conectar a Gmail vía IMAP."}), 500
+
+        uidvalidity, uidnext = almacen_correos.estado(carpeta)
+        return jsonify({
+            "carpeta": carpeta,
+            "nuevos": nuevos,
+            "total_almacenados": almacen_correos.contar(carpeta),
+            "uidvalidity": uidvalidity,
+            "uidnext": uidnext,
+            "fetch": estadisticas_fetch
+        })
+    except Exception as e:
+        print(f"Error en sincronizar_correos: {str(e)}")
+        return jsonify({"error": f"Error al sincronizar correos: {str(e)}"}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def exportar_metricas():
+    """Métricas acumuladas (tiempos por etapa, bytes, correos parseados, cachés) en formato Prometheus."""
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache_resumenes', methods=['GET'])
+def estado_cache_resumenes():
+    """Devuelve los contadores de aciertos/fallos de la caché de resúmenes."""
+    return jsonify(cache_resumenes.estadisticas())
+
 @app.route('/api/analizar_datos', methods=['GET'])
 def analizar_datos():
     """Endpoint para analizar datos de una hoja de cálculo de Google Sheets"""
@@ -355,16 +1279,8 @@ def analizar_datos():
         return jsonify({"error": "Es necesario proporcionar el ID de la hoja y el rango"}), 400
     
     try:
-        # Crear los servicios de Google
-        _, sheets_service = crear_servicios()
-        
-        # Obtener los datos de la hoja de cálculo
-        result = sheets_service.spreadsheets().values().get(
-            spreadsheetId=sheet_id, 
-            range=rango
-        ).execute()
-        
-        valores = result.get('values', [])
+        # Obtener los datos de la hoja de cálculo (por bloques de filas)
+        valores = leer_hoja(sheet_id, rango)
         
         if not valores:
             return jsonify({"error": "No se encontraron datos en la hoja de cálculo"}), 404
@@ -373,37 +1289,48 @@ def analizar_datos():
         # Este es un ejemplo simple que asume que la primera fila son encabezados
         # y la primera columna son etiquetas
         headers = valores[0][1:] if len(valores[0]) > 1 else []
-        labels = [row[0] for row in valores[1:] if len(row) > 0]
+        labels = [row[0] if len(row) > 0 else "" for row in valores[1:]]
+        
+        # Cada columna se tipa y convierte una sola vez (los faltantes quedan como NaN)
+        columnas = tipar_columnas(headers, [row[1:] for row in valores[1:]])
+        columnas_numericas = [c for c in columnas if c["tipo"] == "numero"]
         
         datasets = []
-        for i, header in enumerate(headers):
-            data_points = []
-            for row in valores[1:]:
-                # Obtener el valor numérico o 0 si no existe
-                value = float(row[i+1]) if len(row) > i+1 and row[i+1] and row[i+1].replace('.','',1).isdigit() else 0
-                data_points.append(value)
+        for columna in columnas_numericas:
+            # Los valores faltantes van como null para que el gráfico los deje vacíos
+            data_points = a_lista(columna["valores"])
             
             # Generar un color aleatorio para el dataset
             color = f"rgba({random.randint(0, 255)}, {random.randint(0, 255)}, {random.randint(0, 255)}, 0.7)"
             
             datasets.append({
-                "label": header,
+                "label": columna["nombre"],
                 "data": data_points,
                 "backgroundColor": color,
                 "borderColor": color.replace("0.7", "1"),
                 "borderWidth": 1
             })
         
+        # Digesto estadístico calculado localmente: a Gemini solo se envía esto (y una
+        # muestra opcional de filas, ?muestra=N), así el prompt no crece con la hoja
+        try:
+            filas_muestra = min(int(request.args.get('muestra', ANALISIS_FILAS_MUESTRA)), ANALISIS_FILAS_MUESTRA_MAX)
+        except ValueError:
+            return jsonify({"error": "El parámetro 'muestra' debe ser un número entero"}), 400
+        digesto = generar_digesto(labels, columnas, top=ANALISIS_TOP, filas_muestra=max(filas_muestra, 0))
+        
         # Generar un resumen de los datos usando Google Gemini si está disponible
         resumen = ""
         if GEMINI_API_KEY_CONFIGURADA:
             try:
                 prompt = f"""
-                Analiza los siguientes datos y genera un breve resumen ejecutivo:
+                Analiza los siguientes datos y genera un breve resumen ejecutivo.
+                No tienes las filas completas: tienes estadísticas por columna calculadas sobre
+                todas las filas (mínimo, máximo, media, percentiles, tendencia a lo largo de las
+                filas, valores más frecuentes y atípicos) y una muestra de filas.
                 
-                Encabezados: {headers}
-                Etiquetas: {labels}
-                Valores: {valores[1:]}
+                Primera columna (etiquetas): {valores[0][0] if valores[0] else ""}
+                Datos: {formatear_digesto(digesto, ANALISIS_MAX_CHARS_PROMPT)}
                 
                 El resumen debe incluir:
                 1. Tendencias principales observadas
@@ -423,6 +1350,8 @@ def analizar_datos():
             "tipo_grafico": "bar",  # Puede ser 'bar', 'line', 'pie', etc.
             "labels": labels,
             "datasets": datasets,
+            "columnas": [{"nombre": c["nombre"], "tipo": c["tipo"], "validos": c["validos"]} for c in columnas],
+            "estadisticas": digesto["estadisticas"],
             "resumen": resumen
         })
         
@@ -433,20 +1362,17 @@ def analizar_datos():
 def analizar_bbdd():
     """Endpoint para analizar la base de datos de fallas específica"""
     try:
-        # Usar un ID de hoja específico
-        sheet_id = "1UeO_fORpKELd15gOzitXD3VMCZPMSIQpR6aX9A-eyaA"
-        rango = "Import!A1:Z"  # Ajustar según sea necesario
-        
-        # Crear los servicios de Google
-        _, sheets_service = crear_servicios()
-        
-        # Obtener los datos de la hoja de cálculo
-        result = sheets_service.spreadsheets().values().get(
-            spreadsheetId=sheet_id, 
-            range=rango
-        ).execute()
-        
-        valores = result.get('values', [])
+        top = int(request.args.get('top', 5))
+    except ValueError:
+        return jsonify({"error": "Parámetro inválido: 'top' debe ser un número"}), 400
+
+    try:
+        # Agrupación adicional opcional: ?agrupar_por=Family,Process
+        columnas_extra = [c.strip() for c in (request.args.get('agrupar_por') or '').split(',') if c.strip()]
+        columnas = tuple(BBDD_COLUMNAS) + tuple(sorted(set(columnas_extra) - set(BBDD_COLUMNAS)))
+
+        # Los valores salen de la copia en memoria; solo se descargan si la hoja cambió en Drive
+        valores, snapshot = cache_hojas.obtener(BBDD_SHEET_ID, BBDD_RANGO, columnas)
         
         if not valores or len(valores) <= 1:
             return jsonify({"error": "No se encontraron datos suficientes"}), 404
@@ -487,66 +1413,32 @@ def analizar_bbdd():
         
         print(f"Columnas encontradas: TrackID={track_id_index}, Family={family_index}, TestCode={test_code_index}, Process={proceso_index}")
         
-        # Procesar datos para los gráficos
-        # 1. Conteo por familia
-        family_counts = {}
-        for row in valores[1:]:  # Saltamos los encabezados
-            if len(row) > family_index:  # Aseguramos que la fila tenga los datos necesarios
-                family = row[family_index] if row[family_index] else "Sin Familia"
-                if family in family_counts:
-                    family_counts[family] += 1
-                else:
-                    family_counts[family] = 1
-        
-        # Obtener top 5 familias
-        top_families = sorted(family_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-        
-        # 2. Conteo por TestCode
-        testcode_counts = {}
-        for row in valores[1:]:
-            if len(row) > test_code_index:
-                testcode = row[test_code_index] if len(row) > test_code_index and row[test_code_index] else "Sin TestCode"
-                if testcode in testcode_counts:
-                    testcode_counts[testcode] += 1
-                else:
-                    testcode_counts[testcode] = 1
-        
-        # Obtener top 5 TestCodes
-        top_testcodes = sorted(testcode_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-        
-        # 3. Conteo por Proceso
-        proceso_counts = {}
-        for row in valores[1:]:
-            if len(row) > proceso_index:
-                proceso = row[proceso_index] if len(row) > proceso_index and row[proceso_index] else "Sin Proceso"
-                if proceso in proceso_counts:
-                    proceso_counts[proceso] += 1
-                else:
-                    proceso_counts[proceso] = 1
-        
-        # Obtener top procesos
-        top_procesos = sorted(proceso_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-        
+        # Procesar datos para los gráficos: todos los conteos en una sola pasada
+        agrupaciones = {
+            "family": (family_index,),
+            "testcode": (test_code_index,),
+            "proceso": (proceso_index,),
+            "family_testcode": (family_index, test_code_index)
+        }
+        valores_vacios = {family_index: "Sin Familia", test_code_index: "Sin TestCode", proceso_index: "Sin Proceso"}
+
+        if columnas_extra:
+            indices_extra = indices_columnas(headers, columnas_extra)
+            faltantes = [c for c in columnas_extra if c not in indices_extra]
+            if faltantes:
+                return jsonify({"error": f"No se encontraron las columnas: {', '.join(faltantes)}"}), 400
+            agrupaciones["personalizada"] = tuple(indices_extra[c] for c in columnas_extra)
+
+        conteos = agregar_filas(valores[1:], agrupaciones, valores_vacios)
+
+        # 1-3. Top 5 familias, TestCodes y procesos
+        top_families = top_n(conteos["family"], 5)
+        top_testcodes = top_n(conteos["testcode"], 5)
+        top_procesos = top_n(conteos["proceso"], 5)
+
         # 4. Top TestCodes por cada una de las 5 familias principales
-        testcodes_by_family = {}
-        for family_name, _ in top_families:
-            testcodes_by_family[family_name] = {}
-        
-        for row in valores[1:]:
-            if len(row) > max(family_index, test_code_index):
-                family = row[family_index] if row[family_index] else "Sin Familia"
-                if family in testcodes_by_family:
-                    testcode = row[test_code_index] if len(row) > test_code_index and row[test_code_index] else "Sin TestCode"
-                    if testcode in testcodes_by_family[family]:
-                        testcodes_by_family[family][testcode] += 1
-                    else:
-                        testcodes_by_family[family][testcode] = 1
-        
-        # Para cada familia, obtener sus top 5 TestCodes
-        family_top_testcodes = {}
-        for family in testcodes_by_family:
-            family_top_testcodes[family] = sorted(testcodes_by_family[family].items(), key=lambda x: x[1], reverse=True)[:5]
-        
+        family_top_testcodes = top_n_por_grupo(conteos["family_testcode"], [f for f, _ in top_families], 5)
+
         # Preparar datos para el frontend
         charts_data = {
             "total_registros": len(valores) - 1,
@@ -575,25 +1467,16 @@ def analizar_bbdd():
         }
         
         # Preparar datos para gráfico de barras agrupadas de TestCodes por Familia
+        conteo_por_familia = {family: dict(testcodes) for family, testcodes in family_top_testcodes.items()}
         all_testcodes = set()
-        for family in family_top_testcodes:
-            for testcode, _ in family_top_testcodes[family]:
-                all_testcodes.add(testcode)
+        for testcodes in conteo_por_familia.values():
+            all_testcodes.update(testcodes)
         
         for testcode in all_testcodes:
             dataset = {
                 "label": testcode,
-                "data": []
+                "data": [conteo_por_familia[family].get(testcode, 0) for family in family_top_testcodes]
             }
-            for family in family_top_testcodes:
-                found = False
-                for tc, count in family_top_testcodes[family]:
-                    if tc == testcode:
-                        dataset["data"].append(count)
-                        found = True
-                        break
-                if not found:
-                    dataset["data"].append(0)
             
             # Color aleatorio para cada dataset
             color = f"rgba({random.randint(0, 255)}, {random.randint(0, 255)}, {random.randint(0, 255)}, 0.7)"
@@ -602,6 +1485,18 @@ def analizar_bbdd():
             dataset["borderWidth"] = 1
             
             charts_data["testcodes_by_family"]["datasets"].append(dataset)
+
+        if "personalizada" in conteos:
+            top_personalizada = conteos["personalizada"].most_common(top)
+            charts_data["agrupacion_personalizada"] = {
+                "columnas": columnas_extra,
+                "labels": [" / ".join(clave) for clave, _ in top_personalizada],
+                "data": [cantidad for _, cantidad in top_personalizada],
+                "tipo": "bar",
+                "titulo": f"Top {len(top_personalizada)} por {', '.join(columnas_extra)}"
+            }
+
+        charts_data["snapshot"] = snapshot
         
         return jsonify(charts_data)
         
@@ -610,23 +1505,168 @@ def analizar_bbdd():
         print(traceback.format_exc())  # Imprime el error completo en la consola
         return jsonify({"error": f"Error al analizar datos: {str(e)}"}), 500
 
+@app.route('/api/analizar_bbdd/tendencias', methods=['GET'])
+def tendencias_bbdd():
+    """
+    Tendencia de fallas por día o semana para Family, TestCode o Process.
+    Parámetros: granularidad (dia|semana), dimension (family|testcode|proceso),
+    top (cantidad de series), desde y hasta (YYYY-MM-DD).
+    """
+    granularidad = request.args.get('granularidad', 'dia')
+    dimension = request.args.get('dimension', 'family')
+    desde = request.args.get('desde')
+    hasta = request.args.get('hasta')
+
+    if granularidad not in GRANULARIDADES:
+        return jsonify({"error": f"Granularidad no válida. Usa: {', '.join(GRANULARIDADES)}"}), 400
+    if dimension not in rollups_fallas.dimensiones:
+        return jsonify({"error": f"Dimensión no válida. Usa: {', '.join(rollups_fallas.dimensiones)}"}), 400
+    try:
+        top = int(request.args.get('top', 5))
+        for fecha in (desde, hasta):
+            if fecha:
+                datetime.strptime(fecha, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({"error": "Parámetros inválidos: 'top' debe ser un número y las fechas YYYY-MM-DD"}), 400
+
+    try:
+        # Si la copia de la hoja cambió se incorporan las filas nuevas; si no, se consulta directo
+        valores, snapshot = cache_hojas.obtener(BBDD_SHEET_ID, BBDD_RANGO, BBDD_COLUMNAS)
+        actualizacion = rollups_fallas.actualizar(valores, snapshot["version"])
+
+        if granularidad == 'semana' and desde:
+            # El bucket semanal es el lunes: se incluye la semana que contiene 'desde'
+            fecha_desde = datetime.strptime(desde, '%Y-%m-%d').date()
+            desde = (fecha_desde - timedelta(days=fecha_desde.weekday())).isoformat()
+        resultado = rollups_fallas.consultar(granularidad, dimension, top, desde, hasta)
+        resultado["snapshot"] = snapshot
+        resultado["actualizacion"] = actualizacion
+        resultado["estado"] = rollups_fallas.estado()
+        return jsonify(resultado)
+
+    except Exception as e:
+        import traceback
+        print(traceback.format_exc())
+        return jsonify({"error": f"Error al calcular tendencias: {str(e)}"}), 500
+
+INSTRUCCIONES_ASISTENTE = """Eres el asistente del analizador de correos y de la base de fallas de una fábrica de ensamblaje de celulares (marca Motorola). Responde en español.
+Si la pregunta trata sobre los correos, los informes o los datos de fallas, básate en los fragmentos numerados que siguen y cita entre corchetes los que uses (ej: [2]). Si no alcanzan para responder, dilo en lugar de inventar."""
+
+# Palabras de la consulta que piden buscar en Drive pero no son parte del nombre del archivo
+PALABRAS_BUSQUEDA_DRIVE = {'archivo', 'archivos', 'drive', 'buscar', 'busca', 'busco', 'encuentra', 'documento', 'documentos', 'google'}
+
+def _buscar_en_drive(consulta):
+    """Busca archivos en Drive por las palabras de la consulta y arma la respuesta con sus enlaces."""
+    terminos = [p for p in palabras_clave(consulta) if p not in PALABRAS_BUSQUEDA_DRIVE]
+    condiciones = [f"(name contains '{t}' or fullText contains '{t}')" for t in terminos[:5]]
+    drive_service, _ = crear_servicios()
+    archivos = buscar_archivos_drive(drive_service, " and ".join(condiciones + ["trashed = false"]))
+    if not archivos:
+        return f"No encontré archivos en Drive para: {' '.join(terminos) or consulta}.", []
+    lineas = [f"Encontré {len(archivos)} archivos en Drive:"]
+    for archivo in archivos:
+        modificado = f" (modificado: {archivo['modifiedTime']})" if archivo.get('modifiedTime') else ""
+        lineas.append(f"- 🔗 [{archivo.get('name', '')}]({archivo.get('webViewLink', '')}){modificado}")
+    return "\n".join(lineas), archivos
+
+def _agregados_bbdd():
+    """Totales de la base de fallas ya calculados en los rollups (no lee la hoja)."""
+    if not rollups_fallas.estado()["filas"]:
+        return []
+    lineas = []
+    for dimension in rollups_fallas.dimensiones:
+        resultado = rollups_fallas.consultar('semana', dimension, ANALISIS_TOP)
+        if resultado["series"]:
+            lineas.append(f"Fallas por {dimension} (total de la base): " + ", ".join(f"{s['label']}: {s['total']}" for s in resultado["series"]))
+    semanas = list(zip(resultado["labels"], resultado["total"]))[-8:]
+    if semanas:
+        lineas.append("Fallas por semana (desde el lunes indicado): " + ", ".join(f"{semana}: {total}" for semana, total in semanas))
+    return lineas
+
+def _indice_asistente(consulta, datos_analisis):
+    """
+    Índice BM25 con lo que el asistente puede citar: los correos guardados que
+    comparten palabras con la consulta, los últimos resúmenes generados y los
+    agregados de la base de fallas (los que mandó el frontend y los rollups).
+    """
+    indice = IndiceBM25()
+    correos = deduplicar_correos(almacen_correos.buscar_relevantes(palabras_clave(consulta), ASISTENTE_CANDIDATOS_CORREOS))
+    for datos in correos:
+        titulo = f"Correo del {datos.get('fecha', '')[:10]} de {datos.get('remitente', '')}: {datos.get('asunto', '')}"
+        indice.agregar(datos.get('cuerpo_texto_plano') or datos.get('asunto'), 'correo', titulo)
+    for fila in almacen_correos.resumenes_hilo_recientes(ASISTENTE_RESUMENES):
+        indice.agregar(fila['resumen'], 'resumen', f"Resumen de un hilo de {fila['cantidad']} correos ({fila['carpeta']})")
+    for resumen, creado in cache_resumenes.recientes(ASISTENTE_RESUMENES):
+        indice.agregar(resumen, 'resumen', f"Informe de correos generado el {datetime.fromtimestamp(creado):%Y-%m-%d}")
+    lineas = describir_datos_analisis(datos_analisis) if datos_analisis else []
+    lineas += _agregados_bbdd()
+    if lineas:
+        indice.agregar("\n\n".join(lineas), 'bbdd', "Datos de la base de fallas")
+    return indice
+
+def _historial_conversacion(contexto):
+    """Últimos turnos que manda el frontend ([{role, content}, ...] o textos) como texto para el prompt."""
+    if not isinstance(contexto, list):
+        return []
+    turnos = []
+    for turno in contexto[-ASISTENTE_TURNOS_CONTEXTO:]:
+        if isinstance(turno, dict):
+            rol = 'Usuario' if turno.get('role') == 'user' else 'Asistente'
+            turnos.append((rol, str(turno.get('content', ''))[:1000]))
+        elif turno:
+            turnos.append(('Usuario', str(turno)[:1000]))
+    return turnos
+
 @app.route('/api/asistente_consulta', methods=['POST'])
 def asistente_consulta():
+    """
+    Responde consultas del chat. Las de archivos/Drive se buscan en Drive; el resto
+    va a Gemini junto con los fragmentos más relevantes (BM25) de los correos
+    guardados, los resúmenes y los datos de la base de fallas, dentro de
+    ASISTENTE_PRESUPUESTO_TOKENS, y los últimos turnos de la conversación.
+    """
     try:
-        data = request.json
-        user_query = data.get('query', '')
+        data = request.json or {}
+        user_query = (data.get('query') or '').strip()
+        if not user_query:
+            return jsonify({"error": "La consulta está vacía"}), 400
         
         # Si la consulta es sobre búsqueda de archivos
         if "archivos" in user_query.lower() or "drive" in user_query.lower():
-            # Código existente para búsqueda de archivos...
-            pass
-            
-        # Si es otro tipo de consulta, usa el modelo generativo
-        model = genai.GenerativeModel('gemini-1.5-flash')  # Cambio aquí también
-        response = model.generate_content(user_query)
+            try:
+                respuesta, archivos = _buscar_en_drive(user_query)
+                return jsonify({"response": respuesta, "archivos": archivos})
+            except Exception as e:
+                print(f"No se pudo buscar en Drive ({e}); se responde con el modelo.")
+
+        # Las preguntas de seguimiento ("¿y la semana pasada?") se buscan junto con la anterior del usuario
+        historial = _historial_conversacion(data.get('context'))
+        anteriores = [texto for rol, texto in historial if rol == 'Usuario' and texto != user_query]
+        consulta_recuperacion = " ".join(anteriores[-1:] + [user_query])
+
+        with metricas.medir('recuperacion'):
+            indice = _indice_asistente(consulta_recuperacion, data.get('analysisData'))
+            fragmentos = seleccionar_dentro_de_presupuesto(
+                indice.buscar(consulta_recuperacion, ASISTENTE_FRAGMENTOS), ASISTENTE_PRESUPUESTO_TOKENS, estimar_tokens
+            )
+        print(f"Asistente: {len(fragmentos)} fragmentos elegidos de {len(indice.fragmentos)} indexados.")
+
+        partes = [INSTRUCCIONES_ASISTENTE]
+        if fragmentos:
+            partes.append("Fragmentos:\n\n" + "\n\n".join(
+                f"[{i}] {fragmento['titulo']}\n{fragmento['texto']}" for i, (_, fragmento) in enumerate(fragmentos, 1)
+            ))
+        if historial:
+            partes.append("Conversación previa:\n" + "\n".join(f"{rol}: {texto}" for rol, texto in historial))
+        partes.append(f"Pregunta: {user_query}")
+        texto = _generar_texto("\n\n".join(partes))
         
         return jsonify({
-            "response": response.text if hasattr(response, 'text') else "No se pudo generar una respuesta"
+            "response": texto or "No se pudo generar una respuesta",
+            "fuentes": [
+                {"numero": i, "origen": fragmento["origen"], "titulo": fragmento["titulo"], "puntaje": round(puntaje, 3)}
+                for i, (puntaje, fragmento) in enumerate(fragmentos, 1)
+            ]
         })
         
     except Exception as e:
@@ -644,8 +1684,7 @@ def test_connection():
         
         conexion = conectar_imap(EMAIL_USUARIO_FIJO, CONTRASENA_APP_FIJA)
         if conexion:
-            conexion.close()
-            conexion.logout()
+            liberar_imap(conexion)
             return jsonify({"status": "success", "message": "Conexión IMAP exitosa"})
         else:
             return jsonify({"status": "error", "message": "Falló la conexión IMAP"}), 500
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Límites (en segundos) de las cubetas de los histogramas
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Tiempos por etapa de la solicitud en curso, para el encabezado Server-Timing
+_tiempos_solicitud = contextvars.ContextVar('tiempos_solicitud', default=None)
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _etiquetas(etiquetas, extra=None):
+    pares = list(etiquetas) + ([extra] if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in pares) + "}"
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+class Metricas:
+    """
+    Contadores e histogramas en memoria, exportables en formato de texto de Prometheus.
+
+    - incrementar(nombre, valor, **etiquetas): contador (ej: bytes descargados).
+    - observar(nombre, segundos, **etiquetas): histograma con las cubetas de CUBETAS.
+    - medir(etapa): context manager (o decorador) que observa la duración en
+      'etapa_segundos{etapa=...}' y la suma a los tiempos de la solicitud en curso.
+
+    Los contadores 'cache_consultas_total{cache, resultado}' se exportan además
+    como tasa de aciertos por caché.
+    """
+
+    def __init__(self, prefijo='analizador'):
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self._contadores = {}  # (nombre, etiquetas) -> valor
+        self._histogramas = {}  # (nombre, etiquetas) -> [conteo por cubeta..., suma, cantidad]
+        self._ayudas = {}
+
+    def describir(self, nombre, ayuda):
+        self._ayudas[nombre] = ayuda
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = [0] * len(CUBETAS) + [0.0, 0]
+            for i, limite in enumerate(CUBETAS):
+                if valor <= limite:
+                    histograma[i] += 1
+            histograma[-2] += valor
+            histograma[-1] += 1
+
+    def registrar_etapa(self, etapa, segundos):
+        """Registra una etapa medida por fuera (ej: el parseo en otro proceso)."""
+        self.observar('etapa_segundos', segundos, etapa=etapa)
+        tiempos = _tiempos_solicitud.get()
+        if tiempos is not None:
+            with self._lock:
+                tiempos[etapa] = tiempos.get(etapa, 0.0) + segundos
+
+    @contextmanager
+    def medir(self, etapa):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar_etapa(etapa, time.perf_counter() - inicio)
+
+    def iniciar_solicitud(self):
+        """Empieza a acumular los tiempos por etapa de la solicitud actual y devuelve el diccionario."""
+        tiempos = {}
+        _tiempos_solicitud.set(tiempos)
+        return tiempos
+
+    def propagar(self, funcion):
+        """
+        Envuelve 'funcion' para que, al correr en otro hilo (ej: un ThreadPoolExecutor),
+        sus etapas se sumen a la solicitud que la creó.
+        """
+        tiempos = _tiempos_solicitud.get()
+
+        def envuelta(*args, **kwargs):
+            token = _tiempos_solicitud.set(tiempos)
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                _tiempos_solicitud.reset(token)
+        return envuelta
+
+    @staticmethod
+    def server_timing(tiempos, total=None):
+        """Valor del encabezado Server-Timing: 'etapa;dur=ms' por etapa (las de hilos paralelos se suman)."""
+        partes = [f"{etapa};dur={segundos * 1000:.1f}" for etapa, segundos in sorted(tiempos.items())]
+        if total is not None:
+            partes.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(partes)
+
+    def exportar(self):
+        """Texto en el formato de exposición de Prometheus (versión 0.0.4)."""
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted((clave, list(valores)) for clave, valores in self._histogramas.items())
+
+        lineas = []
+        declarados = set()
+
+        def declarar(nombre, tipo):
+            if nombre not in declarados:
+                declarados.add(nombre)
+                ayuda = self._ayudas.get(nombre)
+                if ayuda:
+                    lineas.append(f"# HELP {self.prefijo}_{nombre} {ayuda}")
+                lineas.append(f"# TYPE {self.prefijo}_{nombre} {tipo}")
+
+        for (nombre, etiquetas), valor in contadores:
+            declarar(nombre, 'counter')
+            lineas.append(f"{self.prefijo}_{nombre}{_etiquetas(etiquetas)} {_numero(valor)}")
+
+        for (nombre, etiquetas), valores in histogramas:
+            declarar(nombre, 'histogram')
+            for limite, conteo in zip(CUBETAS, valores):
+                lineas.append(f"{self.prefijo}_{nombre}_bucket{_etiquetas(etiquetas, ('le', _numero(float(limite))))} {conteo}")
+            lineas.append(f"{self.prefijo}_{nombre}_bucket{_etiquetas(etiquetas, ('le', '+Inf'))} {valores[-1]}")
+            lineas.append(f"{self.prefijo}_{nombre}_sum{_etiquetas(etiquetas)} {_numero(valores[-2])}")
+            lineas.append(f"{self.prefijo}_{nombre}_count{_etiquetas(etiquetas)} {valores[-1]}")
+
+        # Tasa de aciertos por caché a partir de los contadores de consultas
+        consultas = {}
+        for (nombre, etiquetas), valor in contadores:
+            if nombre == 'cache_consultas_total':
+                datos = dict(etiquetas)
+                aciertos, total = consultas.get(datos.get('cache'), (0, 0))
+                consultas[datos.get('cache')] = (aciertos + (valor if datos.get('resultado') == 'acierto' else 0), total + valor)
+        if consultas:
+            declarar('cache_tasa_aciertos', 'gauge')
+            for cache, (aciertos, total) in sorted(consultas.items()):
+                lineas.append(f"{self.prefijo}_cache_tasa_aciertos{_etiquetas([('cache', cache)])} {_numero(aciertos / total if total else 0.0)}")
+        return "\n".join(lineas) + "\n"
+
+# Registro compartido por todos los módulos de la aplicación
+metricas = Metricas()
+metricas.describir('etapa_segundos', "Duración de cada etapa (IMAP, parseo MIME, hilos, Gemini, Google APIs).")
+metricas.describir('solicitud_segundos', "Duración de cada solicitud HTTP por ruta.")
+metricas.describir('imap_bytes_descargados_total', "Bytes recibidos en respuestas UID FETCH.")
+metricas.describir('imap_round_trips_total', "Comandos UID FETCH enviados al servidor IMAP.")
+metricas.describir('correos_parseados_total', "Correos parseados (MIME).")
+metricas.describir('gemini_llamadas_total', "Llamadas a Gemini.")
+metricas.describir('gemini_caracteres_prompt_total', "Caracteres enviados a Gemini en los prompts.")
+metricas.describir('gemini_reintentos_total', "Reintentos de llamadas a Gemini por errores 429/5xx.")
+metricas.describir('gemini_coalescidas_total', "Solicitudes que reutilizaron una llamada idéntica en curso.")
+metricas.describir('cache_consultas_total', "Consultas a cada caché por resultado (acierto/fallo).")
+metricas.describir('cache_tasa_aciertos', "Fracción de consultas a cada caché que fueron aciertos.")
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import email
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email.header import decode_header
+from email.utils import parsedate_to_datetime
+
+from texto_correos import html_a_texto, limpiar_cuerpo
+
+def decodificar_asunto(header_string):
+    """Decodifica el encabezado del correo, manejando diferentes codificaciones."""
+    if not header_string:
+        return ""
+    decoded_parts = decode_header(header_string)
+    asunto_decodificado = []
+    for part, charset in decoded_parts:
+        if isinstance(part, bytes):
+            try:
+                asunto_decodificado.append(part.decode(charset or 'utf-8', errors='replace'))
+            except LookupError:
+                asunto_decodificado.append(part.decode('utf-8', errors='replace'))
+        else:
+            asunto_decodificado.append(part)
+    return "".join(asunto_decodificado)
+
+def _decodificar_parte(part):
+    contenido = part.get_payload(decode=True) or b''
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        return contenido.decode(charset, errors='replace')
+    except LookupError:
+        return contenido.decode('utf-8', errors='replace')
+
+def extraer_cuerpo(mensaje_parseado):
+    """Texto del cuerpo: la primera parte text/plain o, si no hay, la primera text/html convertida."""
+    partes = mensaje_parseado.walk() if mensaje_parseado.is_multipart() else [mensaje_parseado]
+    html = None
+    for part in partes:
+        if part.is_multipart() or part.get_content_disposition() == 'attachment':
+            continue
+        tipo = part.get_content_type()
+        try:
+            if tipo == "text/plain":
+                return _decodificar_parte(part)
+            if tipo == "text/html" and html is None:
+                html = _decodificar_parte(part)
+        except Exception as e:
+            print(f"Error al decodificar parte del correo: {e}")
+    return html_a_texto(html) if html else ""
+
+def extraer_informacion_correo(mensaje_parseado, email_uid):
+    """Extrae información relevante del correo parseado."""
+    try:
+        # Extraer información básica
+        asunto = decodificar_asunto(mensaje_parseado.get('Subject', ''))
+        remitente = mensaje_parseado.get('From', '')
+        fecha_str = mensaje_parseado.get('Date', '')
+
+        # Convertir fecha
+        fecha_datetime = None
+        if fecha_str:
+            try:
+                fecha_datetime = parsedate_to_datetime(fecha_str)
+            except Exception as e:
+                print(f"Error al parsear fecha: {e}")
+
+        # Extraer cuerpo del correo: text/plain, o text/html convertido si no hay texto plano.
+        # Después se quita el historial citado y la firma para quedarse con lo nuevo
+        cuerpo_texto = limpiar_cuerpo(extraer_cuerpo(mensaje_parseado))
+
+        return {
+            'uid': email_uid.decode() if isinstance(email_uid, bytes) else str(email_uid),
+            'asunto': asunto,
+            'remitente': remitente,
+            'fecha': fecha_datetime.isoformat() if fecha_datetime else '',
+            'message_id': mensaje_parseado.get('Message-ID', '').strip(),
+            'in_reply_to': mensaje_parseado.get('In-Reply-To', '').strip(),
+            'references': mensaje_parseado.get('References', '').strip(),
+            'cuerpo_texto_plano': cuerpo_texto[:1000]  # Limitar tamaño
+        }
+    except Exception as e:
+        print(f"Error al extraer información del correo: {e}")
+        return None
+
+def procesar_correo(email_uid, raw_email):
+    """Parsea los bytes de un correo y extrae su información; None si falla."""
+    try:
+        return extraer_informacion_correo(email.message_from_bytes(raw_email), email_uid)
+    except Exception as e:
+        print(f"Error al procesar correo UID {email_uid}: {e}")
+        return None
+
+def procesar_lote(correos):
+    """Tarea que corre en los procesos del pool: [(uid, bytes), ...] -> [información o None, ...]"""
+    return [procesar_correo(email_uid, raw_email) for email_uid, raw_email in correos]
+
+def _procesar_lote_medido(correos):
+    """Como procesar_lote, pero devuelve también los segundos que tardó (medidos donde corre)."""
+    inicio = time.perf_counter()
+    resultados = procesar_lote(correos)
+    return resultados, time.perf_counter() - inicio
+
+class ProcesadorCorreos:
+    """
+    Parsea correos en un pool de procesos mientras se siguen descargando.
+
+    parsear() recibe un iterable de (uid, bytes) (ej: un generador que descarga por
+    lotes), envía tareas de 'tamano_tarea' correos al pool a medida que llegan y
+    devuelve (uid, información) en el mismo orden de entrada. Con 'procesos' en 0, o
+    si hay menos de 'minimo_paralelo' correos, se parsea en el mismo hilo.
+
+    Si un proceso del pool falla, esa tarea se vuelve a parsear en el hilo actual
+    (cada correo con su propio manejo de errores) y el pool se recrea en el próximo uso.
+
+    'al_parsear(cantidad, segundos)' (opcional) se llama en el hilo que consume los
+    resultados con el tiempo de parseo de cada tarea, aunque haya corrido en otro proceso.
+    """
+
+    def __init__(self, procesos=2, tamano_tarea=20, minimo_paralelo=50, al_parsear=None):
+        self.procesos = procesos
+        self.tamano_tarea = tamano_tarea
+        self.minimo_paralelo = minimo_paralelo
+        self.al_parsear = al_parsear or (lambda cantidad, segundos: None)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _obtener_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 'spawn': hacer fork de un servidor con hilos puede dejar locks tomados en el hijo
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.procesos, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _descartar_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def parsear(self, correos_crudos, cantidad=None):
+        """Generador de (uid, información o None). 'cantidad' es el total esperado, si se conoce."""
+        if self.procesos <= 0 or (cantidad is not None and cantidad < self.minimo_paralelo):
+            for email_uid, raw_email in correos_crudos:
+                inicio = time.perf_counter()
+                informacion = procesar_correo(email_uid, raw_email)
+                self.al_parsear(1, time.perf_counter() - inicio)
+                yield email_uid, informacion
+            return
+
+        executor = self._obtener_executor()
+        en_vuelo = deque()
+        tarea = []
+
+        def enviar(tarea):
+            nonlocal executor
+            futuro = None
+            if executor is not None:
+                try:
+                    futuro = executor.submit(_procesar_lote_medido, tarea)
+                except (BrokenProcessPool, RuntimeError) as e:
+                    print(f"El pool de parseo no está disponible ({e}); se parsea en este hilo.")
+                    self._descartar_executor(executor)
+                    executor = None
+            en_vuelo.append((tarea, futuro))
+
+        def resultado(tarea, futuro):
+            nonlocal executor
+            if futuro is not None:
+                try:
+                    resultados, segundos = futuro.result()
+                    self.al_parsear(len(tarea), segundos)
+                    return resultados
+                except Exception as e:
+                    print(f"Falló un proceso de parseo ({e}); se reintenta la tarea en este hilo.")
+                    if isinstance(e, BrokenProcessPool) and executor is not None:
+                        self._descartar_executor(executor)
+                        executor = None
+            resultados, segundos = _procesar_lote_medido(tarea)
+            self.al_parsear(len(tarea), segundos)
+            return resultados
+
+        for correo in correos_crudos:
+            tarea.append(correo)
+            if len(tarea) >= self.tamano_tarea:
+                enviar(tarea)
+                tarea = []
+            # Se entregan los resultados que ya están listos sin frenar la descarga
+            while en_vuelo and (en_vuelo[0][1] is None or en_vuelo[0][1].done()):
+                lista, futuro = en_vuelo.popleft()
+                yield from zip((uid for uid, _ in lista), resultado(lista, futuro))
+        if tarea:
+            enviar(tarea)
+        while en_vuelo:
+            lista, futuro = en_vuelo.popleft()
+            yield from zip((uid for uid, _ in lista), resultado(lista, futuro))
+
+    def cerrar(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True)
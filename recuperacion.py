@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import math
+import re
+import unicodedata
+from collections import Counter
+
+# Palabras demasiado comunes para ayudar a elegir fragmentos (sin tildes, como quedan al tokenizar)
+PALABRAS_VACIAS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes asi aun cada como con contra cual cuales
+cuando cuanto cuantos de del desde donde dos durante e el ella ellas ellos en entre era es esa esas
+ese eso esos esta estan estas este esto estos fue fueron ha han hasta hay la las le les lo los mas
+me mi mis mucho muy nada ni no nos o otra otras otro otros para pero poco por porque que quien se
+sea segun ser si sin sobre son su sus tambien te tiene tienen todo todos tu tus un una unas uno unos
+y ya yo dame dime decir hacer puedes quiero quisiera saber favor
+the and or of to in on for is are was what which who how
+""".split())
+
+def _sin_tildes(texto):
+    return "".join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c))
+
+def _singular(termino):
+    # Plural simple ('fallas' -> 'falla') para que singular y plural coincidan
+    return termino[:-1] if len(termino) > 3 and termino.endswith('s') and not termino.endswith('ss') else termino
+
+def tokenizar(texto):
+    """Términos para BM25: minúsculas, sin tildes ni plural simple, sin palabras vacías ni términos de una letra."""
+    return [_singular(t) for t in re.findall(r"\w+", _sin_tildes((texto or '').lower())) if len(t) > 1 and t not in PALABRAS_VACIAS]
+
+def palabras_clave(texto):
+    """Palabras de la consulta sin las vacías, con sus tildes (para buscar en el índice FTS de correos)."""
+    return [p for p in re.findall(r"\w+", (texto or '').lower()) if len(p) > 1 and _sin_tildes(p) not in PALABRAS_VACIAS]
+
+def dividir_fragmentos(texto, max_chars=1200):
+    """Parte un texto largo en fragmentos de hasta 'max_chars', cortando por párrafos cuando se puede."""
+    fragmentos = []
+    actual = ""
+    for parrafo in re.split(r"\n\s*\n", texto or ''):
+        parrafo = parrafo.strip()
+        while len(parrafo) > max_chars:
+            if actual:
+                fragmentos.append(actual)
+                actual = ""
+            corte = parrafo.rfind(' ', 0, max_chars)
+            corte = corte if corte > max_chars // 2 else max_chars
+            fragmentos.append(parrafo[:corte].strip())
+            parrafo = parrafo[corte:].strip()
+        if not parrafo:
+            continue
+        if actual and len(actual) + len(parrafo) + 2 > max_chars:
+            fragmentos.append(actual)
+            actual = ""
+        actual = f"{actual}\n\n{parrafo}" if actual else parrafo
+    if actual:
+        fragmentos.append(actual)
+    return fragmentos
+
+class IndiceBM25:
+    """
+    Índice en memoria de fragmentos de texto con puntaje BM25 (k1, b).
+
+    Cada fragmento lleva su 'origen' (ej: 'correo', 'resumen', 'bbdd') y un 'titulo'
+    para citarlo. Es pensado para armarse por consulta sobre unos cientos de
+    fragmentos ya preseleccionados, así que no se persiste.
+    """
+
+    def __init__(self, k1=1.5, b=0.75, max_chars_fragmento=1200):
+        self.k1 = k1
+        self.b = b
+        self.max_chars_fragmento = max_chars_fragmento
+        self.fragmentos = []  # {"origen", "titulo", "texto"}
+        self._frecuencias = []  # Counter de términos por fragmento
+        self._largos = []
+        self._documentos_por_termino = Counter()
+        self._vistos = set()
+
+    def agregar(self, texto, origen, titulo=""):
+        """Agrega el texto partido en fragmentos. Los textos repetidos se ignoran."""
+        texto = (texto or '').strip()
+        if not texto or texto in self._vistos:
+            return
+        self._vistos.add(texto)
+        for fragmento in dividir_fragmentos(texto, self.max_chars_fragmento):
+            terminos = Counter(tokenizar(f"{titulo} {fragmento}"))
+            if not terminos:
+                continue
+            self.fragmentos.append({"origen": origen, "titulo": titulo, "texto": fragmento})
+            self._frecuencias.append(terminos)
+            self._largos.append(sum(terminos.values()))
+            self._documentos_por_termino.update(terminos.keys())
+
+    def buscar(self, consulta, k=8):
+        """Los 'k' fragmentos con mayor puntaje para la consulta: [(puntaje, fragmento), ...]. Sin coincidencias, []."""
+        terminos = set(tokenizar(consulta))
+        total = len(self.fragmentos)
+        if not terminos or not total:
+            return []
+        largo_medio = sum(self._largos) / total
+        idf = {
+            t: math.log(1 + (total - self._documentos_por_termino[t] + 0.5) / (self._documentos_por_termino[t] + 0.5))
+            for t in terminos if self._documentos_por_termino[t]
+        }
+        puntajes = []
+        for i, frecuencias in enumerate(self._frecuencias):
+            normalizacion = self.k1 * (1 - self.b + self.b * self._largos[i] / largo_medio)
+            puntaje = sum(
+                peso * frecuencias[t] * (self.k1 + 1) / (frecuencias[t] + normalizacion)
+                for t, peso in idf.items() if t in frecuencias
+            )
+            if puntaje > 0:
+                puntajes.append((puntaje, i))
+        puntajes.sort(key=lambda p: (-p[0], p[1]))
+        return [(puntaje, self.fragmentos[i]) for puntaje, i in puntajes[:k]]
+
+def seleccionar_dentro_de_presupuesto(resultados, presupuesto_tokens, estimar_tokens):
+    """Toma los fragmentos en orden de puntaje mientras entren en el presupuesto de tokens."""
+    elegidos = []
+    usados = 0
+    for puntaje, fragmento in resultados:
+        tokens = estimar_tokens(fragmento["titulo"]) + estimar_tokens(fragmento["texto"])
+        if usados + tokens > presupuesto_tokens:
+            continue
+        elegidos.append((puntaje, fragmento))
+        usados += tokens
+    return elegidos
+
+def describir_datos_analisis(datos, titulo="", profundidad=0):
+    """
+    Convierte el JSON de un análisis (ej: la respuesta de /api/analizar_bbdd que
+    guarda el frontend) en líneas de texto indexables: las series 'labels'/'data'
+    se escriben como 'etiqueta: valor'.
+    """
+    if profundidad > 4:
+        return []
+    if isinstance(datos, dict):
+        nombre = datos.get('titulo') or titulo
+        if isinstance(datos.get('labels'), list) and isinstance(datos.get('data'), list):
+            pares = ", ".join(f"{etiqueta}: {valor}" for etiqueta, valor in zip(datos['labels'], datos['data']))
+            return [f"{nombre}: {pares}"]
+        if isinstance(datos.get('datasets'), list):
+            # Barras agrupadas: {"families": [...], "datasets": [{"label", "data"}, ...]}
+            categorias = next((v for c, v in datos.items() if c != 'datasets' and isinstance(v, list)), [])
+            return [
+                f"{nombre} {serie.get('label', '')}: " + ", ".join(f"{c}: {v}" for c, v in zip(categorias, serie.get('data', [])))
+                for serie in datos['datasets'] if isinstance(serie, dict)
+            ]
+        lineas = []
+        for clave, valor in datos.items():
+            if clave in ('backgroundColor', 'borderColor', 'borderWidth', 'tipo', 'snapshot'):
+                continue
+            subtitulo = f"{titulo} {clave}".strip() if not isinstance(valor, (dict, list)) else clave
+            if isinstance(valor, (dict, list)):
+                lineas.extend(describir_datos_analisis(valor, subtitulo, profundidad + 1))
+            elif valor not in (None, ''):
+                lineas.append(f"{subtitulo}: {valor}")
+        return lineas
+    if isinstance(datos, list):
+        if datos and all(not isinstance(v, (dict, list)) for v in datos):
+            return [f"{titulo}: {', '.join(str(v) for v in datos[:50])}"]
+        lineas = []
+        for valor in datos[:50]:
+            lineas.extend(describir_datos_analisis(valor, titulo, profundidad + 1))
+        return lineas
+    return [f"{titulo}: {datos}"] if titulo else [str(datos)]
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from agregacion import agregar_filas, indices_columnas
+
+# Formatos de fecha que se prueban en orden si no se indica uno (se usa solo la parte de la fecha)
+FORMATOS_FECHA = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d/%m/%y')
+
+GRANULARIDADES = ('dia', 'semana')
+
+def parsear_fecha(texto, formato=None):
+    """Devuelve la fecha (date) de una celda o None si no se reconoce."""
+    parte = texto.strip().split(' ')[0].split('T')[0]
+    if not parte:
+        return None
+    for formato_fecha in ((formato,) if formato else FORMATOS_FECHA):
+        try:
+            return datetime.strptime(parte, formato_fecha).date()
+        except ValueError:
+            continue
+    return None
+
+def _hash_filas(filas, hash_previo=None):
+    """sha256 acumulado de las filas (se puede seguir actualizando con las siguientes)."""
+    acumulado = hash_previo or hashlib.sha256()
+    for fila in filas:
+        acumulado.update(json.dumps(list(fila), ensure_ascii=False, default=str).encode('utf-8'))
+        acumulado.update(b'\n')
+    return acumulado
+
+def _buckets(fecha):
+    """{granularidad: etiqueta}: el día, y la semana identificada por su lunes."""
+    return {
+        'dia': fecha.isoformat(),
+        'semana': (fecha - timedelta(days=fecha.weekday())).isoformat()
+    }
+
+class RollupsFallas:
+    """
+    Tablas materializadas de conteos de fallas por (bucket de tiempo, valor de dimensión).
+
+    Se alimentan con la copia de la hoja (ver CacheHojas). Si la hoja solo creció
+    al final (mismos encabezados y las filas ya procesadas tienen el mismo hash) se
+    agregan únicamente las filas nuevas; si no, se reconstruyen. La versión de Drive
+    cambia con cualquier edición, así que no alcanza para distinguir un agregado.
+    Las consultas leen solo de las tablas, nunca de las filas.
+
+    - dimensiones: {nombre: (columna, texto_para_vacios)} ej: {"family": ("Family", "Sin Familia")}
+    """
+
+    def __init__(self, dimensiones, columna_fecha, formato_fecha=None):
+        self.dimensiones = dimensiones
+        self.columna_fecha = columna_fecha
+        self.formato_fecha = formato_fecha
+        self._lock = threading.Lock()
+        self._reiniciar(None)
+
+    def _reiniciar(self, encabezados):
+        self._encabezados = encabezados
+        self._tablas = {g: {d: Counter() for d in self.dimensiones} for g in GRANULARIDADES}
+        self._totales = {g: Counter() for g in GRANULARIDADES}
+        self._sin_fecha = 0
+        self._filas = 0
+        self._hash_procesadas = hashlib.sha256().hexdigest()
+        self._version = None
+        self._fechas = {}
+
+    def actualizar(self, valores, version):
+        """
+        Incorpora la copia actual de la hoja (encabezados en la primera fila).
+        Devuelve {"modo": "sin_cambios" | "incremental" | "completo", "filas_nuevas": n}.
+        """
+        with self._lock:
+            if version is not None and version == self._version:
+                return {"modo": "sin_cambios", "filas_nuevas": 0}
+            encabezados = valores[0] if valores else []
+            filas = valores[1:]
+
+            # Una fila editada en el medio junto con filas agregadas cambia el hash del prefijo
+            hash_prefijo = None
+            if self._encabezados == encabezados and len(filas) >= self._filas:
+                hash_prefijo = _hash_filas(filas[:self._filas])
+            if hash_prefijo is not None and hash_prefijo.hexdigest() == self._hash_procesadas:
+                modo = "incremental" if self._filas else "completo"
+                nuevas = filas[self._filas:]
+            else:
+                self._reiniciar(encabezados)
+                modo, nuevas, hash_prefijo = "completo", filas, None
+
+            self._agregar(encabezados, nuevas)
+            self._filas = len(filas)
+            self._hash_procesadas = _hash_filas(nuevas, hash_prefijo).hexdigest()
+            self._version = version
+            print(f"Rollups de fallas: actualización {modo}, {len(nuevas)} filas nuevas (versión {version}).")
+            return {"modo": modo, "filas_nuevas": len(nuevas)}
+
+    def _bucket_fecha(self, texto):
+        # Las fechas se repiten mucho: cada texto distinto se convierte una sola vez
+        if texto not in self._fechas:
+            fecha = parsear_fecha(texto, self.formato_fecha) if texto else None
+            self._fechas[texto] = _buckets(fecha) if fecha else None
+        return self._fechas[texto]
+
+    def _agregar(self, encabezados, filas):
+        nombres = [self.columna_fecha] + [columna for columna, _ in self.dimensiones.values()]
+        indices = indices_columnas(encabezados, nombres)
+        if self.columna_fecha not in indices or not filas:
+            self._sin_fecha += len(filas)
+            return
+        indice_fecha = indices[self.columna_fecha]
+
+        agrupaciones = {"_total": (indice_fecha,)}
+        valores_vacios = {}
+        for dimension, (columna, vacio) in self.dimensiones.items():
+            if columna in indices:
+                agrupaciones[dimension] = (indice_fecha, indices[columna])
+                valores_vacios[indices[columna]] = vacio
+        conteos = agregar_filas(filas, agrupaciones, valores_vacios)
+
+        for (texto_fecha,), cantidad in conteos.pop("_total").items():
+            buckets = self._bucket_fecha(texto_fecha)
+            if buckets is None:
+                self._sin_fecha += cantidad
+                continue
+            for granularidad, bucket in buckets.items():
+                self._totales[granularidad][bucket] += cantidad
+        for dimension, contador in conteos.items():
+            for (texto_fecha, valor), cantidad in contador.items():
+                buckets = self._bucket_fecha(texto_fecha)
+                if buckets is None:
+                    continue
+                for granularidad, bucket in buckets.items():
+                    self._tablas[granularidad][dimension][(bucket, valor)] += cantidad
+
+    def consultar(self, granularidad, dimension, top=5, desde=None, hasta=None):
+        """
+        Serie temporal de la dimensión: los 'top' valores con más fallas en el período,
+        con un conteo por bucket. 'desde'/'hasta' son fechas ISO (YYYY-MM-DD) inclusivas.
+        """
+        with self._lock:
+            totales = {
+                bucket: cantidad for bucket, cantidad in self._totales[granularidad].items()
+                if (not desde or bucket >= desde) and (not hasta or bucket <= hasta)
+            }
+            buckets = sorted(totales)
+            posicion = {bucket: i for i, bucket in enumerate(buckets)}
+
+            series = {}
+            por_valor = Counter()
+            for (bucket, valor), cantidad in self._tablas[granularidad][dimension].items():
+                if bucket in posicion:
+                    series.setdefault(valor, [0] * len(buckets))[posicion[bucket]] += cantidad
+                    por_valor[valor] += cantidad
+
+            return {
+                "granularidad": granularidad,
+                "dimension": dimension,
+                "labels": buckets,
+                "total": [totales[bucket] for bucket in buckets],
+                "series": [
+                    {"label": valor, "data": series[valor], "total": cantidad}
+                    for valor, cantidad in por_valor.most_common(top)
+                ]
+            }
+
+    def estado(self):
+        with self._lock:
+            return {
+                "version": self._version,
+                "filas": self._filas,
+                "sin_fecha": self._sin_fecha,
+                "buckets": {g: len(self._totales[g]) for g in GRANULARIDADES}
+            }
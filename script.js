@@ -68,6 +68,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
             if (data.response) {
                 addMessageToChat('assistant', data.response);
+                // El servidor usa los últimos turnos para entender preguntas de seguimiento
+                chatContext.conversationHistory.push(
+                    { role: 'user', content: message },
+                    { role: 'assistant', content: data.response }
+                );
+                chatContext.conversationHistory = chatContext.conversationHistory.slice(-12);
             }
 
         } catch (error) {
@@ -164,8 +170,16 @@ document.addEventListener('DOMContentLoaded', () => {
         estadoDiv.textContent = 'Generando reporte...';
         estadoDiv.className = 'loading';
 
+        const parametros = `asunto=${encodeURIComponent(asunto)}&fecha_desde=${encodeURIComponent(fechaDesde)}&fecha_hasta=${encodeURIComponent(fechaHasta)}`;
+
+        // Con Server-Sent Events se muestra el progreso y el resumen a medida que se genera
+        if (window.EventSource) {
+            buscarCorreosStream(parametros);
+            return;
+        }
+
         try {
-            const response = await fetch(`http://127.0.0.1:5000/api/buscar_correos?asunto=${encodeURIComponent(asunto)}&fecha_desde=${encodeURIComponent(fechaDesde)}&fecha_hasta=${encodeURIComponent(fechaHasta)}`);
+            const response = await fetch(`http://127.0.0.1:5000/api/buscar_correos?${parametros}`);
             
             const data = await response.json();
             
@@ -173,30 +187,95 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(data.error || `Error del servidor: ${response.status}`);
             }
 
-            // Mostrar el resultado
-            if (data.resumen_consolidado) {
-                estadoDiv.innerHTML = `
-                    <div class="success">
-                        <h3>Reporte Generado Exitosamente</h3>
-                        <p><strong>Total de correos analizados:</strong> ${data.total_correos || 0}</p>
-                        <div class="resumen-content">
-                            ${data.resumen_consolidado.replace(/\n/g, '<br>')}
-                        </div>
-                    </div>
-                `;
-                estadoDiv.className = 'success';
-            } else if (data.mensaje_general) {
-                estadoDiv.textContent = data.mensaje_general;
-                estadoDiv.className = 'warning';
-            } else {
-                estadoDiv.textContent = 'No se pudo generar el reporte.';
-                estadoDiv.className = 'error';
-            }
+            mostrarResultadoBusqueda(data);
         } catch (error) {
             console.error('Error completo:', error);
             estadoDiv.textContent = `Error: ${error.message}`;
             estadoDiv.className = 'error';
         }
     });
+
+    // Búsqueda con progreso: /api/buscar_correos/stream emite eventos 'uids', 'descarga',
+    // 'resumen', 'token' (fragmentos del resumen) y finalmente 'resultado' o 'error'
+    function buscarCorreosStream(parametros) {
+        const fuente = new EventSource(`http://127.0.0.1:5000/api/buscar_correos/stream?${parametros}`);
+        let resumenParcial = '';
+        let terminado = false;
+
+        fuente.addEventListener('uids', (event) => {
+            const datos = JSON.parse(event.data);
+            estadoDiv.textContent = `Se encontraron ${datos.encontrados} correos. Descargando...`;
+        });
+
+        fuente.addEventListener('descarga', (event) => {
+            const datos = JSON.parse(event.data);
+            estadoDiv.textContent = `Correos obtenidos: ${datos.descargados} de ${datos.total}...`;
+        });
+
+        fuente.addEventListener('resumen', (event) => {
+            const datos = JSON.parse(event.data);
+            estadoDiv.textContent = `Generando resumen de ${datos.correos} correos...`;
+        });
+
+        fuente.addEventListener('token', (event) => {
+            const datos = JSON.parse(event.data);
+            resumenParcial += datos.texto;
+            estadoDiv.innerHTML = `
+                <div class="resumen-content">
+                    ${resumenParcial.replace(/\n/g, '<br>')}
+                </div>
+            `;
+            estadoDiv.className = 'loading';
+        });
+
+        fuente.addEventListener('resultado', (event) => {
+            terminado = true;
+            fuente.close();
+            mostrarResultadoBusqueda(JSON.parse(event.data));
+        });
+
+        fuente.addEventListener('error', (event) => {
+            terminado = true;
+            fuente.close();
+            let mensaje = 'Se perdió la conexión con el servidor.';
+            if (event.data) {
+                mensaje = JSON.parse(event.data).error || mensaje;
+            }
+            console.error('Error en la búsqueda:', mensaje);
+            estadoDiv.textContent = `Error: ${mensaje}`;
+            estadoDiv.className = 'error';
+        });
+
+        // Errores de conexión (sin evento 'error' del servidor)
+        fuente.onerror = () => {
+            if (!terminado) {
+                fuente.close();
+                estadoDiv.textContent = 'Error: Se perdió la conexión con el servidor.';
+                estadoDiv.className = 'error';
+            }
+        };
+    }
+
+    function mostrarResultadoBusqueda(data) {
+        // Mostrar el resultado
+        if (data.resumen_consolidado) {
+            estadoDiv.innerHTML = `
+                <div class="success">
+                    <h3>Reporte Generado Exitosamente</h3>
+                    <p><strong>Total de correos analizados:</strong> ${data.total_correos || 0}</p>
+                    <div class="resumen-content">
+                        ${data.resumen_consolidado.replace(/\n/g, '<br>')}
+                    </div>
+                </div>
+            `;
+            estadoDiv.className = 'success';
+        } else if (data.mensaje_general) {
+            estadoDiv.textContent = data.mensaje_general;
+            estadoDiv.className = 'warning';
+        } else {
+            estadoDiv.textContent = 'No se pudo generar el reporte.';
+            estadoDiv.className = 'error';
+        }
+    }
 });
 
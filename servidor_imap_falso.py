@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Servidor IMAP mínimo en proceso, para pruebas y benchmarks sin red."""
+import email
+import re
+import socketserver
+import threading
+import time
+from email.parser import BytesHeaderParser
+from email.utils import parsedate_to_datetime
+from datetime import datetime
+
+def _quote(valor):
+    if valor is None:
+        return "NIL"
+    valor = str(valor).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{valor}"'
+
+def _bodystructure(parte):
+    if parte.is_multipart():
+        hijos = "".join(_bodystructure(p) for p in parte.get_payload())
+        return f"({hijos} {_quote(parte.get_content_subtype().upper())})"
+    maintype = parte.get_content_maintype().upper()
+    subtype = parte.get_content_subtype().upper()
+    params = parte.get_params() or []
+    pares = [f"{_quote(k.upper())} {_quote(v)}" for k, v in params[1:]]
+    params_str = f"({' '.join(pares)})" if pares else "NIL"
+    payload = parte.get_payload()
+    if isinstance(payload, list):
+        payload = ""
+    cuerpo = payload.encode('utf-8', errors='replace') if isinstance(payload, str) else payload
+    encoding = (parte.get('Content-Transfer-Encoding') or '7BIT').upper()
+    base = f"{_quote(maintype)} {_quote(subtype)} {params_str} NIL NIL {_quote(encoding)} {len(cuerpo)}"
+    if maintype == 'TEXT':
+        lineas = cuerpo.count(b"\n") + 1
+        base += f" {lineas}"
+    return f"({base})"
+
+class Buzon:
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.mensajes = {}  # uid -> bytes
+        self.uidnext = 1
+        self._encabezados = {}
+
+    def agregar(self, raw):
+        uid = self.uidnext
+        self.mensajes[uid] = raw
+        self.uidnext += 1
+        return uid
+
+    def encabezados(self, uid):
+        """Encabezados parseados del mensaje (se guardan para no reparsear en cada SEARCH)."""
+        if uid not in self._encabezados:
+            self._encabezados[uid] = BytesHeaderParser().parsebytes(self.mensajes[uid])
+        return self._encabezados[uid]
+
+class EstadoServidor:
+    """
+    Buzones y contadores del servidor. 'latencia' son los segundos que se demora
+    cada comando, para simular la ida y vuelta a un servidor remoto.
+    """
+
+    def __init__(self, latencia=0.0):
+        self.buzones = {'INBOX': Buzon()}
+        self.round_trips = 0
+        self.latencia = latencia
+        self.lock = threading.Lock()
+
+def _parsear_set(set_str, uids_existentes):
+    maximo = max(uids_existentes) if uids_existentes else 0
+    resultado = set()
+    for parte in set_str.split(','):
+        if ':' in parte:
+            a, b = parte.split(':')
+            a = maximo if a == '*' else int(a)
+            b = maximo if b == '*' else int(b)
+            lo, hi = min(a, b), max(a, b)
+            resultado.update(u for u in uids_existentes if lo <= u <= hi)
+        else:
+            u = maximo if parte == '*' else int(parte)
+            if u in uids_existentes:
+                resultado.add(u)
+    return sorted(resultado)
+
+def _tokens(texto):
+    return re.findall(r'"(?:[^"\\]|\\.)*"|\(|\)|[^\s()]+', texto)
+
+class Manejador(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.buzon = None
+
+    def enviar(self, linea):
+        if isinstance(linea, str):
+            linea = linea.encode('utf-8')
+        self.wfile.write(linea + b"\r\n")
+
+    def handle(self):
+        self.enviar("* OK servidor IMAP falso listo")
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            linea = linea.decode('utf-8', errors='replace').rstrip('\r\n')
+            if not linea:
+                continue
+            tag, _, resto = linea.partition(' ')
+            comando, _, args = resto.partition(' ')
+            comando = comando.upper()
+            with self.server.estado.lock:
+                self.server.estado.round_trips += 1
+            if self.server.estado.latencia:
+                time.sleep(self.server.estado.latencia)
+            try:
+                if not self.despachar(tag, comando, args):
+                    return
+            except Exception as e:
+                # Un error del servidor falso se informa al cliente en lugar de cortar la sesión
+                self.enviar(f"{tag} BAD {e}")
+
+    def despachar(self, tag, comando, args):
+        estado = self.server.estado
+        if comando == 'CAPABILITY':
+            self.enviar("* CAPABILITY IMAP4rev1 UIDPLUS UNSELECT")
+        elif comando == 'LOGIN':
+            pass
+        elif comando == 'NOOP':
+            pass
+        elif comando == 'LOGOUT':
+            self.enviar("* BYE")
+            self.enviar(f"{tag} OK LOGOUT completado")
+            return False
+        elif comando in ('SELECT', 'EXAMINE'):
+            nombre = args.strip().strip('"')
+            nombre = 'INBOX' if nombre.upper() == 'INBOX' else nombre
+            if nombre not in estado.buzones:
+                self.enviar(f"{tag} NO no existe")
+                return True
+            self.buzon = estado.buzones[nombre]
+            self.enviar(f"* {len(self.buzon.mensajes)} EXISTS")
+            self.enviar(f"* OK [UIDVALIDITY {self.buzon.uidvalidity}] UIDs válidos")
+            self.enviar(f"* OK [UIDNEXT {self.buzon.uidnext}] siguiente UID")
+        elif comando == 'STATUS':
+            m = re.match(r'("(?:[^"\\]|\\.)*"|\S+)\s+\((.*)\)', args)
+            nombre = m.group(1).strip('"')
+            nombre = 'INBOX' if nombre.upper() == 'INBOX' else nombre
+            buzon = estado.buzones.get(nombre)
+            if buzon is None:
+                self.enviar(f"{tag} NO no existe")
+                return True
+            self.enviar(f'* STATUS {_quote(nombre)} (MESSAGES {len(buzon.mensajes)} UIDNEXT {buzon.uidnext} UIDVALIDITY {buzon.uidvalidity})')
+        elif comando in ('CLOSE', 'UNSELECT'):
+            self.buzon = None
+        elif comando == 'UID':
+            sub, _, sub_args = args.partition(' ')
+            sub = sub.upper()
+            if sub == 'SEARCH':
+                self.enviar("* SEARCH " + " ".join(str(u) for u in self.buscar(sub_args)))
+            elif sub == 'FETCH':
+                self.fetch(sub_args)
+        else:
+            self.enviar(f"{tag} BAD comando desconocido")
+            return True
+        self.enviar(f"{tag} OK {comando} completado")
+        return True
+
+    def buscar(self, criterios):
+        uids = sorted(self.buzon.mensajes)
+        tokens = _tokens(criterios)
+        resultado = []
+        for uid in uids:
+            msg = None
+            ok = True
+            i = 0
+            while i < len(tokens):
+                t = tokens[i].upper()
+                if t in ('(', ')', 'CHARSET', 'UTF-8', 'ALL'):
+                    i += 1
+                    continue
+                if msg is None:
+                    msg = self.buzon.encabezados(uid)
+                if t == 'SUBJECT':
+                    valor = tokens[i + 1].strip('"').lower()
+                    ok &= valor in str(msg.get('Subject', '')).lower()
+                    i += 2
+                elif t in ('SINCE', 'BEFORE'):
+                    valor = datetime.strptime(tokens[i + 1].strip('"'), '%d-%b-%Y').date()
+                    fecha = parsedate_to_datetime(msg['Date']).date()
+                    ok &= fecha >= valor if t == 'SINCE' else fecha < valor
+                    i += 2
+                elif t == 'HEADER':
+                    campo, valor = tokens[i + 1].strip('"'), tokens[i + 2].strip('"')
+                    ok &= valor in str(msg.get(campo, ''))
+                    i += 3
+                elif t == 'UID':
+                    ok &= uid in _parsear_set(tokens[i + 1], uids)
+                    i += 2
+                else:
+                    i += 1
+            if ok:
+                resultado.append(uid)
+        return resultado
+
+    def fetch(self, args):
+        set_str, _, items = args.partition(' ')
+        uids = _parsear_set(set_str, sorted(self.buzon.mensajes))
+        items = items.strip()
+        if items.startswith('(') and items.endswith(')'):
+            items = items[1:-1]
+        pedidos = re.findall(r'BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+\.\d+>)?|\S+', items, re.IGNORECASE)
+        for seq, uid in enumerate(uids, 1):
+            raw = self.buzon.mensajes[uid]
+            msg = email.message_from_bytes(raw)
+            partes_texto = [f"UID {uid}"]
+            literales = []
+            for pedido in pedidos:
+                p = pedido.upper()
+                if p == 'UID':
+                    continue
+                if p in ('RFC822', 'BODY[]', 'BODY.PEEK[]'):
+                    nombre = 'RFC822' if p == 'RFC822' else 'BODY[]'
+                    literales.append((nombre, raw))
+                elif p == 'RFC822.SIZE':
+                    partes_texto.append(f"RFC822.SIZE {len(raw)}")
+                elif p == 'BODYSTRUCTURE':
+                    partes_texto.append(f"BODYSTRUCTURE {_bodystructure(msg)}")
+                elif p.startswith('BODY'):
+                    m = re.match(r'BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?', pedido, re.IGNORECASE)
+                    seccion, inicio, largo = m.group(1), m.group(2), m.group(3)
+                    datos = self.seccion(msg, raw, seccion)
+                    nombre = f"BODY[{seccion}]"
+                    if inicio is not None:
+                        datos = datos[int(inicio):int(inicio) + int(largo)]
+                        nombre += f"<{inicio}>"
+                    literales.append((nombre, datos))
+            cabecera = f"* {seq} FETCH (" + " ".join(partes_texto)
+            if not literales:
+                self.enviar(cabecera + ")")
+                continue
+            for j, (nombre, datos) in enumerate(literales):
+                prefijo = cabecera + " " if j == 0 else " "
+                self.wfile.write(f"{prefijo}{nombre} {{{len(datos)}}}\r\n".encode('utf-8'))
+                self.wfile.write(datos)
+            self.enviar(")")
+
+    def seccion(self, msg, raw, seccion):
+        if seccion.upper().startswith('HEADER.FIELDS'):
+            campos = re.search(r'\((.*)\)', seccion).group(1).split()
+            lineas = []
+            for campo in campos:
+                for valor in msg.get_all(campo, []):
+                    lineas.append(f"{campo.title()}: {valor}")
+            return ("\r\n".join(lineas) + "\r\n\r\n").encode('utf-8')
+        if seccion.upper() == 'HEADER':
+            return raw.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n"
+        parte = msg
+        for numero in seccion.split('.'):
+            if parte.is_multipart():
+                parte = parte.get_payload()[int(numero) - 1]
+            elif numero != '1':
+                return b""
+        payload = parte.get_payload()
+        return payload.encode('utf-8', errors='replace') if isinstance(payload, str) else b""
+
+class ServidorIMAPFalso(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Servidor IMAP en un hilo del mismo proceso, sin SSL ni autenticación real.
+    Implementa lo que usa la aplicación: SELECT/EXAMINE, STATUS, UID SEARCH
+    (SUBJECT, SINCE, BEFORE, HEADER, UID) y UID FETCH (RFC822, BODY[...] con
+    rangos parciales, BODYSTRUCTURE). Uso:
+
+        servidor = ServidorIMAPFalso(latencia=0.02).iniciar()
+        servidor.estado.buzones['INBOX'].agregar(bytes_del_correo)
+        ... imaplib.IMAP4('127.0.0.1', servidor.puerto) ...
+        servidor.detener()
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', puerto=0, latencia=0.0):
+        super().__init__((host, puerto), Manejador)
+        self.estado = EstadoServidor(latencia)
+        self.hilo = None
+
+    @property
+    def puerto(self):
+        return self.server_address[1]
+
+    def iniciar(self):
+        self.hilo = threading.Thread(target=self.serve_forever, daemon=True)
+        self.hilo.start()
+        return self
+
+    def detener(self):
+        self.shutdown()
+        self.server_close()
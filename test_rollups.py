@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from rollups import RollupsFallas
+
+ENCABEZADOS = ["Date", "Family"]
+
+def _hoja(*familias):
+    return [ENCABEZADOS] + [["2024-01-01", familia] for familia in familias]
+
+class TestRollupsFallas(unittest.TestCase):
+
+    def setUp(self):
+        self.rollups = RollupsFallas({"family": ("Family", "Sin Familia")}, "Date")
+
+    def _conteos_dia(self):
+        return dict(self.rollups._tablas['dia']['family'])
+
+    def test_agregado_al_final_es_incremental(self):
+        self.rollups.actualizar(_hoja("A", "A", "A"), 1)
+        resultado = self.rollups.actualizar(_hoja("A", "A", "A", "C"), 2)
+        self.assertEqual(resultado, {"modo": "incremental", "filas_nuevas": 1})
+        self.assertEqual(self._conteos_dia(), {('2024-01-01', 'A'): 3, ('2024-01-01', 'C'): 1})
+
+    def test_edicion_en_el_medio_con_agregado_reconstruye(self):
+        self.rollups.actualizar(_hoja("A", "A", "A"), 1)
+        resultado = self.rollups.actualizar(_hoja("A", "B", "A", "C"), 2)
+        self.assertEqual(resultado, {"modo": "completo", "filas_nuevas": 4})
+        self.assertEqual(self._conteos_dia(), {
+            ('2024-01-01', 'A'): 2, ('2024-01-01', 'B'): 1, ('2024-01-01', 'C'): 1
+        })
+
+    def test_incremental_despues_de_reconstruir(self):
+        self.rollups.actualizar(_hoja("A", "A"), 1)
+        self.rollups.actualizar(_hoja("B", "A"), 2)
+        resultado = self.rollups.actualizar(_hoja("B", "A", "C"), 3)
+        self.assertEqual(resultado["modo"], "incremental")
+        self.assertEqual(self._conteos_dia(), {
+            ('2024-01-01', 'A'): 1, ('2024-01-01', 'B'): 1, ('2024-01-01', 'C'): 1
+        })
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import re
+from html.parser import HTMLParser
+
+# Etiquetas cuyo contenido no es texto del mensaje
+_ETIQUETAS_OMITIDAS = {'script', 'style', 'head', 'title'}
+# Etiquetas que cortan línea al abrir o cerrar
+_ETIQUETAS_BLOQUE = {
+    'p', 'div', 'br', 'tr', 'li', 'ul', 'ol', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'pre', 'hr', 'section', 'article', 'header', 'footer'
+}
+# Contenedores de citas de Gmail, Thunderbird, Yahoo y Outlook web
+_CLASES_CITA = ('gmail_quote', 'moz-cite-prefix', 'yahoo_quoted')
+_IDS_CITA = ('divrplyfwdmsg', 'appendonsend')
+
+class _ExtractorTexto(HTMLParser):
+    """Pasa HTML a texto plano, dejando afuera scripts, estilos y bloques citados."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.partes = []
+        self._omitir = 0  # anidamiento de la etiqueta omitida (o cita) en la que se está
+        self._etiqueta_omitida = None
+        self._cortado = False  # después del encabezado de respuesta de Outlook todo es historia
+
+    def handle_starttag(self, tag, attrs):
+        if self._cortado:
+            return
+        atributos = dict(attrs)
+        clases = (atributos.get('class') or '').lower()
+        identificador = (atributos.get('id') or '').lower()
+        if identificador in _IDS_CITA:
+            self._cortado = True
+            return
+        if self._omitir:
+            # Solo se cuenta la misma etiqueta: así no importan los <p> o <li> sin cerrar
+            if tag == self._etiqueta_omitida:
+                self._omitir += 1
+            return
+        if tag in _ETIQUETAS_OMITIDAS or tag == 'blockquote' or any(c in clases for c in _CLASES_CITA):
+            self._etiqueta_omitida = tag
+            self._omitir = 1
+            return
+        if tag in _ETIQUETAS_BLOQUE:
+            self.partes.append('\n')
+        if tag == 'li':
+            self.partes.append('- ')
+
+    def handle_endtag(self, tag):
+        if self._cortado:
+            return
+        if self._omitir:
+            if tag == self._etiqueta_omitida:
+                self._omitir -= 1
+            return
+        if tag in _ETIQUETAS_BLOQUE:
+            self.partes.append('\n')
+
+    def handle_data(self, data):
+        if not self._omitir and not self._cortado:
+            self.partes.append(data)
+
+def html_a_texto(html):
+    """Convierte el HTML de un correo en texto plano legible."""
+    extractor = _ExtractorTexto()
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except Exception as e:
+        # El HTML puede venir cortado (fetch parcial) o mal formado: se usa lo extraído hasta ahí
+        print(f"Error al convertir HTML a texto: {e}")
+    texto = ''.join(extractor.partes).replace('\xa0', ' ')
+    lineas = [re.sub(r'[ \t]+', ' ', linea).strip() for linea in texto.split('\n')]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lineas)).strip()
+
+# "On Mon, 1 Jan 2024 at 10:00, Ana <ana@x.com> wrote:" (a veces partido en dos líneas) y equivalentes
+_ENCABEZADO_RESPUESTA = re.compile(
+    r"^[ \t]*(On|El|Em|Le|Am)\b[^\n]{0,250}(\n[^\n]{0,250})?\b(wrote|escribió|escreveu|a écrit|schrieb)[ \t]*:[ \t]*$",
+    re.MULTILINE | re.IGNORECASE
+)
+_SEPARADOR_ORIGINAL = re.compile(
+    r"^[ \t]*(-{2,}[ \t]*(Original Message|Mensaje original|Mensagem original)[ \t]*-{2,}|_{10,})[ \t]*$",
+    re.MULTILINE | re.IGNORECASE
+)
+# Bloque de encabezados de Outlook: "From:/De:" seguido de "Sent:/Enviado:/Date:/Fecha:" en las líneas siguientes
+_ENCABEZADO_OUTLOOK = re.compile(
+    r"^[ \t]*\*?(From|De)\*?:[^\n]*\n([^\n]*\n){0,2}[ \t]*\*?(Sent|Enviado|Date|Fecha)\*?:",
+    re.MULTILINE | re.IGNORECASE
+)
+_REENVIO = re.compile(
+    r"^[ \t]*-+[ \t]*(Forwarded message|Mensaje reenviado|Mensagem encaminhada|Begin forwarded message)[ \t]*:?-*[ \t]*$",
+    re.MULTILINE | re.IGNORECASE
+)
+_FIRMA = re.compile(
+    r"^(-- ?|Enviado desde mi \w+.*|Sent from my \w+.*|Obtener Outlook para .*|Get Outlook for .*)[ \t]*$",
+    re.MULTILINE | re.IGNORECASE
+)
+
+def limpiar_cuerpo(texto):
+    """
+    Deja solo el contenido nuevo de un correo: corta el historial citado
+    (encabezados "On ... wrote:" / "El ... escribió:", bloques "De:/Enviado:" de
+    Outlook, separadores "Original Message"), quita las líneas que empiezan con '>'
+    y la firma. Un correo reenviado conserva el mensaje reenviado, que es contenido nuevo.
+    Si no queda nada (ej: el correo era solo una cita) devuelve el texto original.
+    """
+    if not texto:
+        return ""
+    texto = texto.replace('\r\n', '\n').replace('\r', '\n')
+    limpio = texto
+
+    reenvio = _REENVIO.search(limpio)
+    fin_busqueda = reenvio.start() if reenvio else len(limpio)
+    cortes = [m.start() for patron in (_ENCABEZADO_RESPUESTA, _SEPARADOR_ORIGINAL, _ENCABEZADO_OUTLOOK)
+              for m in [patron.search(limpio, 0, fin_busqueda)] if m]
+    if cortes:
+        limpio = limpio[:min(cortes)]
+
+    limpio = '\n'.join(linea for linea in limpio.split('\n') if not linea.lstrip().startswith('>'))
+
+    firma = _FIRMA.search(limpio)
+    if firma:
+        limpio = limpio[:firma.start()]
+
+    limpio = re.sub(r'\n{3,}', '\n\n', limpio).strip()
+    return limpio or texto.strip()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+class ColaLlena(Exception):
+    """Se lanza cuando la cola de trabajos alcanzó su capacidad máxima."""
+
+class GestorTrabajos:
+    """
+    Cola de trabajos en segundo plano, sin broker externo.
+
+    - Un pool fijo de hilos consume una cola acotada (max_en_cola).
+    - Si llega un trabajo con la misma clave que otro que todavía está en cola o
+      en proceso, se devuelve el existente en lugar de encolar uno nuevo.
+    - Los trabajos terminados se conservan 'ttl_resultados' segundos para consultarlos.
+    """
+
+    def __init__(self, max_workers=2, max_en_cola=20, ttl_resultados=3600):
+        self.max_workers = max_workers
+        self.ttl_resultados = ttl_resultados
+        self._cola = queue.Queue(maxsize=max_en_cola)
+        self._trabajos = {}
+        self._en_curso_por_clave = {}
+        self._lock = threading.Lock()
+        self._hilos = []
+
+    def enviar(self, clave, funcion):
+        """
+        Encola funcion(notificar) y devuelve (id_trabajo, duplicado).
+        'funcion' debe devolver (resultado, codigo_http); 'notificar(evento, datos)'
+        permite informar el progreso mientras se ejecuta.
+        """
+        with self._lock:
+            self._purgar_vencidos()
+            existente = self._en_curso_por_clave.get(clave)
+            if existente:
+                return existente, True
+
+            trabajo_id = uuid.uuid4().hex
+            trabajo = {
+                "id": trabajo_id,
+                "estado": "en_cola",
+                "creado": time.time(),
+                "iniciado": None,
+                "terminado": None,
+                "progreso": {},
+                "resultado": None,
+                "codigo": None
+            }
+            try:
+                self._cola.put_nowait((trabajo_id, clave, funcion))
+            except queue.Full:
+                raise ColaLlena("La cola de trabajos está llena, intenta nuevamente más tarde.")
+            self._trabajos[trabajo_id] = trabajo
+            self._en_curso_por_clave[clave] = trabajo_id
+            self._iniciar_workers()
+            return trabajo_id, False
+
+    def obtener(self, trabajo_id):
+        """Devuelve una copia del estado del trabajo, o None si no existe o ya venció."""
+        with self._lock:
+            self._purgar_vencidos()
+            trabajo = self._trabajos.get(trabajo_id)
+            if not trabajo:
+                return None
+            copia = dict(trabajo)
+            copia["progreso"] = dict(trabajo["progreso"])
+            if copia["estado"] == "en_cola":
+                copia["posicion_en_cola"] = self._posicion_en_cola(trabajo_id)
+            return copia
+
+    def _posicion_en_cola(self, trabajo_id):
+        """Posición del trabajo en la cola (1 = el próximo en ejecutarse); None si ya salió de ella."""
+        with self._cola.mutex:
+            for posicion, (id_en_cola, _, _) in enumerate(self._cola.queue, 1):
+                if id_en_cola == trabajo_id:
+                    return posicion
+        return None
+
+    def estado(self):
+        with self._lock:
+            self._purgar_vencidos()
+            por_estado = {}
+            for trabajo in self._trabajos.values():
+                por_estado[trabajo["estado"]] = por_estado.get(trabajo["estado"], 0) + 1
+            return {
+                "en_cola": self._cola.qsize(),
+                "max_en_cola": self._cola.maxsize,
+                "max_workers": self.max_workers,
+                "trabajos": por_estado
+            }
+
+    def _iniciar_workers(self):
+        # Se llama con el lock tomado
+        while len(self._hilos) < self.max_workers:
+            hilo = threading.Thread(target=self._worker, name=f"trabajos-{len(self._hilos)}", daemon=True)
+            self._hilos.append(hilo)
+            hilo.start()
+
+    def _worker(self):
+        while True:
+            trabajo_id, clave, funcion = self._cola.get()
+            with self._lock:
+                trabajo = self._trabajos.get(trabajo_id)
+                if trabajo:
+                    trabajo["estado"] = "en_proceso"
+                    trabajo["iniciado"] = time.time()
+
+            def notificar(evento, datos, trabajo=trabajo):
+                if trabajo is None or evento == 'token':
+                    return
+                with self._lock:
+                    trabajo["progreso"][evento] = datos
+
+            try:
+                resultado, codigo = funcion(notificar)
+                estado = "completado" if codigo < 400 else "error"
+            except Exception as e:
+                print(f"Error en el trabajo {trabajo_id}: {e}")
+                traceback.print_exc()
+                resultado, codigo, estado = {"error": f"Error interno del servidor: {str(e)}"}, 500, "error"
+
+            with self._lock:
+                if trabajo:
+                    trabajo.update(estado=estado, resultado=resultado, codigo=codigo, terminado=time.time())
+                if self._en_curso_por_clave.get(clave) == trabajo_id:
+                    del self._en_curso_por_clave[clave]
+            self._cola.task_done()
+
+    def _purgar_vencidos(self):
+        # Se llama con el lock tomado
+        ahora = time.time()
+        vencidos = [
+            trabajo_id for trabajo_id, trabajo in self._trabajos.items()
+            if trabajo["terminado"] and ahora - trabajo["terminado"] > self.ttl_resultados
+        ]
+        for trabajo_id in vencidos:
+            del self._trabajos[trabajo_id]